@@ -0,0 +1,50 @@
+# gunicorn reads this file from the working directory, command line flags override it.
+#
+# the app is loaded once in the master (preload_app) and the workers are forked from it, so
+# they share the model's memory copy-on-write: the memory-mapped vectors and indexes (see
+# S2V_MMAP_VECTORS and scripts/build_s2v_indexes.py) and every array derived from them at load.
+# the loaded python objects are moved out of the garbage collector's reach before forking,
+# otherwise a collection in a worker writes to (and so copies) every page holding them.
+#
+# the warmup (see S2vWarmup) runs before the app serves: with preload_app in the master as it
+# loads the app, before any worker is forked, so every worker (restarted ones too) inherits its
+# warm caches, otherwise in every worker as it loads the app. /readyz is only answered by warm
+# workers either way
+#
+# the workers write their metrics to S2V_METRICS_DIR (emptied at startup, or a temporary
+# directory removed on exit) for /metrics to answer for all of them, see S2vMetrics
+#
+# scale with GUNICORN_WORKERS (processes) and GUNICORN_THREADS (threads per process), the
+# extra memory per worker is reported by scripts/benchmark_worker_memory.py
+import gc
+import os
+import shutil
+import tempfile
+
+preload_app = bool(int(os.getenv('GUNICORN_PRELOAD', 1)))
+worker_class = 'gthread'
+workers = int(os.getenv('GUNICORN_WORKERS', 1))
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+os.environ['S2V_WARMUP_BEFORE_SERVING'] = '1'
+temporary_metrics_dir = not os.getenv('S2V_METRICS_DIR')
+if temporary_metrics_dir:
+  os.environ['S2V_METRICS_DIR'] = tempfile.mkdtemp(prefix='s2v-metrics-')
+# emptied here rather than in a server hook: with preload_app the app is loaded (and may record
+# metrics) before on_starting runs
+os.makedirs(os.environ['S2V_METRICS_DIR'], exist_ok=True)
+for filename in os.listdir(os.environ['S2V_METRICS_DIR']):
+  if filename.startswith('s2v_metrics_'):
+    os.remove(os.path.join(os.environ['S2V_METRICS_DIR'], filename))
+
+
+def when_ready(server):
+  gc.freeze()
+
+
+def pre_fork(server, worker):
+  gc.freeze()
+
+
+def on_exit(server):
+  if temporary_metrics_dir:
+    shutil.rmtree(os.environ['S2V_METRICS_DIR'], ignore_errors=True)
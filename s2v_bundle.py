@@ -0,0 +1,260 @@
+import os
+import tempfile
+import numpy as np
+from sense2vec import Sense2Vec
+from spacy.strings import get_string_id
+from spacy.vectors import Vectors
+from thinc.api import NumpyOps
+from s2v_util import S2vUtil, s2v_model_fingerprint
+from s2v_mmap import write_arrays, read_arrays
+from s2v_vectors import S2vVectors
+from s2v_caseless_index import S2vCaselessIndex, CASELESS_INDEX_FILENAME, CASELESS_INDEX_VERSION
+from s2v_key_table import S2vKeyTable, KEY_TABLE_FILENAME, KEY_TABLE_VERSION
+from s2v_partitions import S2vPartitions, PARTITIONS_FILENAME, PARTITIONS_VERSION
+from s2v_neighbour_table import S2vNeighbourTable, NEIGHBOUR_TABLE_FILENAME, NEIGHBOUR_TABLE_VERSION
+from s2v_quantized_vectors import S2vQuantizedVectors, QUANTIZED_VECTORS_FILENAME, QUANTIZED_VECTORS_VERSION
+
+BUNDLE_FILENAME = 'model.s2vbundle'
+BUNDLE_VERSION = 1
+
+# the index files of the model directory packed into the bundle, name: (file, version, constructor)
+BUNDLE_INDEXES = {
+  'caseless_index': (CASELESS_INDEX_FILENAME, CASELESS_INDEX_VERSION, S2vCaselessIndex),
+  'key_table': (KEY_TABLE_FILENAME, KEY_TABLE_VERSION, S2vKeyTable),
+  'partitions': (PARTITIONS_FILENAME, PARTITIONS_VERSION, lambda s2v, arrays, meta: S2vPartitions(arrays, meta)),
+  'neighbour_table': (NEIGHBOUR_TABLE_FILENAME, NEIGHBOUR_TABLE_VERSION, S2vNeighbourTable),
+  'quantized_vectors': (QUANTIZED_VECTORS_FILENAME, QUANTIZED_VECTORS_VERSION, lambda s2v, arrays, meta: S2vQuantizedVectors(arrays, meta)),
+}
+
+
+# the position of key in sorted uint64 keys, -1 when missing
+def sorted_find(sorted_keys, key):
+  try:
+    key = np.uint64(key)
+  except (OverflowError, TypeError, ValueError):
+    return -1
+  i = int(sorted_keys.searchsorted(key))
+  if i < len(sorted_keys) and sorted_keys[i] == key:
+    return i
+  return -1
+
+
+# read only uint64 -> int mapping over arrays sorted by key, looked up by binary search,
+# standing in for the key2row and freqs dicts. iterates in the given order (positions into
+# the sorted keys) so key2row keeps the order of the model's own key2row
+class S2vBundleMap:
+
+  def __init__(self, keys, values, order=None):
+    self.sorted_keys = keys
+    self.sorted_values = values
+    self.order = order
+
+
+  def get(self, key, default=None):
+    i = sorted_find(self.sorted_keys, key)
+    return default if i < 0 else int(self.sorted_values[i])
+
+
+  def __getitem__(self, key):
+    i = sorted_find(self.sorted_keys, key)
+    if i < 0:
+      raise KeyError(key)
+    return int(self.sorted_values[i])
+
+
+  def __contains__(self, key):
+    return sorted_find(self.sorted_keys, key) >= 0
+
+
+  def __len__(self):
+    return len(self.sorted_keys)
+
+
+  def keys(self):
+    return self.sorted_keys if self.order is None else self.sorted_keys[self.order]
+
+
+  def values(self):
+    return self.sorted_values if self.order is None else self.sorted_values[self.order]
+
+
+  def items(self):
+    return zip(self.keys().tolist(), self.values().tolist())
+
+
+  def __iter__(self):
+    return iter(self.keys().tolist())
+
+
+# read only stand in for the model's StringStore: strings are hashed the way StringStore
+# hashes them and hashes are looked up in the bundle's strings, sorted by hash. strings are
+# never added, add only returns the hash
+class S2vBundleStrings:
+
+  def __init__(self, hashes, blob, offsets):
+    self.hashes = hashes
+    self.blob = blob
+    self.offsets = offsets
+
+
+  def __getitem__(self, key):
+    if isinstance(key, str):
+      return get_string_id(key)
+    i = sorted_find(self.hashes, key)
+    if i < 0:
+      raise KeyError(key)
+    return bytes(self.blob[int(self.offsets[i]):int(self.offsets[i + 1])]).decode('utf-8')
+
+
+  def add(self, string):
+    return self[string]
+
+
+  def __contains__(self, key):
+    return sorted_find(self.hashes, get_string_id(key) if isinstance(key, str) else key) >= 0
+
+
+  def __len__(self):
+    return len(self.hashes)
+
+
+  def __iter__(self):
+    for i in range(len(self.hashes)):
+      yield bytes(self.blob[int(self.offsets[i]):int(self.offsets[i + 1])]).decode('utf-8')
+
+
+def sorted_map_arrays(keys, values, dtype):
+  keys = np.asarray(keys, dtype=np.uint64)
+  order = np.argsort(keys, kind='stable')
+  return keys[order], np.asarray(values, dtype=dtype)[order], order
+
+
+# the meta and arrays of the model directory's index file name when it is current, the caseless
+# index and key table (which every server needs) are built when it isn't, the others left out
+def packed_index(name, s2v, s2v_util, model_path, fingerprint):
+  filename, version, _ = BUNDLE_INDEXES[name]
+  path = os.path.join(model_path, filename) if model_path else None
+  if path and os.path.exists(path):
+    meta, arrays = read_arrays(path)
+    if meta.get('version') == version and meta.get('fingerprint') == fingerprint:
+      return meta, arrays
+    print('ignoring', path, 'built for a different model or version')
+  if name == 'caseless_index':
+    index = S2vCaselessIndex.build(s2v)
+  elif name == 'key_table':
+    index = S2vKeyTable.build(s2v_util)
+  else:
+    return None
+  with tempfile.TemporaryDirectory() as tmp_dir:
+    index.save(os.path.join(tmp_dir, filename))
+    return read_arrays(os.path.join(tmp_dir, filename), mmap=False)
+
+
+# the whole model in one versioned s2v mmap file (see s2v_mmap), opened without deserializing
+# anything: every array is memory-mapped and only paged in when used, so opening it takes
+# milliseconds however large the model is.
+#
+# * vectors: the unit normalised vectors table, with norms / nonzero (see S2vVectors), the
+#   model's raw vectors are vectors * norms
+# * key_hashes / key_rows / key_order: key2row sorted by key hash, key_order gives the
+#   model's own key2row order (so the model fingerprint is unchanged)
+# * string_hashes / strings_blob / string_offsets: the model's strings (utf-8) sorted by hash
+# * freq_hashes / freq_values: the key frequencies sorted by key hash
+# * cache.indices / cache.scores: the model's most_similar cache, when it has one
+# * <index>/<array>: the arrays of the model directory's index files (BUNDLE_INDEXES), with
+#   their meta in the header's indexes
+#
+# the model's s2v.similarity / s2v.most_similar of multiple keys average unit vectors, so
+# the same caveat as S2vVectors' normalize_in_place applies
+class S2vModelBundle:
+
+  def __init__(self, arrays, meta):
+    self.arrays = arrays
+    self.meta = meta
+    self.fingerprint = meta['fingerprint']
+    self.norms = arrays['norms']
+    self.nonzero = arrays['nonzero']
+    s2v = Sense2Vec(shape=(0, arrays['vectors'].shape[1]))
+    vectors = Vectors()
+    vectors.data = arrays['vectors']
+    vectors.key2row = S2vBundleMap(arrays['key_hashes'], arrays['key_rows'], arrays['key_order'])
+    vectors.to_ops(NumpyOps())
+    s2v.vectors = vectors
+    s2v.cfg.update(meta['cfg'])
+    s2v.strings = S2vBundleStrings(arrays['string_hashes'], arrays['strings_blob'], arrays['string_offsets'])
+    s2v.freqs = S2vBundleMap(arrays['freq_hashes'], arrays['freq_values'])
+    if 'cache.indices' in arrays:
+      s2v.cache = { 'indices': arrays['cache.indices'], 'scores': arrays['cache.scores'] }
+    self.s2v = s2v
+
+
+  @classmethod
+  def open(cls, path):
+    meta, arrays = read_arrays(path)
+    if meta.get('version') != BUNDLE_VERSION:
+      raise ValueError('model bundle {0} has version {1}, expected {2}'.format(path, meta.get('version'), BUNDLE_VERSION))
+    return cls(arrays, meta)
+
+
+  # packs a loaded model and the index files of its model directory into a bundle at path,
+  # building the caseless index and key table when the directory has no current ones
+  @classmethod
+  def pack(cls, s2v, path, model_path=None):
+    fingerprint = s2v_model_fingerprint(s2v)
+    s2v_vectors = S2vVectors(s2v)
+    key2row = s2v.vectors.key2row
+    key_hashes, key_rows, order = sorted_map_arrays(list(key2row.keys()), list(key2row.values()), np.int64)
+    key_order = np.empty(len(order), dtype=np.int64)
+    key_order[order] = np.arange(len(order))
+    strings = sorted(s2v.strings, key=lambda s: s2v.strings[s])
+    encoded_strings = [s.encode('utf-8') for s in strings]
+    string_offsets = np.zeros(len(strings) + 1, dtype=np.uint64)
+    string_offsets[1:] = np.cumsum([len(s) for s in encoded_strings])
+    # keys without a frequency are left out, get_freq then returns its default as before
+    freqs = [(k, f) for k, f in s2v.freqs.items() if f is not None]
+    freq_hashes, freq_values, _ = sorted_map_arrays([k for k, _ in freqs], [f for _, f in freqs], np.int64)
+    arrays = {
+      'vectors': s2v_vectors.unit,
+      'norms': s2v_vectors.norms,
+      'nonzero': s2v_vectors.nonzero,
+      'key_hashes': key_hashes,
+      'key_rows': key_rows,
+      'key_order': key_order,
+      'string_hashes': np.fromiter((s2v.strings[s] for s in strings), dtype=np.uint64, count=len(strings)),
+      'strings_blob': np.frombuffer(b''.join(encoded_strings), dtype=np.uint8),
+      'string_offsets': string_offsets,
+      'freq_hashes': freq_hashes,
+      'freq_values': freq_values,
+    }
+    if s2v.cache:
+      arrays['cache.indices'] = np.asarray(s2v.cache['indices'])
+      arrays['cache.scores'] = np.asarray(s2v.cache['scores'])
+    indexes = {}
+    s2v_util = S2vUtil(s2v)
+    for name in BUNDLE_INDEXES:
+      index = packed_index(name, s2v, s2v_util, model_path, fingerprint)
+      if index is not None:
+        indexes[name] = index[0]
+        arrays.update({ '{0}/{1}'.format(name, k): a for k, a in index[1].items() })
+    meta = {
+      'version': BUNDLE_VERSION,
+      'fingerprint': fingerprint,
+      'cfg': s2v.cfg,
+      'indexes': indexes,
+    }
+    write_arrays(path, arrays, meta)
+    return indexes
+
+
+  # the bundled index name (see BUNDLE_INDEXES), None when it wasn't packed or has an old version
+  def index(self, name):
+    meta = self.meta['indexes'].get(name)
+    if meta is None:
+      return None
+    _, version, constructor = BUNDLE_INDEXES[name]
+    if meta.get('version') != version:
+      print('ignoring bundled {0}: version {1}, expected {2}'.format(name, meta.get('version'), version))
+      return None
+    prefix = name + '/'
+    arrays = { k[len(prefix):]: a for k, a in self.arrays.items() if k.startswith(prefix) }
+    return constructor(self.s2v, arrays, meta)
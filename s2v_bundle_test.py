@@ -0,0 +1,63 @@
+import pytest
+import numpy as np
+from s2v_util import S2vUtil, s2v_model_fingerprint
+from s2v_vectors import S2vVectors
+from s2v_partitions import S2vPartitions, PARTITIONS_FILENAME
+from s2v_bundle import S2vModelBundle
+
+@pytest.fixture
+def s2v_mock():
+    from sense2vec import Sense2Vec
+    rng = np.random.default_rng(5)
+    s2v = Sense2Vec(shape=(40, 8))
+    for i, word in enumerate(['apple', 'Apple', 'pear', 'big', 'large', 'New_York', 'car', 'bus']):
+      for j, sense in enumerate(['NOUN', 'ADJ', 'PROPN']):
+        s2v.add('{0}|{1}'.format(word, sense), rng.standard_normal(8).astype(np.float32), freq=i * 10 + j)
+    s2v.add('unfrequent|NOUN', rng.standard_normal(8).astype(np.float32))
+    s2v.cache = { 'indices': rng.integers(0, 25, size=(25, 4)).astype(np.int32), 'scores': rng.random((25, 4)).astype(np.float32) }
+    return s2v
+
+
+@pytest.fixture
+def bundle(s2v_mock, tmp_path):
+    S2vPartitions.build(S2vUtil(s2v_mock)).save(str(tmp_path / PARTITIONS_FILENAME))
+    path = str(tmp_path / 'model.s2vbundle')
+    S2vModelBundle.pack(s2v_mock, path, str(tmp_path))
+    return S2vModelBundle.open(path)
+
+
+def test_bundle_holds_the_model(s2v_mock, bundle):
+    s2v = bundle.s2v
+    assert bundle.fingerprint == s2v_model_fingerprint(s2v_mock) == s2v_model_fingerprint(s2v)
+    assert list(s2v.keys()) == list(s2v_mock.keys())
+    assert len(s2v) == len(s2v_mock)
+    for key in list(s2v_mock.keys()) + ['missing|NOUN']:
+      assert (key in s2v) == (key in s2v_mock)
+      assert s2v.vectors.find(key=key) == s2v_mock.vectors.find(key=key)
+      assert s2v.get_freq(key) == s2v_mock.get_freq(key)
+      assert s2v.strings[key] == s2v_mock.strings[key]
+      if key in s2v_mock:
+        assert s2v.strings[s2v.strings[key]] == key
+        row = s2v.vectors.find(key=key)
+        assert np.allclose(s2v[key] * bundle.norms[row], s2v_mock[key], atol=1e-6)
+    assert s2v.cfg == s2v_mock.cfg
+    assert np.array_equal(s2v.cache['indices'], s2v_mock.cache['indices'])
+    assert np.array_equal(s2v.cache['scores'], s2v_mock.cache['scores'])
+    assert s2v.most_similar('apple|NOUN', n=3) == s2v_mock.most_similar('apple|NOUN', n=3)
+
+
+def test_bundle_holds_the_indexes(s2v_mock, bundle):
+    caseless_index = bundle.index('caseless_index')
+    assert caseless_index.get('new york') == [('New_York|NOUN', 'NOUN'), ('New_York|ADJ', 'ADJ'), ('New_York|PROPN', 'PROPN')]
+    key_table = bundle.index('key_table')
+    row = key_table.row('Apple|PROPN')
+    assert (key_table.word(row), key_table.sense(row), key_table.is_proper(row), key_table.freq(row)) == ('Apple', 'PROPN', True, 12)
+    assert bundle.index('partitions').ranges == S2vPartitions.build(S2vUtil(s2v_mock)).ranges
+    assert bundle.index('neighbour_table') is None
+
+
+def test_bundled_vectors_score_like_the_model(s2v_mock, bundle):
+    phrases = [[k] for k in s2v_mock.keys()] + [['big|ADJ', 'apple|NOUN'], ['large|ADJ', 'pear|NOUN']]
+    expected = S2vVectors(s2v_mock).similarity_matrix(phrases, phrases)
+    scores = S2vVectors(bundle.s2v, normalized=bundle).similarity_matrix(phrases, phrases)
+    assert np.allclose(scores, expected, atol=1e-6)
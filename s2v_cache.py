@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# thread safe LRU cache with an optional time to live (in seconds) per entry,
+# counting hits and misses. a maxsize of 0 disables the cache
+class S2vLruCache:
+
+  def __init__(self, maxsize=10000, ttl=None, clock=time.monotonic):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.clock = clock
+    self.entries = OrderedDict()
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.expirations = 0
+
+
+  # returns a (found, value) tuple
+  def lookup(self, key):
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is not None:
+        value, expires_at = entry
+        if expires_at is None or expires_at > self.clock():
+          self.entries.move_to_end(key)
+          self.hits += 1
+          return True, value
+        del self.entries[key]
+        self.expirations += 1
+      self.misses += 1
+      return False, None
+
+
+  def set(self, key, value):
+    if self.maxsize <= 0:
+      return
+    expires_at = None if not self.ttl else self.clock() + self.ttl
+    with self.lock:
+      self.entries[key] = (value, expires_at)
+      self.entries.move_to_end(key)
+      while len(self.entries) > self.maxsize:
+        self.entries.popitem(last=False)
+        self.evictions += 1
+
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+
+
+  def __len__(self):
+    return len(self.entries)
+
+
+  def stats(self):
+    with self.lock:
+      lookups = self.hits + self.misses
+      return {
+        'size': len(self.entries),
+        'maxsize': self.maxsize,
+        'hits': self.hits,
+        'misses': self.misses,
+        'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+        'evictions': self.evictions,
+        'expirations': self.expirations,
+      }
+
+
+def _immutable(self, *args, **kwargs):
+  raise TypeError('{0} is immutable'.format(type(self).__name__))
+
+
+# read only list / dict, still comparing equal to (and json encoding as) plain lists and
+# dicts, for cached values handed out to callers
+class FrozenList(list):
+  __setitem__ = __delitem__ = __iadd__ = __imul__ = _immutable
+  append = extend = insert = pop = remove = clear = sort = reverse = _immutable
+
+  def __hash__(self):
+    return hash(tuple(self))
+
+  def __copy__(self):
+    return self
+
+  def __deepcopy__(self, memo):
+    return self
+
+  def __reduce__(self):
+    return (FrozenList, (list(self),))
+
+
+class FrozenDict(dict):
+  __setitem__ = __delitem__ = __ior__ = _immutable
+  clear = pop = popitem = setdefault = update = _immutable
+
+  def __hash__(self):
+    return hash(tuple(sorted(self.items())))
+
+  def __copy__(self):
+    return self
+
+  def __deepcopy__(self, memo):
+    return self
+
+  def __reduce__(self):
+    return (FrozenDict, (dict(self),))
+
+
+def freeze(value):
+  if isinstance(value, (FrozenList, FrozenDict)):
+    return value
+  if isinstance(value, list):
+    return FrozenList(map(freeze, value))
+  if isinstance(value, dict):
+    return FrozenDict((k, freeze(v)) for k, v in value.items())
+  return value
@@ -0,0 +1,99 @@
+import pytest
+from s2v_cache import S2vLruCache
+
+class FakeClock:
+    def __init__(self):
+      self.now = 0.0
+
+    def __call__(self):
+      return self.now
+
+
+def test_evicts_least_recently_used_entries():
+    cache = S2vLruCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.lookup('a') == (True, 1)
+    cache.set('c', 3)
+    assert cache.lookup('b') == (False, None)
+    assert cache.lookup('a') == (True, 1)
+    assert cache.lookup('c') == (True, 3)
+    stats = cache.stats()
+    assert stats['size'] == 2
+    assert stats['evictions'] == 1
+    assert stats['hits'] == 3
+    assert stats['misses'] == 1
+    assert stats['hit_rate'] == 0.75
+
+
+def test_expires_entries_after_ttl():
+    clock = FakeClock()
+    cache = S2vLruCache(maxsize=10, ttl=5, clock=clock)
+    cache.set('a', 1)
+    clock.now = 4.9
+    assert cache.lookup('a') == (True, 1)
+    clock.now = 5.0
+    assert cache.lookup('a') == (False, None)
+    assert cache.stats()['expirations'] == 1
+    assert len(cache) == 0
+
+
+def test_zero_maxsize_disables_the_cache():
+    cache = S2vLruCache(maxsize=0)
+    cache.set('a', 1)
+    assert cache.lookup('a') == (False, None)
+
+
+@pytest.fixture
+def s2v_util():
+    from sense2vec import Sense2Vec
+    from s2v_util import S2vUtil
+    import numpy as np
+    s2v = Sense2Vec(shape=(6, 4))
+    s2v.add('New_York|GPE', np.asarray([1, 1, 1, 1], dtype=np.float32))
+    s2v.add('big|ADJ', np.asarray([2, 5, 4, 2], dtype=np.float32))
+    s2v.add('apple|NOUN', np.asarray([1, 3, 9, 3], dtype=np.float32))
+    s2v.add('pear|NOUN', np.asarray([1, 4, 8, 3], dtype=np.float32))
+    s2v.add('car|NOUN', np.asarray([9, 1, 1, 2], dtype=np.float32))
+    return S2vUtil(s2v)
+
+
+@pytest.fixture
+def s2v_key_variations(s2v_util):
+    from s2v_senses import S2vSenses
+    from s2v_key_case_and_sense_variations import S2vKeyCaseAndSenseVariations
+    return S2vKeyCaseAndSenseVariations(s2v_util, S2vSenses(s2v_util))
+
+
+def test_synonyms_results_are_cached_per_input_and_req_args(s2v_util, s2v_key_variations):
+    from s2v_key_commonizer import S2vKeyCommonizer
+    from s2v_synonyms import S2vSynonyms
+    from s2v_vectors import S2vVectors
+    from s2v_vector_search import S2vVectorSearch
+    cache = S2vLruCache()
+    synonyms_service = S2vSynonyms(
+      s2v_util,
+      s2v_key_variations,
+      S2vKeyCommonizer(),
+      s2v_vector_search=S2vVectorSearch(S2vVectors(s2v_util.s2v)),
+      allow_non_cached_keys=True,
+      result_cache=cache,
+    )
+    first = synonyms_service.call(['big|ADJ', 'apple|NOUN'], { 'n': 2 })
+    first[0]['word'] = 'mutated by the caller'
+    second = synonyms_service.call(['big|ADJ', 'apple|NOUN'], { 'n': 2 })
+    assert second[0]['word'] != 'mutated by the caller'
+    assert cache.stats()['hits'] == 1
+    synonyms_service.call(['big|ADJ', 'apple|NOUN'], { 'n': 3 })
+    assert cache.stats()['misses'] == 2
+
+
+def test_similarity_cache_key_is_order_insensitive(s2v_util, s2v_key_variations):
+    from s2v_key_commonizer import S2vKeyCommonizer
+    from s2v_similarity import S2vSimilarity
+    cache = S2vLruCache()
+    similarity_service = S2vSimilarity(s2v_util, s2v_key_variations, S2vKeyCommonizer(), result_cache=cache)
+    a = similarity_service.call(['New_York|GPE'], ['big|ADJ', 'apple|NOUN'])
+    b = similarity_service.call(['big|ADJ', 'apple|NOUN'], ['New_York|GPE'])
+    assert a == b
+    assert cache.stats()['hits'] == 1
@@ -0,0 +1,140 @@
+import os
+import numpy as np
+from s2v_util import s2v_model_fingerprint
+from s2v_mmap import write_arrays, read_arrays
+
+CASELESS_INDEX_FILENAME = 'caseless_index.s2vmmap'
+CASELESS_INDEX_VERSION = 1
+
+
+# caseless word -> keys index, stored as flat arrays so it can be persisted next to the
+# model and memory-mapped by every worker instead of being rebuilt as a python dict:
+#
+# * words_blob / word_offsets: the distinct lowercased words (utf-8, sorted)
+# * entry_offsets: for word i, its keys are entries entry_offsets[i]:entry_offsets[i+1]
+# * entry_keys / entry_senses: the s2v key hash and sense id of each entry,
+#   in s2v.keys() order within a word
+class S2vCaselessIndex:
+
+  def __init__(self, s2v, arrays, meta):
+    self.s2v = s2v
+    self.words_blob = arrays['words_blob']
+    self.word_offsets = arrays['word_offsets']
+    self.entry_offsets = arrays['entry_offsets']
+    self.entry_keys = arrays['entry_keys']
+    self.entry_senses = arrays['entry_senses']
+    self.sense_names = meta['senses']
+    self.fingerprint = meta['fingerprint']
+    self.words_len = len(self.word_offsets) - 1
+
+
+  @classmethod
+  def build(cls, s2v):
+    print('building caseless s2v index..')
+    groups = {}
+    sense_ids = {}
+    for key in s2v.keys():
+      word, sense = s2v.split_key(key)
+      word_lower = word.lower().replace('_', ' ')
+      if not sense in sense_ids:
+        sense_ids[sense] = len(sense_ids)
+      if not word_lower in groups:
+        groups[word_lower] = []
+      groups[word_lower].append((s2v.strings[key], sense_ids[sense]))
+
+    words = sorted(groups.keys())
+    encoded_words = [w.encode('utf-8') for w in words]
+    word_offsets = np.zeros(len(words) + 1, dtype=np.uint64)
+    word_offsets[1:] = np.cumsum([len(w) for w in encoded_words])
+    entry_offsets = np.zeros(len(words) + 1, dtype=np.uint64)
+    entry_offsets[1:] = np.cumsum([len(groups[w]) for w in words])
+    entries = [e for w in words for e in groups[w]]
+    arrays = {
+      'words_blob': np.frombuffer(b''.join(encoded_words), dtype=np.uint8),
+      'word_offsets': word_offsets,
+      'entry_offsets': entry_offsets,
+      'entry_keys': np.fromiter((e[0] for e in entries), dtype=np.uint64, count=len(entries)),
+      'entry_senses': np.fromiter((e[1] for e in entries), dtype=np.uint16, count=len(entries)),
+    }
+    meta = {
+      'version': CASELESS_INDEX_VERSION,
+      'fingerprint': s2v_model_fingerprint(s2v),
+      'senses': sorted(sense_ids.keys(), key=lambda s: sense_ids[s]),
+    }
+    return cls(s2v, arrays, meta)
+
+
+  @classmethod
+  def load(cls, s2v, path, fingerprint=None):
+    meta, arrays = read_arrays(path)
+    if meta.get('version') != CASELESS_INDEX_VERSION:
+      raise ValueError('caseless index {0} has version {1}, expected {2}'.format(path, meta.get('version'), CASELESS_INDEX_VERSION))
+    fingerprint = fingerprint or s2v_model_fingerprint(s2v)
+    if meta.get('fingerprint') != fingerprint:
+      raise ValueError('caseless index {0} was built for a different model, rebuild it with scripts/build_s2v_indexes.py'.format(path))
+    return cls(s2v, arrays, meta)
+
+
+  # loads the persisted index from the model directory when present and current,
+  # otherwise falls back to building it in memory
+  @classmethod
+  def load_or_build(cls, s2v, model_path=None, fingerprint=None):
+    path = os.path.join(model_path, CASELESS_INDEX_FILENAME) if model_path else None
+    if path and os.path.exists(path):
+      try:
+        print('loading caseless s2v index from', path)
+        return cls.load(s2v, path, fingerprint)
+      except ValueError as e:
+        print('ignoring caseless s2v index:', e)
+    return cls.build(s2v)
+
+
+  def save(self, path):
+    write_arrays(path, {
+      'words_blob': self.words_blob,
+      'word_offsets': self.word_offsets,
+      'entry_offsets': self.entry_offsets,
+      'entry_keys': self.entry_keys,
+      'entry_senses': self.entry_senses,
+    }, {
+      'version': CASELESS_INDEX_VERSION,
+      'fingerprint': self.fingerprint,
+      'senses': self.sense_names,
+    })
+
+
+  def word_at(self, i):
+    return bytes(self.words_blob[int(self.word_offsets[i]):int(self.word_offsets[i + 1])])
+
+
+  # binary search of the sorted words, returns the word index or -1
+  def find_word(self, word):
+    target = word.encode('utf-8')
+    lo = 0
+    hi = self.words_len
+    while lo < hi:
+      mid = (lo + hi) // 2
+      if self.word_at(mid) < target:
+        lo = mid + 1
+      else:
+        hi = mid
+    if lo < self.words_len and self.word_at(lo) == target:
+      return lo
+    return -1
+
+
+  def __contains__(self, word):
+    return self.find_word(word) != -1
+
+
+  # returns the (key, sense) tuples for a lowercased word
+  def get(self, word):
+    i = self.find_word(word)
+    if i == -1:
+      return []
+    start = int(self.entry_offsets[i])
+    end = int(self.entry_offsets[i + 1])
+    return [
+      (self.s2v.strings[int(key)], self.sense_names[sense])
+      for key, sense in zip(self.entry_keys[start:end], self.entry_senses[start:end])
+    ]
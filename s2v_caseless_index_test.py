@@ -0,0 +1,51 @@
+import pytest
+from s2v_caseless_index import S2vCaselessIndex
+
+@pytest.fixture
+def s2v_mock():
+    from sense2vec import Sense2Vec
+    import numpy as np
+    s2v = Sense2Vec(shape=(10, 4))
+    s2v.add('New_York|GPE', np.asarray([1, 1, 1, 1], dtype=np.float32))
+    s2v.add('New_York|NOUN', np.asarray([1, 2, 1, 1], dtype=np.float32))
+    s2v.add('big|ADJ', np.asarray([2, 5, 4, 2], dtype=np.float32))
+    s2v.add('BIG|ADJ', np.asarray([2, 5, 4, 1], dtype=np.float32))
+    s2v.add('apple|NOUN', np.asarray([1, 3, 9, 3], dtype=np.float32))
+    s2v.add('big_apple|NOUN', np.asarray([6, 6, 6, 6], dtype=np.float32))
+    s2v.add('Big_Apple|LOC', np.asarray([6, 6, 6, 6], dtype=np.float32))
+    s2v.add('café|NOUN', np.asarray([6, 6, 6, 5], dtype=np.float32))
+    return s2v
+
+
+def test_groups_keys_by_caseless_word_in_s2v_order(s2v_mock):
+    index = S2vCaselessIndex.build(s2v_mock)
+    assert index.get('new york') == [('New_York|GPE', 'GPE'), ('New_York|NOUN', 'NOUN')]
+    assert index.get('big apple') == [('big_apple|NOUN', 'NOUN'), ('Big_Apple|LOC', 'LOC')]
+    assert index.get('big') == [('big|ADJ', 'ADJ'), ('BIG|ADJ', 'ADJ')]
+    assert index.get('café') == [('café|NOUN', 'NOUN')]
+    assert index.get('foo') == []
+    assert 'apple' in index
+    assert 'appl' not in index
+
+
+def test_saved_index_is_memory_mapped_and_matches_built_index(s2v_mock, tmp_path):
+    import numpy as np
+    built = S2vCaselessIndex.build(s2v_mock)
+    path = str(tmp_path / 'caseless_index')
+    built.save(path)
+    loaded = S2vCaselessIndex.load(s2v_mock, path)
+    assert isinstance(loaded.entry_keys, np.memmap)
+    for word in ['new york', 'big apple', 'big', 'apple', 'café', 'foo']:
+        assert loaded.get(word) == built.get(word)
+
+
+def test_index_built_for_another_model_is_rejected(s2v_mock, tmp_path):
+    import numpy as np
+    from s2v_caseless_index import CASELESS_INDEX_FILENAME
+    path = str(tmp_path / CASELESS_INDEX_FILENAME)
+    S2vCaselessIndex.build(s2v_mock).save(path)
+    s2v_mock.add('orange|NOUN', np.asarray([1, 1, 1, 2], dtype=np.float32))
+    with pytest.raises(ValueError):
+        S2vCaselessIndex.load(s2v_mock, path)
+    rebuilt = S2vCaselessIndex.load_or_build(s2v_mock, str(tmp_path))
+    assert rebuilt.get('orange') == [('orange|NOUN', 'NOUN')]
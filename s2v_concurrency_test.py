@@ -0,0 +1,84 @@
+import sys
+import random
+import pytest
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+THREADS = 8
+ROUNDS = 20
+
+@pytest.fixture
+def s2v_mock():
+    from sense2vec import Sense2Vec
+    rng = np.random.default_rng(3)
+    s2v = Sense2Vec(shape=(128, 8))
+    for word in ['big', 'apple', 'new', 'york', 'blue', 'big_apple', 'new_york']:
+      for cased in [word, word.upper(), word.title()]:
+        for sense in ['NOUN', 'ADJ', 'PROPN', 'GPE']:
+          s2v.add('{0}|{1}'.format(cased, sense), rng.standard_normal(8).astype(np.float32))
+    return s2v
+
+
+@pytest.fixture
+def services(s2v_mock):
+    from s2v_util import S2vUtil
+    from s2v_senses import S2vSenses
+    from s2v_sense_buckets import S2vSenseBuckets
+    from s2v_caseless_index import S2vCaselessIndex
+    from s2v_key_case_and_sense_variations import S2vKeyCaseAndSenseVariations
+    from s2v_key_commonizer import S2vKeyCommonizer
+    from s2v_similarity import S2vSimilarity
+    from s2v_synonyms import S2vSynonyms
+    from s2v_singleflight import S2vSingleflight
+    s2v_util = S2vUtil(s2v_mock)
+    s2v_caseless_index = S2vCaselessIndex.build(s2v_mock)
+    s2v_senses = S2vSenses(s2v_util, s2v_caseless_index)
+    s2v_sense_buckets = S2vSenseBuckets(s2v_caseless_index, seed=0, deterministic=True)
+    s2v_key_variations = S2vKeyCaseAndSenseVariations(s2v_util, s2v_senses, s2v_sense_buckets)
+    s2v_key_commonizer = S2vKeyCommonizer()
+    return {
+      'variations': s2v_key_variations,
+      'similarity': S2vSimilarity(s2v_util, s2v_key_variations, s2v_key_commonizer, singleflight=S2vSingleflight()),
+      'synonyms': S2vSynonyms(s2v_util, s2v_key_variations, s2v_key_commonizer, allow_non_cached_keys=True, singleflight=S2vSingleflight()),
+    }
+
+
+def requests(services):
+    variations = services['variations']
+    similarity = services['similarity']
+    synonyms = services['synonyms']
+    big_apple = [{ 'wordsense': 'big|ADJ', 'required': True }, { 'wordsense': 'apple|NOUN', 'required': True }]
+    blue_big_apple = [{ 'wordsense': 'blue|ADJ', 'required': True }] + big_apple
+    join = { 'attempt-phrase-join-for-compound-phrases': 1 }
+    return [
+      lambda: variations.call(big_apple),
+      lambda: variations.call(big_apple, True, flag_joined_phrase_variations=True, limit=3),
+      lambda: variations.call(blue_big_apple, True, flag_joined_phrase_variations=True, must_only_phrase_join_for_compound_phrases=True),
+      lambda: variations.call(blue_big_apple, True, flag_joined_phrase_variations=True, return_only_top_priority=True, limit=5),
+      lambda: variations.call([{ 'wordsense': 'unknown|NOUN', 'required': True }], random_sample_matching_sense_unknown_keys=True),
+      lambda: similarity.call(['New_York|LOC'], ['big|ADJ', 'apple|NOUN']),
+      lambda: similarity.call(['New_York|LOC'], ['big|ADJ', 'apple|NOUN'], join),
+      lambda: similarity.call(['blue|ADJ', 'big|ADJ', 'apple|NOUN'], ['york|NOUN'], join),
+      lambda: synonyms.call(['big|ADJ', 'apple|NOUN'], { 'n': 5 }),
+      lambda: synonyms.call(['big|ADJ', 'apple|NOUN'], dict(join, n=5)),
+      lambda: synonyms.call(['New_York|LOC'], { 'n': 8, 'match-input-sense': 1 }),
+      lambda: synonyms.call_batch([['big|ADJ', 'apple|NOUN'], ['New_York|LOC'], ['blue|ADJ']], { 'n': 5 }),
+      lambda: similarity.call_batch([[['york|NOUN'], ['big|ADJ']], [['big|ADJ'], ['york|NOUN']]], join),
+    ]
+
+
+def test_concurrent_requests_get_the_same_results_as_serial_requests(services):
+    calls = requests(services)
+    expected = [call() for call in calls]
+    jobs = list(range(len(calls))) * ROUNDS
+    random.Random(0).shuffle(jobs)
+    switch_interval = sys.getswitchinterval()
+    # switch threads as often as possible, to interleave the requests' steps
+    sys.setswitchinterval(1e-6)
+    try:
+      with ThreadPoolExecutor(THREADS) as executor:
+        results = list(executor.map(lambda i: calls[i](), jobs))
+    finally:
+      sys.setswitchinterval(switch_interval)
+    for i, result in zip(jobs, results):
+      assert result == expected[i]
@@ -1,68 +1,140 @@
-import random
-import os
-from itertools import product
-from functools import cmp_to_key
+from collections import namedtuple
+from heapq import heappush, heappop
+from itertools import islice
+from s2v_sense_buckets import S2vSenseBuckets
+from s2v_cache import freeze
+from s2v_trace import current_trace
+
+# the properties of a combination that ranking and priority grouping look at, computed once per combination
+VariationFeatures = namedtuple('VariationFeatures', [
+  'length',
+  'joined_count',
+  'single_joined',
+  'first_joined',
+  'sense',
+  'words',
+  'joined_words',
+  'upper_or_title_cased',
+])
+
+# the arguments of one call, handed down to the helpers collecting its variations instead of
+# being kept on the (shared between requests) service. also the call's memo key, with the phrase
+VariationsContext = namedtuple('VariationsContext', [
+  'attempt_phrase_join_for_compound_phrases',
+  'flag_joined_phrase_variations',
+  'random_sample_matching_sense_unknown_keys',
+  'phrase_is_proper',
+  'return_only_top_priority',
+  'must_only_phrase_join_for_compound_phrases',
+  'limit',
+])
 
 class S2vKeyCaseAndSenseVariations:
 
-  def __init__(self, s2v_util, s2v_senses):
+  # memo_cache (a S2vLruCache) memoizes call results keyed on the phrase and the call flags,
+  # results are always returned frozen (see s2v_cache.freeze) so cached entries can be shared.
+  # results that fell back to randomly sampled keys are not memoized unless sampling is deterministic
+
+  def __init__(self, s2v_util, s2v_senses, s2v_sense_buckets=None, memo_cache=None):
     self.s2v_util = s2v_util
     self.s2v_senses = s2v_senses
+    self.s2v_sense_buckets = s2v_sense_buckets or S2vSenseBuckets(self.s2v_senses.s2v_caseless_index)
+    self.memo_cache = memo_cache
 
   def call(self, k, attempt_phrase_join_for_compound_phrases=None, flag_joined_phrase_variations=False, random_sample_matching_sense_unknown_keys=False, phrase_is_proper=None, return_only_top_priority=False, must_only_phrase_join_for_compound_phrases=None, limit=None):
-    self.flag_joined_phrase_variations = flag_joined_phrase_variations
-    self.must_only_phrase_join_for_compound_phrases = must_only_phrase_join_for_compound_phrases
-    self.limit = limit
+    ctx = VariationsContext(
+      attempt_phrase_join_for_compound_phrases,
+      flag_joined_phrase_variations,
+      random_sample_matching_sense_unknown_keys,
+      phrase_is_proper,
+      return_only_top_priority,
+      must_only_phrase_join_for_compound_phrases,
+      limit,
+    )
+    memo_key = None
+    if self.memo_cache is not None:
+      memo_key = (self.s2v_util.phrase_key(k), ctx)
+      found, result = self.memo_cache.lookup(memo_key)
+      if found:
+        self.trace_variations(k, result, memoized=True)
+        return result
+
+    result, sampled = self.collect_variations(k, ctx)
+    result = freeze(result)
+    if memo_key is not None and (not sampled or self.s2v_sense_buckets.deterministic):
+      self.memo_cache.set(memo_key, result)
+    self.trace_variations(k, result, sampled=sampled)
+    return result
+
+
+  # records the variations of k and their priorities in the current trace
+  def trace_variations(self, k, result, memoized=False, sampled=False):
+    trace = current_trace()
+    if trace is None:
+      return
+    trace.event(
+      'variations',
+      phrase=list(map(lambda x: x['wordsense'], k)),
+      memoized=memoized,
+      sampled=sampled,
+      variations=list(map(lambda x: { 'key': list(map(lambda y: y['wordsense'], x['key'])), 'priority': x['priority'] }, result)),
+    )
+
+
+  # returns the ranked variations and whether they fell back to randomly sampled keys
+  def collect_variations(self, k, ctx):
+    phrase_is_proper = ctx.phrase_is_proper
     if phrase_is_proper is None:
       phrase_is_proper = self.s2v_util.phrase_is_proper(list(map(lambda x: self.s2v_util.s2v.split_key(x['wordsense'])[0], k)))
     combinations = []
+    sampled = False
     k_len = len(k)
-    if k_len >= 2 and attempt_phrase_join_for_compound_phrases or self.must_only_phrase_join_for_compound_phrases:
-      combinations += self.collect_compound_phrase_joined_combinations(k)
-    if k_len > 2  and attempt_phrase_join_for_compound_phrases and not self.must_only_phrase_join_for_compound_phrases:
-      combinations += self.collect_last_compound_joined_combinations(k)
-    remaining_limit = None if self.limit is None else (self.limit-len(combinations))
-    if (remaining_limit is None or remaining_limit > 0) and not self.must_only_phrase_join_for_compound_phrases or k_len < 2:
-      combinations += self.collect_combinations_based_on_each_keys_combinations(k, limit=remaining_limit)
-    if random_sample_matching_sense_unknown_keys and len(combinations) <= 0:
+    if k_len >= 2 and ctx.attempt_phrase_join_for_compound_phrases or ctx.must_only_phrase_join_for_compound_phrases:
+      combinations += self.collect_compound_phrase_joined_combinations(k, ctx)
+    if k_len > 2  and ctx.attempt_phrase_join_for_compound_phrases and not ctx.must_only_phrase_join_for_compound_phrases:
+      combinations += self.collect_last_compound_joined_combinations(k, ctx)
+    remaining_limit = None if ctx.limit is None else (ctx.limit-len(combinations))
+    if (remaining_limit is None or remaining_limit > 0) and not ctx.must_only_phrase_join_for_compound_phrases or k_len < 2:
+      combinations += self.collect_combinations_based_on_each_keys_combinations(k, ctx, limit=remaining_limit)
+    if ctx.random_sample_matching_sense_unknown_keys and len(combinations) <= 0:
       combinations = self.collect_combinations_based_on_each_keys_combinations(
         k,
+        ctx,
         random_sample_matching_sense_unknown_keys = True,
       )
+      sampled = True
     # print('check for key!', k)
     # print('combinations', combinations)
-    combinations.sort(key=cmp_to_key(self.sort_by_joined_then_case_match_to_key(k, phrase_is_proper)))
-    combinations = self.assign_priority_scores(combinations, phrase_is_proper, return_only_top_priority)
-    return combinations[:self.limit]
+    features = list(map(self.variation_features, combinations))
+    sort_key = self.joined_then_case_match_to_key_sort_key(k, phrase_is_proper)
+    ranked = sorted(zip(combinations, features), key=lambda x: sort_key(x[1]))
+    combinations = self.assign_priority_scores(ranked, phrase_is_proper, ctx.return_only_top_priority)
+    return combinations[:ctx.limit], sampled
 
 
-  def collect_combinations_based_on_each_keys_combinations(self, k, random_sample_matching_sense_unknown_keys=False, limit=None):
-    return self.collect_key_sense_combinations(k, random_sample_matching_sense_unknown_keys, limit=limit)
+  def collect_combinations_based_on_each_keys_combinations(self, k, ctx, random_sample_matching_sense_unknown_keys=False, limit=None):
+    return self.collect_key_sense_combinations(k, ctx, random_sample_matching_sense_unknown_keys, limit=limit)
 
 
-  def collect_last_compound_joined_combinations(self, k):
+  def collect_last_compound_joined_combinations(self, k, ctx):
     last_compound_pair_joined_key = ' '.join(map(lambda x: self.s2v_util.s2v.split_key(x['wordsense'])[0], k[-2:]))
     if len(self.s2v_senses.get_noun_based_senses(last_compound_pair_joined_key)) <= 0:
       return []
     new_k = k[:-2] + [{ 'wordsense': self.s2v_util.s2v.make_key(last_compound_pair_joined_key, 'NOUN'), 'required': True, 'is_joined': True }]
-    return self.collect_key_sense_combinations(new_k)
+    return self.collect_key_sense_combinations(new_k, ctx)
 
 
-  def collect_key_sense_combinations(self, k, random_sample_matching_sense_unknown_keys=False, limit=None):
+  def collect_key_sense_combinations(self, k, ctx, random_sample_matching_sense_unknown_keys=False, limit=None):
     remaining = limit
     result = []
     inner_result = []
     len_k = len(k)
-    if os.getenv('S2V_VERBOSE'):
-      print()
-      print('collecting key sense combos for', k)
-      print()
+    trace = current_trace()
     for sub_k in k:
       sub_k_result = []
-      if os.getenv('S2V_VERBOSE'):
-        print('getting senses for sub_k', sub_k)
       word, sense = self.s2v_util.s2v.split_key(sub_k['wordsense'])
       sense_based_senses = []
+      source = 'senses'
 
       if sense in self.s2v_util.s2v_adj_tags:
         sense_based_senses = self.s2v_senses.get_adjective_based_senses(word)
@@ -75,35 +147,25 @@ class S2vKeyCaseAndSenseVariations:
           random_sample = self.random_sample_matching_sense(sense)
           if random_sample:
             sense_based_senses = [random_sample]
-          if os.getenv('S2V_VERBOSE'):
-            print('no senses got random sample', sense_based_senses)
+          source = 'random_sample'
         else:
-          print('checking if sense in s2v', sub_k['wordsense'])
           if sub_k['wordsense'] in self.s2v_util.s2v:
             sense_based_senses = [sub_k['wordsense']]
-            if os.getenv('S2V_VERBOSE'):
-              print('no senses default to input sense', sense_based_senses)
+            source = 'input_sense'
           else:
-            if os.getenv('S2V_VERBOSE'):
-              print('no senses')
             sense_based_senses = []
-      if os.getenv('S2V_VERBOSE'):
-        print('senses for ', sub_k, sense_based_senses)
+            source = 'none'
+      if trace is not None:
+        trace.event('key_senses', key=sub_k['wordsense'], source=source, senses=list(sense_based_senses))
       for s in sense_based_senses:
-        if os.getenv('S2V_VERBOSE'):
-          print('collecting sense based sense', s, ' for ', sub_k)
         if len_k > 1:
           v = { 'wordsense': s, 'required': sub_k['required'] }
-          if self.flag_joined_phrase_variations:
+          if ctx.flag_joined_phrase_variations:
             v['is_joined'] = sub_k['is_joined'] if 'is_joined' in sub_k else False
           sub_k_result.append(v)
-          if not remaining is None:
-            remaining -= 1
-            if remaining <= 0:
-              break
         else:
           v = { 'wordsense': s, 'required': sub_k['required'] }
-          if self.flag_joined_phrase_variations:
+          if ctx.flag_joined_phrase_variations:
             v['is_joined'] = sub_k['is_joined'] if 'is_joined' in sub_k else False
           result.append([v])
           if not remaining is None:
@@ -112,19 +174,68 @@ class S2vKeyCaseAndSenseVariations:
               break
       if len_k > 1:
         inner_result.append(sub_k_result)
-    # combine all inner combinations
+    # combine all inner combinations, only the best ranked limit of them
     if len_k > 1:
-      for to_append in list(product(*inner_result)):
-        result.append(list(to_append))
+      result += list(islice(self.best_first_combinations(k, inner_result), limit))
     return result
 
 
-  def collect_compound_phrase_joined_combinations(self, k):
+  # lazily yields the combinations of the per key sense lists (the itertools.product of them)
+  # best ranked first, the way call ranks them.
+  #
+  # each key's senses are ordered by how well they match that key (key_sense_rank), the rank of a
+  # combination never improves when one of its keys moves to a worse sense, so the product can be
+  # expanded best-first from the combination of every key's best sense, keeping a frontier heap.
+  # combinations that rank equal come out in product order, the order a stable sort keeps them in
+  def best_first_combinations(self, k, inner_result):
+    if len(inner_result) <= 0 or min(map(len, inner_result)) <= 0:
+      return
+    sort_key = self.joined_then_case_match_to_key_sort_key(k, False)
+    match_title_case = self.s2v_util.words_only(k)[0][0].isupper()
+    ranked = []
+    for sub_k, sub_k_result in zip(k, inner_result):
+      ranks = list(map(lambda x: self.key_sense_rank(sub_k, x['wordsense'], match_title_case), sub_k_result))
+      ranked.append(sorted(range(len(sub_k_result)), key=lambda i: ranks[i]))
+
+    def heap_entry(position):
+      indices = tuple(map(lambda x: ranked[x[0]][x[1]], enumerate(position)))
+      combination = list(map(lambda x: inner_result[x[0]][x[1]], enumerate(indices)))
+      return (sort_key(self.variation_features(combination)), indices, position, combination)
+
+    frontier = [heap_entry((0,) * len(ranked))]
+    while frontier:
+      _, _, position, combination = heappop(frontier)
+      yield combination
+      # each position is reached from exactly one parent: the one with its last advanced key
+      # stepped back, so successors only advance keys from the last advanced one onwards
+      last_advanced = max([i for i, p in enumerate(position) if p > 0], default=0)
+      for i in range(last_advanced, len(position)):
+        if position[i] + 1 < len(ranked[i]):
+          heappush(frontier, heap_entry(position[:i] + (position[i] + 1,) + position[i + 1:]))
+
+
+  # how well the sense s matches the key sub_k, the per key part of the ranking call applies
+  # to whole combinations: exact match, case insensitive match, title case match, then letter by letter
+  def key_sense_rank(self, sub_k, s, match_title_case):
+    k_words = self.s2v_util.s2v.split_key(sub_k['wordsense'])[0].split(' ')
+    k_words_joined = '_'.join(k_words)
+    words = self.s2v_util.s2v.split_key(s)[0].split(' ')
+    words_joined = '_'.join(words)
+    title_cased = ' '.join(words).title().replace(' ', '_')
+    return (
+      0 if words == k_words else 1,
+      0 if words_joined.lower() == k_words_joined.lower() else 1,
+      0 if match_title_case and title_cased == k_words_joined else 1,
+      tuple(map(lambda x: 0 if x[0] == x[1] else 1, zip(k_words_joined, words_joined))),
+    )
+
+
+  def collect_compound_phrase_joined_combinations(self, k, ctx):
     result = []
     joined_key = ' '.join(map(lambda x: self.s2v_util.s2v.split_key(x['wordsense'])[0], k))
     for s in self.s2v_senses.get_noun_based_senses(joined_key):
       v = { 'wordsense': s, 'required': True }
-      if self.flag_joined_phrase_variations:
+      if ctx.flag_joined_phrase_variations:
         v['is_joined'] = True
       result.append([v])
     return result
@@ -134,158 +245,89 @@ class S2vKeyCaseAndSenseVariations:
     if matching_sense not in self.s2v_util.s2v_noun_tags and matching_sense not in self.s2v_util.s2v_adj_tags:
       return None
 
-    matching_sample = None
-    attempts_remaining = 10
-    while True:
-      if attempts_remaining <= 0:
-        return None
-      samples = random.sample(self.s2v_util.s2v_all_keys, min([50, self.s2v_util.s2v_all_keys_len]))
-      for sample in samples:
-        if sample[-2:] != '|X':
-          word, sense = self.s2v_util.s2v.split_key(sample)
-          if sense == matching_sense:
-            matching_sample = sample
-            break
-          
-      if matching_sample:
-        return matching_sample
-      attempts_remaining -= 1
-
-
-  def sort_by_joined_then_case_match_to_key(self, k, phrase_is_proper):
+    return self.s2v_sense_buckets.sample(matching_sense)
+
+
+  def variation_features(self, c):
+    words = tuple(self.s2v_util.words_only(c))
+    length = len(c)
+    return VariationFeatures(
+      length = length,
+      joined_count = len(list(filter(lambda x: x.get('is_joined'), c))),
+      single_joined = length == 1 and bool(c[0].get('is_joined')),
+      first_joined = length > 0 and bool(c[0].get('is_joined')),
+      sense = self.s2v_util.s2v.split_key(c[0]['wordsense'])[1] if length > 0 else None,
+      words = words,
+      joined_words = '_'.join(words),
+      upper_or_title_cased = self.phrase_has_title_cased(words) or self.phrase_has_upper_cased(words),
+    )
+
+
+  # ranks combinations (by their VariationFeatures) against the source phrase k, in order:
+  # * non empty combinations
+  # * the fully joined compound phrase, then combinations with more joined keys
+  # * when the phrase is not proper, for single key combinations take as priority:
+  #   1. the NOUN groups that are not title cased and not all upper case
+  #   2. if not enough synonyms in 1, then take the remaining NOUN groups
+  #   3. then remaining other sense noun based groups taking the top scoring from those groups
+  # * all words matching k exactly
+  # * all words matching k case insensitively
+  # * title case matching k (if first letter of first word of k is upper)
+  # * combinations with no fewer keys than k. without flag_joined_phrase_variations this puts a
+  #   last compound joined combination after the unjoined ones with its words, the comparator
+  #   this replaced had them equal, which no sort key can keep consistently with the rest
+  # * the best match letter for letter with k, from the first letter
+  def joined_then_case_match_to_key_sort_key(self, k, phrase_is_proper):
     k_len = len(k)
-    k_words = self.s2v_util.words_only(k)
-    def the_actual_sort(a, b):
-      a_len = len(a)
-      b_len = len(b)
-      if b_len > 0 and not a_len > 0:
-        return 1
-      elif a_len > 0 and not b_len > 0:
-        return -1
-
-
-      if b_len == 1 and b[0]['is_joined'] and not a[0]['is_joined']:
-        return 1
-      elif a_len == 1 and a[0]['is_joined'] and not b[0]['is_joined']:
-        return -1
+    k_words = tuple(self.s2v_util.words_only(k))
+    k_words_joined = '_'.join(k_words)
+    k_words_joined_lower = k_words_joined.lower()
+    match_title_case = k_words[0][0].isupper()
+
+    def sort_key(f):
+      if not phrase_is_proper and f.length == 1:
+        sense_rank = (0 if f.sense == 'NOUN' else 1, 1 if f.upper_or_title_cased else 0)
       else:
-        a_is_joined_len = len(list(filter(lambda x: 'is_joined' in x and x['is_joined'], a)))
-        b_is_joined_len = len(list(filter(lambda x: 'is_joined' in x and x['is_joined'], b)))
-        if b_is_joined_len > 0 and b_is_joined_len > a_is_joined_len:
-          return 1
-        elif a_is_joined_len > 0 and a_is_joined_len > b_is_joined_len:
-          return -1
-
-      a_words = self.s2v_util.words_only(a)
-      b_words = self.s2v_util.words_only(b)
-      a_sense = self.s2v_util.s2v.split_key(a[0]['wordsense'])[1]
-      b_sense = self.s2v_util.s2v.split_key(b[0]['wordsense'])[1]
-
-      if not phrase_is_proper and a_len == b_len == 1:
-        # take as priority: 
-        # 1. the NOUN groups that are not title cased and not all upper case
-        # 2. if not enough synonyms in 1, then take the remaining NOUN groups
-        # 3. then remaining other sense noun based groups taking the top scoring from those groups
-        if b_sense == 'NOUN' and a_sense != 'NOUN':
-          return 1
-        elif a_sense == 'NOUN' and b_sense != 'NOUN':
-          return -1
-        else:
-          a_upper_or_title_cased = self.phrase_has_title_cased(a_words) or self.phrase_has_upper_cased(a_words)
-          b_upper_or_title_cased = self.phrase_has_title_cased(b_words) or self.phrase_has_upper_cased(b_words)
-          if not b_upper_or_title_cased and a_upper_or_title_cased:
-            return 1
-          elif not a_upper_or_title_cased and b_upper_or_title_cased:
-            return -1
-
-      if a_words == b_words:
-        return 0
-
-      # k_words is the source (list of words)
-      # words is what will be scored for matching (list of words) 
-      # 
-      # score highest in order:
-      # all words match exactly
-      if b_words == k_words:
-        return 1
-      elif a_words == k_words:
-        return -1
-
-      k_words_joined = '_'.join(k_words)
-      k_words_joined_lower = k_words_joined.lower()
-      a_words_joined = '_'.join(a_words)
-      a_words_joined_lower = a_words_joined.lower()
-      b_words_joined = '_'.join(b_words)
-      b_words_joined_lower = b_words_joined.lower()
-
-      # if one matches case insensitive and the other doesnt then return the case insenstive match
-      if k_words_joined_lower == b_words_joined_lower and k_words_joined_lower != a_words_joined_lower:
-        return 1
-      elif k_words_joined_lower == a_words_joined_lower and k_words_joined_lower != b_words_joined_lower:
-        return -1
-
-      # match case of each word - from first word the more that match case the better,
-      # title case (if first letter of first word is upper), 
-      # lower case, 
-      # remaining
-      if k_words[0][0].isupper():
-        a_words_joined_title = ' '.join(a_words).title().replace(' ', '_')
-        b_words_joined_title = ' '.join(b_words).title().replace(' ', '_')
-        if b_words_joined_title == k_words_joined and a_words_joined_title != k_words_joined:
-          return 1
-        elif a_words_joined_title == k_words_joined and b_words_joined_title != k_words_joined:
-          return -1
-
-      if a_len < k_len and b_len >= k_len:
-        return 1
-      elif b_len < k_len and a_len >= k_len:
-        return -1
-
-      # return the best match letter for letter
-      for k_letter, a_letter, b_letter in zip(list(k_words_joined), list(a_words_joined), list(b_words_joined)):
-        if b_letter == k_letter and a_letter != k_letter:
-          return 1
-        elif a_letter == k_letter and b_letter != k_letter:
-          return -1
-
-      return 0
-    
-    return the_actual_sort
-
-
-  def assign_priority_scores(self, combinations, phrase_is_proper, return_only_top_priority):
+        sense_rank = (0, 0)
+      title_cased = ' '.join(f.words).title().replace(' ', '_')
+      return (
+        0 if f.length > 0 else 1,
+        0 if f.single_joined else 1,
+        -f.joined_count,
+        sense_rank,
+        0 if f.words == k_words else 1,
+        0 if f.joined_words.lower() == k_words_joined_lower else 1,
+        0 if match_title_case and title_cased == k_words_joined else 1,
+        1 if f.length < k_len else 0,
+        tuple(map(lambda x: 0 if x[0] == x[1] else 1, zip(k_words_joined, f.joined_words))),
+      )
+
+    return sort_key
+
+
+  # ranked is a list of (combination, VariationFeatures) tuples in rank order
+  def assign_priority_scores(self, ranked, phrase_is_proper, return_only_top_priority):
     initial_score = 1
     current_score = initial_score
     new_combinations = []
-    last_combination = None
-    for i, c in enumerate(combinations):
+    last = None
+    for i, (c, f) in enumerate(ranked):
       if i > 0:
-        if len(last_combination['key']) == 1 and 'is_joined' in last_combination['key'][0] and \
-            last_combination['key'][0]['is_joined'] and \
-            (len(last_combination['key']) > 1 or 'is_joined' not in c[0] or c[0]['is_joined'] != last_combination['key'][0]['is_joined']):
+        if last.single_joined and not f.first_joined:
           current_score += 1
-        else:
-          c_is_joined_len = len(list(filter(lambda x: 'is_joined' in x and x['is_joined'], c)))
-          prev_is_joined_len = len(list(filter(lambda x: 'is_joined' in x and x['is_joined'], last_combination['key'])))
-          if c_is_joined_len != prev_is_joined_len:
-            current_score += 1
-          else:
-            words = self.s2v_util.words_only(c)
-            prev_words = self.s2v_util.words_only(last_combination['key'])
-            if words != prev_words:
-              current_score += 1
-            elif not phrase_is_proper and len(last_combination['key']) == len(c) == 1:
-              current_sense = self.s2v_util.s2v.split_key(c[0]['wordsense'])[1]
-              prev_sense = self.s2v_util.s2v.split_key(last_combination['key'][0]['wordsense'])[1]
-              if (current_sense == 'NOUN' and prev_sense != 'NOUN') or (current_sense != 'NOUN' and prev_sense == 'NOUN'):
-                current_score += 1
-      
+        elif f.joined_count != last.joined_count:
+          current_score += 1
+        elif f.words != last.words:
+          current_score += 1
+        elif not phrase_is_proper and last.length == f.length == 1 and \
+            (f.sense == 'NOUN') != (last.sense == 'NOUN'):
+          current_score += 1
+
       if return_only_top_priority and current_score > initial_score:
         break
 
-      new_combination = { 'key': c, 'priority': current_score }
-      new_combinations.append(new_combination)
-      last_combination = new_combination
+      new_combinations.append({ 'key': c, 'priority': current_score })
+      last = f
 
     return new_combinations
 
@@ -220,6 +220,21 @@ def test_joins_the_last_two_words_of_a_phrase_if_they_exist_as_a_compound(the_se
     ]
     assert result == expected
 
+def test_last_two_words_joined_rank_after_the_unjoined_keys_with_their_words_when_not_flagged(the_service, s2v_mock):
+    k = [
+      { 'wordsense': 'black|ADJ', 'required': False },
+      { 'wordsense': 'big|ADJ', 'required': False },
+      { 'wordsense': 'apple|NOUN', 'required': False },
+    ]
+    result = the_service.call(k, attempt_phrase_join_for_compound_phrases = True)
+    expected = [
+      (['black|ADJ', 'big|ADJ', 'apple|NOUN'], 1),
+      (['black|ADJ', 'big_apple|NOUN'], 1),
+      (['black|ADJ', 'BIG|ADJ', 'apple|NOUN'], 2),
+      (['black|ADJ', 'Big_apple|NOUN'], 3),
+    ]
+    assert list(map(lambda x: (list(map(lambda y: y['wordsense'], x['key'])), x['priority']), result))[:4] == expected
+
 def test_3_word_all_required_compound(the_service, s2v_mock):
     k = [
       { 'wordsense': 'blue|NOUN', 'required': True },
@@ -303,3 +318,40 @@ def test_limit(the_service, s2v_mock):
       {'key': [{'wordsense': 'blue|NOUN', 'required': True, 'is_joined': False}, {'wordsense': 'Big_Apple|LOC', 'required': True, 'is_joined': True}], 'priority': 4},
     ]
     assert result == expected
+
+
+def test_memoized_results_are_shared_and_immutable(s2v_mock):
+    from s2v_util import S2vUtil
+    from s2v_senses import S2vSenses
+    from s2v_cache import S2vLruCache
+    s2v_util = S2vUtil(s2v_mock)
+    memo_cache = S2vLruCache()
+    the_service = S2vKeyCaseAndSenseVariations(s2v_util, S2vSenses(s2v_util), memo_cache=memo_cache)
+    k = [
+      { 'wordsense': 'big|ADJ', 'required': False },
+      { 'wordsense': 'apple|NOUN', 'required': False },
+    ]
+    first = the_service.call(k, attempt_phrase_join_for_compound_phrases = True, flag_joined_phrase_variations = True)
+    second = the_service.call(k, attempt_phrase_join_for_compound_phrases = True, flag_joined_phrase_variations = True)
+    assert first is second
+    assert memo_cache.stats()['hits'] == 1
+    with pytest.raises(TypeError):
+      first[0]['key'][0]['wordsense'] = 'mutated|NOUN'
+    with pytest.raises(TypeError):
+      first.append({})
+    third = the_service.call(k, attempt_phrase_join_for_compound_phrases = True, flag_joined_phrase_variations = True, limit = 2)
+    assert third == first[:2]
+    assert memo_cache.stats()['misses'] == 2
+
+
+def test_limit_keeps_the_best_ranked_combinations_of_all_keys_senses(the_service, s2v_mock):
+    k = [
+      { 'wordsense': 'BIG|ADJ', 'required': True },
+      { 'wordsense': 'Big_Apple|NOUN', 'required': True },
+    ]
+    unlimited = the_service.call(k, flag_joined_phrase_variations = True)
+    assert len(unlimited) == 2 * 7
+    for limit in range(1, len(unlimited) + 1):
+      result = the_service.call(k, flag_joined_phrase_variations = True, limit = limit)
+      assert list(map(lambda x: x['key'], result)) == list(map(lambda x: x['key'], unlimited[:limit]))
+    assert list(map(lambda x: x['wordsense'], unlimited[0]['key'])) in [['BIG|ADJ', 'Big_Apple|NOUN'], ['BIG|ADJ', 'Big_Apple|LOC']]
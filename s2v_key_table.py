@@ -0,0 +1,183 @@
+import os
+import numpy as np
+from s2v_util import s2v_model_fingerprint
+from s2v_mmap import write_arrays, read_arrays
+
+KEY_TABLE_FILENAME = 'key_table.s2vmmap'
+KEY_TABLE_VERSION = 1
+GENERIC_SENSES = ['n', 'a', 'v', 'unknown']
+
+
+# per key metadata parsed once from the vocabulary, stored column by column in flat arrays
+# indexed by the key's s2v row (rows without a key are left empty), so lookups read an array
+# element instead of splitting the key and running phrase_is_proper / get_generic_sense on it:
+#
+# * row_keys: the s2v key hash of each row
+# * words_blob / word_offsets: the word of each row (as s2v.split_key returns it, utf-8)
+# * senses: sense id (into meta senses), generic_senses: id into GENERIC_SENSES
+# * is_proper: S2vUtil.phrase_is_proper of the word
+# * lower_ids: id of the lowercased word among the vocabulary's sorted distinct lowercased
+#   words, the same ids as S2vCaselessIndex's word ids, -1 for rows without a key
+# * word_counts: the number of words in the key
+# * freqs: the key's frequency, -1 when the model has none
+#
+# it serves code that already holds rows (synonyms read from neighbour searches, partitions,
+# the warmup). S2vKeyCaseAndSenseVariations and S2vUtil.words_only still split key strings:
+# their keys are inputs and joined phrases (often not in the model) and a row lookup by
+# key string costs more than s2v.split_key
+class S2vKeyTable:
+
+  def __init__(self, s2v, arrays, meta):
+    self.s2v = s2v
+    self.key2row = s2v.vectors.key2row
+    self.row_keys = arrays['row_keys']
+    self.words_blob = arrays['words_blob']
+    self.word_offsets = arrays['word_offsets']
+    self.senses = arrays['senses']
+    self.generic_senses = arrays['generic_senses']
+    self.is_propers = arrays['is_proper']
+    self.lower_ids = arrays['lower_ids']
+    self.word_counts = arrays['word_counts']
+    self.freqs = arrays['freqs']
+    self.sense_names = meta['senses']
+    self.fingerprint = meta['fingerprint']
+    self.generic_sense_by_sense = {
+      sense: GENERIC_SENSES[generic_sense]
+      for sense, generic_sense in zip(self.sense_names, meta['sense_generic_senses'])
+    }
+
+
+  @classmethod
+  def build(cls, s2v_util):
+    print('building s2v key table..')
+    s2v = s2v_util.s2v
+    rows_len = s2v.vectors.shape[0]
+    row_keys = np.zeros(rows_len, dtype=np.uint64)
+    senses = np.zeros(rows_len, dtype=np.uint16)
+    is_proper = np.zeros(rows_len, dtype=np.bool_)
+    word_counts = np.zeros(rows_len, dtype=np.uint16)
+    freqs = np.full(rows_len, -1, dtype=np.int64)
+    words = [''] * rows_len
+    sense_ids = {}
+    for key, row in s2v.vectors.key2row.items():
+      word, sense = s2v.split_key(s2v.strings[key])
+      if not sense in sense_ids:
+        sense_ids[sense] = len(sense_ids)
+      row_keys[row] = key
+      words[row] = word
+      senses[row] = sense_ids[sense]
+      is_proper[row] = s2v_util.phrase_is_proper([word])
+      word_counts[row] = len(word.split(' '))
+      freqs[row] = s2v.freqs.get(key, -1)
+
+    has_key = row_keys != 0
+    lower_words = [w.lower() for w in words]
+    lower_ids_by_word = { w: i for i, w in enumerate(sorted(set(w for w, k in zip(lower_words, has_key) if k))) }
+    lower_ids = np.fromiter((lower_ids_by_word[w] if k else -1 for w, k in zip(lower_words, has_key)), dtype=np.int32, count=rows_len)
+    sense_names = sorted(sense_ids.keys(), key=lambda s: sense_ids[s])
+    sense_generic_senses = [GENERIC_SENSES.index(s2v_util.get_generic_sense(s)) for s in sense_names]
+    generic_senses = np.asarray(sense_generic_senses + [GENERIC_SENSES.index('unknown')], dtype=np.uint8)[
+      np.where(has_key, senses, len(sense_names))
+    ]
+    encoded_words = [w.encode('utf-8') for w in words]
+    word_offsets = np.zeros(rows_len + 1, dtype=np.uint64)
+    word_offsets[1:] = np.cumsum([len(w) for w in encoded_words])
+    arrays = {
+      'row_keys': row_keys,
+      'words_blob': np.frombuffer(b''.join(encoded_words), dtype=np.uint8),
+      'word_offsets': word_offsets,
+      'senses': senses,
+      'generic_senses': generic_senses,
+      'is_proper': is_proper,
+      'lower_ids': lower_ids,
+      'word_counts': word_counts,
+      'freqs': freqs,
+    }
+    meta = {
+      'version': KEY_TABLE_VERSION,
+      'fingerprint': s2v_model_fingerprint(s2v),
+      'senses': sense_names,
+      'sense_generic_senses': sense_generic_senses,
+    }
+    return cls(s2v, arrays, meta)
+
+
+  @classmethod
+  def load(cls, s2v, path, fingerprint=None):
+    meta, arrays = read_arrays(path)
+    if meta.get('version') != KEY_TABLE_VERSION:
+      raise ValueError('key table {0} has version {1}, expected {2}'.format(path, meta.get('version'), KEY_TABLE_VERSION))
+    fingerprint = fingerprint or s2v_model_fingerprint(s2v)
+    if meta.get('fingerprint') != fingerprint:
+      raise ValueError('key table {0} was built for a different model, rebuild it with scripts/build_s2v_indexes.py'.format(path))
+    return cls(s2v, arrays, meta)
+
+
+  # loads the persisted table from the model directory when present and current,
+  # otherwise falls back to building it in memory
+  @classmethod
+  def load_or_build(cls, s2v_util, model_path=None, fingerprint=None):
+    path = os.path.join(model_path, KEY_TABLE_FILENAME) if model_path else None
+    if path and os.path.exists(path):
+      try:
+        print('loading s2v key table from', path)
+        return cls.load(s2v_util.s2v, path, fingerprint)
+      except ValueError as e:
+        print('ignoring s2v key table:', e)
+    return cls.build(s2v_util)
+
+
+  def save(self, path):
+    write_arrays(path, {
+      'row_keys': self.row_keys,
+      'words_blob': self.words_blob,
+      'word_offsets': self.word_offsets,
+      'senses': self.senses,
+      'generic_senses': self.generic_senses,
+      'is_proper': self.is_propers,
+      'lower_ids': self.lower_ids,
+      'word_counts': self.word_counts,
+      'freqs': self.freqs,
+    }, {
+      'version': KEY_TABLE_VERSION,
+      'fingerprint': self.fingerprint,
+      'senses': self.sense_names,
+      'sense_generic_senses': [GENERIC_SENSES.index(self.generic_sense_by_sense[s]) for s in self.sense_names],
+    })
+
+
+  # the row of a key, -1 when it is not in the model
+  def row(self, key):
+    return self.key2row.get(self.s2v.strings[key], -1)
+
+
+  def key(self, row):
+    return self.s2v.strings[int(self.row_keys[row])]
+
+
+  def word(self, row):
+    return bytes(self.words_blob[int(self.word_offsets[row]):int(self.word_offsets[row + 1])]).decode('utf-8')
+
+
+  def sense(self, row):
+    return self.sense_names[self.senses[row]]
+
+
+  def generic_sense(self, row):
+    return GENERIC_SENSES[self.generic_senses[row]]
+
+
+  def is_proper(self, row):
+    return bool(self.is_propers[row])
+
+
+  def lower_id(self, row):
+    return int(self.lower_ids[row])
+
+
+  def word_count(self, row):
+    return int(self.word_counts[row])
+
+
+  def freq(self, row):
+    return int(self.freqs[row])
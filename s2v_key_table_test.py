@@ -0,0 +1,64 @@
+import pytest
+import numpy as np
+from s2v_util import S2vUtil
+from s2v_key_table import S2vKeyTable
+
+@pytest.fixture
+def s2v_mock():
+    from sense2vec import Sense2Vec
+    s2v = Sense2Vec(shape=(12, 4))
+    s2v.add('New_York|GPE', np.asarray([1, 1, 1, 1], dtype=np.float32), freq=10)
+    s2v.add('New_York|NOUN', np.asarray([1, 2, 1, 1], dtype=np.float32), freq=3)
+    s2v.add('big|ADJ', np.asarray([2, 5, 4, 2], dtype=np.float32), freq=50)
+    s2v.add('BIG|ADJ', np.asarray([2, 5, 4, 1], dtype=np.float32))
+    s2v.add('apple|NOUN', np.asarray([1, 3, 9, 3], dtype=np.float32), freq=20)
+    s2v.add('big_apple|NOUN', np.asarray([6, 6, 6, 6], dtype=np.float32), freq=4)
+    s2v.add('Big_Apple|LOC', np.asarray([6, 6, 6, 6], dtype=np.float32), freq=2)
+    s2v.add('run|VERB', np.asarray([3, 6, 6, 5], dtype=np.float32), freq=7)
+    s2v.add('café|X', np.asarray([6, 6, 6, 5], dtype=np.float32), freq=1)
+    return s2v
+
+
+def test_columns_match_the_parsed_keys(s2v_mock):
+    s2v_util = S2vUtil(s2v_mock)
+    table = S2vKeyTable.build(s2v_util)
+    for key in s2v_mock.keys():
+      row = table.row(key)
+      word, sense = s2v_mock.split_key(key)
+      assert row == s2v_mock.vectors.find(key=key)
+      assert table.key(row) == key
+      assert table.word(row) == word
+      assert table.sense(row) == sense
+      assert table.generic_sense(row) == s2v_util.get_generic_sense(sense)
+      assert table.is_proper(row) == s2v_util.phrase_is_proper([word])
+      assert table.word_count(row) == len(word.split(' '))
+      assert table.freq(row) == (s2v_mock.get_freq(key) or -1)
+    assert table.row('missing|NOUN') == -1
+    assert table.generic_sense_by_sense == { 'GPE': 'n', 'NOUN': 'n', 'ADJ': 'a', 'LOC': 'n', 'VERB': 'v', 'X': 'unknown' }
+
+
+def test_lower_ids_are_the_caseless_index_word_ids(s2v_mock):
+    from s2v_caseless_index import S2vCaselessIndex
+    table = S2vKeyTable.build(S2vUtil(s2v_mock))
+    index = S2vCaselessIndex.build(s2v_mock)
+    for key in s2v_mock.keys():
+      row = table.row(key)
+      assert table.lower_id(row) == index.find_word(table.word(row).lower())
+    assert table.lower_id(table.row('big|ADJ')) == table.lower_id(table.row('BIG|ADJ'))
+    assert table.lower_id(table.row('big_apple|NOUN')) == table.lower_id(table.row('Big_Apple|LOC'))
+
+
+def test_saved_table_is_memory_mapped_and_checked_against_the_model(s2v_mock, tmp_path):
+    from s2v_key_table import KEY_TABLE_FILENAME
+    s2v_util = S2vUtil(s2v_mock)
+    built = S2vKeyTable.build(s2v_util)
+    built.save(str(tmp_path / KEY_TABLE_FILENAME))
+    loaded = S2vKeyTable.load_or_build(s2v_util, str(tmp_path))
+    assert isinstance(loaded.freqs, np.memmap)
+    for key in s2v_mock.keys():
+      row = loaded.row(key)
+      assert (loaded.word(row), loaded.sense(row), loaded.is_proper(row), loaded.freq(row)) == \
+        (built.word(row), built.sense(row), built.is_proper(row), built.freq(row))
+    s2v_mock.add('pear|NOUN', np.asarray([1, 1, 2, 2], dtype=np.float32))
+    with pytest.raises(ValueError):
+      S2vKeyTable.load(s2v_mock, str(tmp_path / KEY_TABLE_FILENAME))
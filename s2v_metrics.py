@@ -0,0 +1,475 @@
+import os
+import json
+import mmap
+import struct
+import weakref
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from s2v_trace import current_trace
+
+# latency buckets (seconds), from the sub millisecond internal stages up to slow requests
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS_FILE_PREFIX = 's2v_metrics_'
+METRICS_FILE_SIZE = 1 << 16
+# seconds between writes of the collectors' values to the process' metrics file
+COLLECTOR_FLUSH_SECONDS = 1.0
+
+# every metric the service exposes, name: (type, help)
+METRICS = {
+  's2v_request_duration_seconds': ('histogram', 'Latency of requests by endpoint'),
+  's2v_stage_duration_seconds': ('histogram', 'Latency of the internal stages of a request by service and stage'),
+  's2v_requests_total': ('counter', 'Requests by endpoint and status code'),
+  's2v_request_items_total': ('counter', 'Items (phrases or phrase pairs) received by endpoint'),
+  's2v_request_deduplicated_items_total': ('counter', 'Items identical to an earlier item of the same request, not recomputed'),
+  's2v_variation_combinations_total': ('counter', 'Key variations (synonyms) or variation pairs (similarity) generated by service'),
+  's2v_cache_hits_total': ('counter', 'Cache hits by cache'),
+  's2v_cache_misses_total': ('counter', 'Cache misses by cache'),
+  's2v_cache_evictions_total': ('counter', 'Cache entries evicted for space by cache'),
+  's2v_cache_entries': ('gauge', 'Entries held by cache'),
+  's2v_singleflight_leaders_total': ('counter', 'Computations started by service'),
+  's2v_singleflight_coalesced_total': ('counter', 'Computations that waited for an identical in flight computation by service'),
+  's2v_singleflight_timeouts_total': ('counter', 'Waits for an in flight computation that timed out by service'),
+  's2v_singleflight_in_flight': ('gauge', 'Computations in flight by service'),
+}
+
+
+class S2vHistogram:
+
+  def __init__(self, buckets):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.sum = 0.0
+    self.lock = threading.Lock()
+    # store(part, value) writes through to the process' metrics file in multiprocess mode
+    self.store = None
+
+
+  def observe(self, value):
+    i = bisect_left(self.buckets, value)
+    with self.lock:
+      self.counts[i] += 1
+      self.sum += value
+      if self.store is not None:
+        self.store('bucket:{0}'.format(i), self.counts[i])
+        self.store('sum', self.sum)
+
+
+  # cumulative (le, count) pairs ending with +Inf, the sum and the count
+  def snapshot(self):
+    with self.lock:
+      counts = list(self.counts)
+      total = self.sum
+    cumulative = []
+    running = 0
+    for le, count in zip(list(self.buckets) + ['+Inf'], counts):
+      running += count
+      cumulative.append((le, running))
+    return cumulative, total, running
+
+
+class S2vCounter:
+
+  def __init__(self):
+    self.value = 0
+    self.lock = threading.Lock()
+    self.store = None
+
+
+  def inc(self, value=1):
+    with self.lock:
+      self.value += value
+      if self.store is not None:
+        self.store('', self.value)
+
+
+# the metric values of one process in a memory-mapped file, so other processes can read them:
+#
+#   used bytes (uint64) | entries ...
+#
+# an entry is the key's length (uint32), the utf-8 key padded to 8 bytes and its float64 value.
+# entries are only appended, an existing entry's value is overwritten in place. the file grows
+# by doubling when full
+class S2vMetricsFile:
+
+  def __init__(self, path):
+    self.path = path
+    self.lock = threading.Lock()
+    self.positions = {}
+    self.file = open(path, 'a+b')
+    size = max(os.path.getsize(path), METRICS_FILE_SIZE)
+    self.file.truncate(size)
+    self.mm = mmap.mmap(self.file.fileno(), size)
+    self.used = struct.unpack_from('<Q', self.mm, 0)[0] or 8
+    for key, _, position in metrics_file_entries(self.mm, self.used):
+      self.positions[key] = position
+
+
+  def set(self, key, value):
+    with self.lock:
+      position = self.positions.get(key)
+      if position is None:
+        position = self.append(key)
+      struct.pack_into('<d', self.mm, position, value)
+
+
+  def append(self, key):
+    encoded = key.encode('utf-8')
+    position = self.used + (4 + len(encoded) + 7) // 8 * 8
+    if position + 8 > len(self.mm):
+      size = len(self.mm)
+      while position + 8 > size:
+        size *= 2
+      self.mm.close()
+      self.file.truncate(size)
+      self.mm = mmap.mmap(self.file.fileno(), size)
+    struct.pack_into('<I', self.mm, self.used, len(encoded))
+    self.mm[self.used + 4:self.used + 4 + len(encoded)] = encoded
+    struct.pack_into('<d', self.mm, position, 0.0)
+    self.used = position + 8
+    # the entry is complete before readers see it
+    struct.pack_into('<Q', self.mm, 0, self.used)
+    self.positions[key] = position
+    return position
+
+
+# (key, value, value position) of the entries of a metrics file's contents
+def metrics_file_entries(data, used):
+  offset = 8
+  while offset < used:
+    length = struct.unpack_from('<I', data, offset)[0]
+    key = bytes(data[offset + 4:offset + 4 + length]).decode('utf-8')
+    position = offset + (4 + length + 7) // 8 * 8
+    yield key, struct.unpack_from('<d', data, position)[0], position
+    offset = position + 8
+
+
+# the entries of the metrics file at path as a dict of key: value
+def read_metrics_file(path):
+  with open(path, 'rb') as f:
+    data = f.read()
+  if len(data) < 8:
+    return {}
+  return { key: value for key, value, _ in metrics_file_entries(data, struct.unpack_from('<Q', data, 0)[0]) }
+
+
+def metrics_file_key(name, labels, part):
+  return json.dumps([name, list(map(list, labels)), part])
+
+
+def process_alive(pid):
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
+
+
+# times a stage into its histogram, and into the request's trace when it is traced
+class S2vStageTimer:
+  __slots__ = ('histogram', 'trace', 'service', 'stage', 'start')
+
+  def __init__(self, histogram, trace, service, stage):
+    self.histogram = histogram
+    self.trace = trace
+    self.service = service
+    self.stage = stage
+
+
+  def __enter__(self):
+    self.start = perf_counter()
+    return self
+
+
+  def __exit__(self, *exc):
+    seconds = perf_counter() - self.start
+    self.histogram.observe(seconds)
+    if self.trace is not None:
+      self.trace.step(self.service, self.stage, self.start, seconds)
+
+
+# in process metrics rendered in the prometheus text format. recording is a dict lookup plus an
+# uncontended lock around an increment, cheap enough to leave on. values that are already
+# counted elsewhere (cache and singleflight stats) are read by collectors when rendering
+# instead of being counted twice.
+#
+# every process keeps its own metrics. with multiprocess_dir (gunicorn workers) every process
+# also writes its values through to its own file there (S2vMetricsFile, created on first use
+# after a fork, its metrics start over from the ones inherited) and render sums the files of
+# all the processes, so a scrape answers for all of them whichever worker serves it. counters
+# and histograms of processes that have exited are kept, their gauges left out. collectors'
+# values are written to the file at most every COLLECTOR_FLUSH_SECONDS, see flush_collectors.
+# the collectors' counters of a forked process count from their values at the fork, the caches
+# it inherits come with the parent's stats
+#
+# nothing is recorded in a paused() block (the warmup before serving, see server.py), the
+# collectors' counters then count from their values at its end
+class S2vMetrics:
+
+  def __init__(self, buckets=DEFAULT_BUCKETS, multiprocess_dir=None):
+    self.buckets = buckets
+    self.multiprocess_dir = multiprocess_dir
+    self.series = {}
+    self.collectors = []
+    self.lock = threading.Lock()
+    self.pid = None
+    self.file = None
+    self.flushed = 0.0
+    self.recording = True
+    # (name, labels): value of the collectors' counters to count from
+    self.baseline = {}
+    if multiprocess_dir is not None:
+      forked_metrics.add(self)
+
+
+  def metric(self, name, labels, make):
+    if self.multiprocess_dir is not None and self.pid != os.getpid():
+      self.start_process()
+    key = (name, labels)
+    metric = self.series.get(key)
+    if metric is None:
+      if name not in METRICS:
+        raise KeyError('unknown metric {0}'.format(name))
+      with self.lock:
+        metric = self.series.get(key)
+        if metric is None:
+          metric = make()
+          if self.file is not None:
+            metric.store = self.file_store(name, labels)
+          self.series[key] = metric
+    return metric
+
+
+  # starts this process' metrics file, dropping the metrics inherited from the parent
+  def start_process(self):
+    with self.lock:
+      if self.pid == os.getpid():
+        return
+      os.makedirs(self.multiprocess_dir, exist_ok=True)
+      self.series = {}
+      self.file = S2vMetricsFile(os.path.join(self.multiprocess_dir, '{0}{1}.db'.format(METRICS_FILE_PREFIX, os.getpid())))
+      self.flushed = 0.0
+      self.pid = os.getpid()
+
+
+  # called in a forked child, see forked_metrics
+  def after_fork(self):
+    self.lock = threading.Lock()
+    self.baseline = self.collector_counters()
+
+
+  @contextmanager
+  def paused(self):
+    self.recording = False
+    try:
+      yield
+    finally:
+      self.baseline = self.collector_counters()
+      self.recording = True
+
+
+  def file_store(self, name, labels):
+    file = self.file
+    keys = {}
+    def store(part, value):
+      key = keys.get(part)
+      if key is None:
+        key = keys[part] = metrics_file_key(name, labels, part)
+      file.set(key, value)
+    return store
+
+
+  def observe(self, name, value, **labels):
+    if not self.recording:
+      return
+    self.metric(name, tuple(sorted(labels.items())), lambda: S2vHistogram(self.buckets)).observe(value)
+
+
+  def inc(self, name, value=1, **labels):
+    if not self.recording:
+      return
+    self.metric(name, tuple(sorted(labels.items())), S2vCounter).inc(value)
+
+
+  # times a with block into s2v_stage_duration_seconds (and the current trace, see s2v_trace)
+  def stage(self, service, stage):
+    if not self.recording:
+      return NO_METRICS.stage(service, stage)
+    return S2vStageTimer(self.metric(
+      's2v_stage_duration_seconds',
+      (('service', service), ('stage', stage)),
+      lambda: S2vHistogram(self.buckets),
+    ), current_trace(), service, stage)
+
+
+  # collector() returns (name, labels dict, value) samples of counters / gauges, read on render
+  def add_collector(self, collector):
+    self.collectors.append(collector)
+
+
+  def collected(self, baseline=True):
+    for collector in self.collectors:
+      for name, labels, value in collector():
+        if name not in METRICS:
+          raise KeyError('unknown metric {0}'.format(name))
+        labels = tuple(sorted(labels.items()))
+        if baseline and (name, labels) in self.baseline:
+          value -= self.baseline[(name, labels)]
+        yield name, labels, value
+
+
+  def collector_counters(self):
+    return { (name, labels): value for name, labels, value in self.collected(baseline=False) if METRICS[name][0] == 'counter' }
+
+
+  # writes the collectors' values to this process' metrics file in multiprocess mode, unless
+  # they were written less than COLLECTOR_FLUSH_SECONDS ago (force writes them anyway)
+  def flush_collectors(self, force=False):
+    if self.multiprocess_dir is None:
+      return
+    if self.pid != os.getpid():
+      self.start_process()
+    now = perf_counter()
+    if not force and now - self.flushed < COLLECTOR_FLUSH_SECONDS:
+      return
+    self.flushed = now
+    for name, labels, value in self.collected():
+      self.file.set(metrics_file_key(name, labels, ''), value)
+
+
+  # samples of this process, name: [(labels, S2vHistogram / S2vCounter / value)]
+  def process_samples(self):
+    samples = {}
+    with self.lock:
+      series = list(self.series.items())
+    for (name, labels), metric in series:
+      samples.setdefault(name, []).append((labels, metric))
+    for name, labels, value in self.collected():
+      samples.setdefault(name, []).append((labels, value))
+    return samples
+
+
+  # samples summed over the metrics files of multiprocess_dir
+  def multiprocess_samples(self):
+    self.flush_collectors(force=True)
+    histograms = {}
+    values = {}
+    for filename in sorted(os.listdir(self.multiprocess_dir)):
+      if not filename.startswith(METRICS_FILE_PREFIX):
+        continue
+      alive = process_alive(int(filename[len(METRICS_FILE_PREFIX):].split('.')[0]))
+      for key, value in read_metrics_file(os.path.join(self.multiprocess_dir, filename)).items():
+        name, labels, part = json.loads(key)
+        if name not in METRICS:
+          continue
+        labels = tuple(map(tuple, labels))
+        kind = METRICS[name][0]
+        if kind == 'gauge' and not alive:
+          continue
+        if kind == 'histogram':
+          histogram = histograms.get((name, labels))
+          if histogram is None:
+            histogram = histograms[(name, labels)] = S2vHistogram(self.buckets)
+          if part == 'sum':
+            histogram.sum += value
+          else:
+            histogram.counts[int(part.split(':')[1])] += int(value)
+        else:
+          values[(name, labels)] = values.get((name, labels), 0) + value
+    samples = {}
+    for (name, labels), metric in list(histograms.items()) + list(values.items()):
+      samples.setdefault(name, []).append((labels, metric))
+    return samples
+
+
+  def render(self):
+    samples = self.process_samples() if self.multiprocess_dir is None else self.multiprocess_samples()
+    lines = []
+    for name in sorted(samples):
+      kind, help_text = METRICS[name]
+      lines.append('# HELP {0} {1}'.format(name, help_text))
+      lines.append('# TYPE {0} {1}'.format(name, kind))
+      for labels, metric in sorted(samples[name], key=lambda x: x[0]):
+        if isinstance(metric, S2vHistogram):
+          cumulative, total, count = metric.snapshot()
+          for le, bucket_count in cumulative:
+            lines.append('{0}_bucket{1} {2}'.format(name, format_labels(labels + (('le', format_value(le)),)), bucket_count))
+          lines.append('{0}_sum{1} {2}'.format(name, format_labels(labels), format_value(total)))
+          lines.append('{0}_count{1} {2}'.format(name, format_labels(labels), count))
+        else:
+          value = metric.value if isinstance(metric, S2vCounter) else metric
+          if isinstance(value, float) and value.is_integer():
+            value = int(value)
+          lines.append('{0}{1} {2}'.format(name, format_labels(labels), format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+# S2vMetrics in multiprocess mode, see S2vMetrics.after_fork
+forked_metrics = weakref.WeakSet()
+os.register_at_fork(after_in_child=lambda: [metrics.after_fork() for metrics in list(forked_metrics)])
+
+
+# metrics that record nothing, the default of the services so they can always time their stages.
+# stages are still timed into the current trace when the request is traced
+class S2vNoMetrics:
+
+  def observe(self, name, value, **labels):
+    pass
+
+
+  def inc(self, name, value=1, **labels):
+    pass
+
+
+  def stage(self, service, stage):
+    trace = current_trace()
+    if trace is None:
+      return nullcontext()
+    return trace.stage(service, stage)
+
+
+NO_METRICS = S2vNoMetrics()
+
+
+def format_value(value):
+  if isinstance(value, str):
+    return value
+  return repr(value) if isinstance(value, float) else str(int(value))
+
+
+def format_labels(labels):
+  if not labels:
+    return ''
+  return '{' + ','.join('{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in labels) + '}'
+
+
+# collector of the hit / miss / eviction counts and size of S2vLruCaches, caches is a dict of name: cache
+def cache_collector(caches):
+  def collect():
+    for name, cache in caches.items():
+      if cache is None:
+        continue
+      stats = cache.stats()
+      yield 's2v_cache_hits_total', { 'cache': name }, stats['hits']
+      yield 's2v_cache_misses_total', { 'cache': name }, stats['misses']
+      yield 's2v_cache_evictions_total', { 'cache': name }, stats['evictions']
+      yield 's2v_cache_entries', { 'cache': name }, stats['size']
+  return collect
+
+
+# collector of the stats of S2vSingleflights, singleflights is a dict of service name: singleflight
+def singleflight_collector(singleflights):
+  def collect():
+    for name, singleflight in singleflights.items():
+      if singleflight is None:
+        continue
+      stats = singleflight.stats()
+      yield 's2v_singleflight_leaders_total', { 'service': name }, stats['leaders']
+      yield 's2v_singleflight_coalesced_total', { 'service': name }, stats['coalesced']
+      yield 's2v_singleflight_timeouts_total', { 'service': name }, stats['timeouts']
+      yield 's2v_singleflight_in_flight', { 'service': name }, stats['in_flight']
+  return collect
@@ -0,0 +1,159 @@
+import pytest
+import numpy as np
+from s2v_metrics import S2vMetrics, cache_collector, singleflight_collector
+
+def sample_lines(text, prefix):
+    return [line for line in text.splitlines() if line.startswith(prefix)]
+
+
+def test_histograms_render_cumulative_buckets():
+    metrics = S2vMetrics(buckets=(0.1, 1.0))
+    for value in [0.05, 0.1, 0.5, 2.0]:
+      metrics.observe('s2v_request_duration_seconds', value, endpoint='index')
+    text = metrics.render()
+    assert '# TYPE s2v_request_duration_seconds histogram' in text
+    assert sample_lines(text, 's2v_request_duration_seconds') == [
+      's2v_request_duration_seconds_bucket{endpoint="index",le="0.1"} 2',
+      's2v_request_duration_seconds_bucket{endpoint="index",le="1.0"} 3',
+      's2v_request_duration_seconds_bucket{endpoint="index",le="+Inf"} 4',
+      's2v_request_duration_seconds_sum{endpoint="index"} 2.65',
+      's2v_request_duration_seconds_count{endpoint="index"} 4',
+    ]
+
+
+def test_counters_stages_and_collectors():
+    from s2v_cache import S2vLruCache
+    from s2v_singleflight import S2vSingleflight
+    metrics = S2vMetrics()
+    metrics.inc('s2v_requests_total', endpoint='index', status=200)
+    metrics.inc('s2v_requests_total', endpoint='index', status=200)
+    metrics.inc('s2v_request_items_total', 5, endpoint='similarity')
+    with metrics.stage('synonyms', 'commonize'):
+      pass
+    cache = S2vLruCache(10)
+    cache.set('a', 1)
+    cache.lookup('a')
+    cache.lookup('b')
+    metrics.add_collector(cache_collector({ 'variations': cache, 'missing': None }))
+    singleflight = S2vSingleflight()
+    singleflight.do('k', lambda: 1)
+    metrics.add_collector(singleflight_collector({ 'synonyms': singleflight }))
+    text = metrics.render()
+    assert 's2v_requests_total{endpoint="index",status="200"} 2' in text
+    assert 's2v_request_items_total{endpoint="similarity"} 5' in text
+    assert 's2v_stage_duration_seconds_count{service="synonyms",stage="commonize"} 1' in text
+    assert 's2v_cache_hits_total{cache="variations"} 1' in text
+    assert 's2v_cache_misses_total{cache="variations"} 1' in text
+    assert 's2v_cache_entries{cache="variations"} 1' in text
+    assert 'cache="missing"' not in text
+    assert 's2v_singleflight_leaders_total{service="synonyms"} 1' in text
+    with pytest.raises(KeyError):
+      metrics.inc('s2v_unknown_total')
+
+
+def test_services_time_their_stages():
+    from sense2vec import Sense2Vec
+    from s2v_util import S2vUtil
+    from s2v_senses import S2vSenses
+    from s2v_key_case_and_sense_variations import S2vKeyCaseAndSenseVariations
+    from s2v_key_commonizer import S2vKeyCommonizer
+    from s2v_similarity import S2vSimilarity
+    from s2v_synonyms import S2vSynonyms
+    s2v = Sense2Vec(shape=(24, 4))
+    rng = np.random.default_rng(6)
+    for word in ['big', 'apple', 'pear', 'large', 'car', 'bus']:
+      for sense in ['NOUN', 'ADJ']:
+        s2v.add('{0}|{1}'.format(word, sense), rng.standard_normal(4).astype(np.float32))
+    metrics = S2vMetrics()
+    s2v_util = S2vUtil(s2v)
+    s2v_key_variations = S2vKeyCaseAndSenseVariations(s2v_util, S2vSenses(s2v_util, metrics=metrics))
+    synonyms = S2vSynonyms(s2v_util, s2v_key_variations, S2vKeyCommonizer(), allow_non_cached_keys=True, metrics=metrics)
+    similarity = S2vSimilarity(s2v_util, s2v_key_variations, S2vKeyCommonizer(), metrics=metrics)
+    synonyms.call_batch([['big|ADJ', 'apple|NOUN'], ['car|NOUN']], { 'n': 3, 'min-score': 0.1 })
+    similarity.call_batch([[['car|NOUN'], ['bus|NOUN']]])
+    text = metrics.render()
+    for service, stage in [
+      ('synonyms', 'commonize'), ('synonyms', 'variations'), ('synonyms', 'most_similar'), ('synonyms', 'filter'),
+      ('similarity', 'commonize'), ('similarity', 'variations'), ('similarity', 'scoring'), ('senses', 'sense_lookup'),
+    ]:
+      assert 's2v_stage_duration_seconds_count{{service="{0}",stage="{1}"}}'.format(service, stage) in text
+    assert sample_lines(text, 's2v_variation_combinations_total{service="synonyms"}')
+    assert sample_lines(text, 's2v_variation_combinations_total{service="similarity"}')
+
+
+def test_multiprocess_metrics_sum_every_process(tmp_path):
+    import os
+    from s2v_metrics import METRICS_FILE_SIZE
+    metrics = S2vMetrics(buckets=(0.1, 1.0), multiprocess_dir=str(tmp_path))
+    entries = [1]
+    metrics.add_collector(lambda: [('s2v_cache_entries', { 'cache': 'variations' }, len(entries))])
+    metrics.inc('s2v_requests_total', endpoint='index', status=200)
+    metrics.observe('s2v_request_duration_seconds', 0.05, endpoint='index')
+    pid = os.fork()
+    if pid == 0:
+      # a worker forked after the parent recorded, its metrics start over
+      try:
+        metrics.inc('s2v_requests_total', 2, endpoint='index', status=200)
+        metrics.observe('s2v_request_duration_seconds', 0.5, endpoint='index')
+        for i in range(2000):
+          metrics.inc('s2v_request_items_total', endpoint='label{0}'.format(i))
+        metrics.flush_collectors(force=True)
+      finally:
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.path.getsize(str(tmp_path / 's2v_metrics_{0}.db'.format(pid))) > METRICS_FILE_SIZE
+    metrics.inc('s2v_requests_total', endpoint='index', status=200)
+    entries.append(2)
+    text = metrics.render()
+    assert 's2v_requests_total{endpoint="index",status="200"} 4' in text
+    assert sample_lines(text, 's2v_request_duration_seconds') == [
+      's2v_request_duration_seconds_bucket{endpoint="index",le="0.1"} 1',
+      's2v_request_duration_seconds_bucket{endpoint="index",le="1.0"} 2',
+      's2v_request_duration_seconds_bucket{endpoint="index",le="+Inf"} 2',
+      's2v_request_duration_seconds_sum{endpoint="index"} 0.55',
+      's2v_request_duration_seconds_count{endpoint="index"} 2',
+    ]
+    assert 's2v_request_items_total{endpoint="label1999"} 1' in text
+    # the exited worker's gauges are left out
+    assert 's2v_cache_entries{cache="variations"} 2' in text
+
+
+def test_forked_process_does_not_report_inherited_cache_stats(tmp_path):
+    import os
+    from s2v_cache import S2vLruCache
+    cache = S2vLruCache(10)
+    metrics = S2vMetrics(multiprocess_dir=str(tmp_path))
+    metrics.add_collector(cache_collector({ 'variations': cache }))
+    cache.lookup('a')
+    cache.set('a', 1)
+    cache.lookup('a')
+    pid = os.fork()
+    if pid == 0:
+      # a worker inheriting the parent's cache, with one miss of its own
+      try:
+        cache.lookup('b')
+        metrics.flush_collectors(force=True)
+      finally:
+        os._exit(0)
+    os.waitpid(pid, 0)
+    text = metrics.render()
+    assert 's2v_cache_misses_total{cache="variations"} 2' in text
+    assert 's2v_cache_hits_total{cache="variations"} 1' in text
+
+
+def test_paused_metrics_record_nothing(tmp_path):
+    from s2v_cache import S2vLruCache
+    cache = S2vLruCache(10)
+    metrics = S2vMetrics(multiprocess_dir=str(tmp_path))
+    metrics.add_collector(cache_collector({ 'variations': cache }))
+    with metrics.paused():
+      cache.lookup('a')
+      metrics.inc('s2v_variation_combinations_total', 3, service='synonyms')
+      with metrics.stage('synonyms', 'variations'):
+        pass
+    assert list(tmp_path.iterdir()) == []
+    cache.lookup('b')
+    text = metrics.render()
+    assert 's2v_cache_misses_total{cache="variations"} 1' in text
+    assert 's2v_variation_combinations_total' not in text
+    assert 's2v_stage_duration_seconds' not in text
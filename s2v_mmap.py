@@ -0,0 +1,61 @@
+import json
+import struct
+import numpy as np
+
+# single file container for a set of named numpy arrays plus a small json header,
+# laid out so that every array can be memory-mapped straight from the file:
+#
+#   MAGIC (8 bytes) | header length (uint64) | json header | padding | array data ...
+#
+# each array starts on an ALIGNMENT boundary so the mapped views are aligned
+MAGIC = b'S2VMMAP1'
+ALIGNMENT = 64
+
+
+def _align(offset):
+  return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_arrays(path, arrays, meta=None):
+  arrays = { name: np.ascontiguousarray(a) for name, a in arrays.items() }
+  layout = {}
+  offset = 0
+  for name, a in arrays.items():
+    layout[name] = { 'dtype': a.dtype.str, 'shape': list(a.shape), 'offset': offset }
+    offset = _align(offset + a.nbytes)
+  header = json.dumps({ 'meta': meta or {}, 'arrays': layout }).encode('utf-8')
+  data_start = _align(len(MAGIC) + 8 + len(header))
+  with open(path, 'wb') as f:
+    f.write(MAGIC)
+    f.write(struct.pack('<Q', len(header)))
+    f.write(header)
+    for name, a in arrays.items():
+      f.seek(data_start + layout[name]['offset'])
+      f.write(a.tobytes())
+    f.truncate(data_start + offset)
+
+
+def read_header(path):
+  with open(path, 'rb') as f:
+    if f.read(len(MAGIC)) != MAGIC:
+      raise ValueError('not a s2v mmap file: {0}'.format(path))
+    header_len = struct.unpack('<Q', f.read(8))[0]
+    header = json.loads(f.read(header_len).decode('utf-8'))
+  header['data_start'] = _align(len(MAGIC) + 8 + header_len)
+  return header
+
+
+def read_arrays(path, mmap=True):
+  header = read_header(path)
+  arrays = {}
+  for name, spec in header['arrays'].items():
+    dtype = np.dtype(spec['dtype'])
+    shape = tuple(spec['shape'])
+    offset = header['data_start'] + spec['offset']
+    if int(np.prod(shape)) == 0:
+      arrays[name] = np.zeros(shape, dtype=dtype)
+    elif mmap:
+      arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+    else:
+      arrays[name] = np.fromfile(path, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape)
+  return header['meta'], arrays
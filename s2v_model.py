@@ -0,0 +1,32 @@
+import numpy as np
+import srsly
+from pathlib import Path
+from sense2vec import Sense2Vec
+from spacy.strings import StringStore
+from spacy.vectors import Vectors
+from thinc.api import NumpyOps
+
+
+# loads a sense2vec model directory the way Sense2Vec.from_disk does, except that with
+# mmap the vectors table is memory-mapped read only from the model's vectors file rather than
+# read into memory. the table then lives in the page cache, shared by every process serving
+# the model (gunicorn workers forked from a --preload master, or separate processes), and only
+# the pages that are actually used get read
+def load_s2v(model_path, mmap=False):
+  if not mmap:
+    return Sense2Vec().from_disk(model_path)
+  path = Path(model_path)
+  s2v = Sense2Vec()
+  vectors = Vectors()
+  vectors.data = np.load(str(path / 'vectors'), mmap_mode='r')
+  vectors.from_disk(path, exclude=['vectors'])
+  vectors.to_ops(NumpyOps())
+  s2v.vectors = vectors
+  s2v.cfg.update(srsly.read_json(path / 'cfg'))
+  if (path / 'freqs.json').exists():
+    s2v.freqs = dict(srsly.read_json(path / 'freqs.json'))
+  if (path / 'strings.json').exists():
+    s2v.strings = StringStore().from_disk(path / 'strings.json')
+  if (path / 'cache').exists():
+    s2v.cache = srsly.read_msgpack(path / 'cache')
+  return s2v
@@ -0,0 +1,26 @@
+import pytest
+import numpy as np
+from s2v_model import load_s2v
+
+@pytest.fixture
+def model_path(tmp_path):
+    from sense2vec import Sense2Vec
+    rng = np.random.default_rng(4)
+    s2v = Sense2Vec(shape=(12, 4))
+    for i in range(10):
+      s2v.add('word{0}|NOUN'.format(i), rng.standard_normal(4).astype(np.float32), freq=i + 1)
+    s2v.to_disk(tmp_path)
+    return tmp_path
+
+
+def test_memory_mapped_model_matches_the_loaded_model(model_path):
+    loaded = load_s2v(model_path)
+    mapped = load_s2v(model_path, mmap=True)
+    assert isinstance(mapped.vectors.data, np.memmap)
+    assert not mapped.vectors.data.flags.writeable
+    assert mapped.vectors.key2row == loaded.vectors.key2row
+    assert mapped.freqs == loaded.freqs
+    assert list(mapped.keys()) == list(loaded.keys())
+    np.testing.assert_array_equal(mapped.vectors.data, loaded.vectors.data)
+    assert mapped.similarity('word0|NOUN', 'word1|NOUN') == loaded.similarity('word0|NOUN', 'word1|NOUN')
+    assert mapped['word3|NOUN'].tolist() == loaded['word3|NOUN'].tolist()
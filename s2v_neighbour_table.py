@@ -0,0 +1,117 @@
+import os
+import numpy as np
+from s2v_util import s2v_model_fingerprint
+from s2v_mmap import write_arrays, read_arrays
+
+NEIGHBOUR_TABLE_FILENAME = 'neighbour_table.s2vmmap'
+NEIGHBOUR_TABLE_VERSION = 1
+DEFAULT_BUILD_BATCH_SIZE = 1024
+
+
+# precomputed top-k neighbours of every key in the model, a deeper replacement for the
+# most_similar cache bundled with the model (which only holds MAX_CACHED_KEYS entries):
+#
+# * indices / scores: (rows, depth) arrays, the neighbour rows of each row best first
+# * row_keys: the s2v key hash of each row
+class S2vNeighbourTable:
+
+  def __init__(self, s2v, arrays, meta):
+    self.s2v = s2v
+    self.indices = arrays['indices']
+    self.scores = arrays['scores']
+    self.row_keys = arrays['row_keys']
+    self.fingerprint = meta['fingerprint']
+    self.depth = self.indices.shape[1]
+
+
+  # computes the table with blocked matrix products, batch_size rows of the table are
+  # searched against the whole vocabulary at a time
+  @classmethod
+  def build(cls, s2v_vector_search, depth, batch_size=DEFAULT_BUILD_BATCH_SIZE, progress=None):
+    s2v = s2v_vector_search.s2v
+    rows_len = len(s2v_vector_search.row_keys)
+    indices = np.full((rows_len, depth), -1, dtype=np.int32)
+    scores = np.zeros((rows_len, depth), dtype=np.float32)
+    for start in range(0, rows_len, batch_size):
+      end = min(start + batch_size, rows_len)
+      batch_rows = np.arange(start, end)
+      batch_rows = batch_rows[s2v_vector_search.positions[batch_rows] >= 0]
+      if len(batch_rows) > 0:
+        rows, row_scores = s2v_vector_search.search(s2v_vector_search.row_vectors(batch_rows), depth + 1)
+        for i, row in enumerate(batch_rows):
+          not_self = rows[i] != row
+          found = rows[i][not_self][:depth]
+          indices[row, :len(found)] = found
+          scores[row, :len(found)] = row_scores[i][not_self][:depth]
+      if progress:
+        progress(end, rows_len)
+    arrays = { 'indices': indices, 'scores': scores, 'row_keys': s2v_vector_search.row_keys }
+    meta = { 'version': NEIGHBOUR_TABLE_VERSION, 'fingerprint': s2v_model_fingerprint(s2v) }
+    return cls(s2v, arrays, meta)
+
+
+  @classmethod
+  def load(cls, s2v, path, fingerprint=None):
+    meta, arrays = read_arrays(path)
+    if meta.get('version') != NEIGHBOUR_TABLE_VERSION:
+      raise ValueError('neighbour table {0} has version {1}, expected {2}'.format(path, meta.get('version'), NEIGHBOUR_TABLE_VERSION))
+    fingerprint = fingerprint or s2v_model_fingerprint(s2v)
+    if meta.get('fingerprint') != fingerprint:
+      raise ValueError('neighbour table {0} was built for a different model, rebuild it with scripts/build_s2v_indexes.py'.format(path))
+    return cls(s2v, arrays, meta)
+
+
+  # loads the table from the model directory, returns None when it is missing or stale
+  @classmethod
+  def load_if_exists(cls, s2v, model_path, fingerprint=None):
+    path = os.path.join(model_path, NEIGHBOUR_TABLE_FILENAME)
+    if not os.path.exists(path):
+      return None
+    try:
+      print('loading s2v neighbour table from', path)
+      return cls.load(s2v, path, fingerprint)
+    except ValueError as e:
+      print('ignoring s2v neighbour table:', e)
+      return None
+
+
+  def save(self, path):
+    write_arrays(path, {
+      'indices': self.indices,
+      'scores': self.scores,
+      'row_keys': self.row_keys,
+    }, {
+      'version': NEIGHBOUR_TABLE_VERSION,
+      'fingerprint': self.fingerprint,
+    })
+
+
+  # same contract as s2v.most_similar for a single key served from its cache
+  def most_similar(self, keys, n=10):
+    key = keys if isinstance(keys, str) else keys[-1]
+    result = self.most_similar_batch([key], n)[0]
+    if isinstance(result, Exception):
+      raise result
+    return result
+
+
+  # most_similar for each of keys, with one gather of their table rows. each entry is
+  # the most_similar result for that key or the ValueError it would raise
+  def most_similar_batch(self, keys, n=10):
+    n = min(n, self.depth)
+    results = [None] * len(keys)
+    valid = []
+    for i, key in enumerate(keys):
+      if key not in self.s2v:
+        results[i] = ValueError("Can't find key {0} in table".format(key))
+      else:
+        valid.append(i)
+    rows = np.fromiter((self.s2v.vectors.find(key=keys[i]) for i in valid), dtype=np.int64, count=len(valid))
+    for i, neighbours, scores in zip(valid, self.indices[rows, :n], self.scores[rows, :n]):
+      result = []
+      for neighbour, score in zip(neighbours, scores):
+        if neighbour < 0:
+          break
+        result.append((self.s2v.strings[int(self.row_keys[neighbour])], score))
+      results[i] = result
+    return results
@@ -0,0 +1,47 @@
+import pytest
+import numpy as np
+from s2v_vectors import S2vVectors
+from s2v_vector_search import S2vVectorSearch
+from s2v_neighbour_table import S2vNeighbourTable
+
+@pytest.fixture
+def s2v_mock():
+    from sense2vec import Sense2Vec
+    rng = np.random.default_rng(1)
+    s2v = Sense2Vec(shape=(45, 8))
+    for i in range(40):
+      s2v.add('word{0}|NOUN'.format(i), rng.standard_normal(8).astype(np.float32))
+    return s2v
+
+
+def test_table_matches_exact_search_for_every_key(s2v_mock, tmp_path):
+    search = S2vVectorSearch(S2vVectors(s2v_mock), block_size=16)
+    table = S2vNeighbourTable.build(search, 30, batch_size=8)
+    path = str(tmp_path / 'neighbour_table')
+    table.save(path)
+    loaded = S2vNeighbourTable.load(s2v_mock, path)
+    for key in s2v_mock.keys():
+      expected = search.most_similar([key], n=30)
+      for t in [table, loaded]:
+        result = t.most_similar([key], n=30)
+        assert [k for k, _ in result] == [k for k, _ in expected]
+        assert np.allclose([s for _, s in result], [s for _, s in expected], atol=1e-5)
+
+
+def test_synonyms_are_not_capped_at_max_cached_keys(s2v_mock):
+    from s2v_util import S2vUtil
+    from s2v_senses import S2vSenses
+    from s2v_key_case_and_sense_variations import S2vKeyCaseAndSenseVariations
+    from s2v_key_commonizer import S2vKeyCommonizer
+    from s2v_synonyms import S2vSynonyms, MAX_CACHED_KEYS
+    s2v_util = S2vUtil(s2v_mock)
+    table = S2vNeighbourTable.build(S2vVectorSearch(S2vVectors(s2v_mock)), 39)
+    synonyms_service = S2vSynonyms(
+      s2v_util,
+      S2vKeyCaseAndSenseVariations(s2v_util, S2vSenses(s2v_util)),
+      S2vKeyCommonizer(),
+      s2v_neighbour_table=table,
+    )
+    result = synonyms_service.call(['word0|NOUN'], { 'n': 30 })
+    assert len(result) == 30 > MAX_CACHED_KEYS
+    assert [r['score'] for r in result] == sorted([round(float(s), 3) for _, s in table.most_similar('word0|NOUN', n=39)], reverse=True)[:30]
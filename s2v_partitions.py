@@ -0,0 +1,116 @@
+import os
+import numpy as np
+from s2v_util import s2v_model_fingerprint
+from s2v_mmap import write_arrays, read_arrays
+from s2v_key_table import S2vKeyTable, GENERIC_SENSES
+
+PARTITIONS_FILENAME = 'partitions.s2vmmap'
+PARTITIONS_VERSION = 1
+
+
+def partition_name(generic_sense, is_proper):
+  return '{0}:{1}'.format(generic_sense, 'proper' if is_proper else 'common')
+
+
+# the vocabulary split by generic sense (S2vUtil.get_generic_sense) and properness
+# (S2vUtil.phrase_is_proper), the same properties synonyms are filtered on, so a search
+# can be limited to the partitions whose keys it would keep:
+#
+# * rows: the s2v rows of every key, grouped by partition
+# * offsets: partition i holds rows[offsets[i]:offsets[i+1]]
+# * unit / scales: optional, the unit vectors of rows in the same order as the S2vVectors they
+#   were built from stores them (float32, or quantized codes with int8 scales), for a search to
+#   scan memory-mapped instead of laying out a copy of the table at startup
+class S2vPartitions:
+
+  def __init__(self, arrays, meta):
+    self.rows = arrays['rows']
+    self.offsets = arrays['offsets']
+    self.unit = arrays.get('unit')
+    self.scales = arrays.get('scales')
+    self.names = meta['names']
+    self.fingerprint = meta['fingerprint']
+    self.ranges = {
+      name: (int(self.offsets[i]), int(self.offsets[i + 1]))
+      for i, name in enumerate(self.names)
+    }
+
+
+  # with s2v_vectors the unit vectors are laid out along with the rows
+  @classmethod
+  def build(cls, s2v_util, s2v_key_table=None, s2v_vectors=None):
+    s2v = s2v_util.s2v
+    names = [partition_name(g, p) for g in GENERIC_SENSES for p in [False, True]]
+    if s2v_key_table is None:
+      s2v_key_table = S2vKeyTable.build(s2v_util)
+    rows = np.flatnonzero(s2v_key_table.row_keys != 0)
+    # names are ordered generic sense by generic sense, common then proper
+    partitions = s2v_key_table.generic_senses[rows].astype(np.int64) * 2 + s2v_key_table.is_propers[rows]
+    order = np.lexsort((rows, partitions))
+    offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(partitions, minlength=len(names)))
+    arrays = { 'rows': rows[order], 'offsets': offsets }
+    if s2v_vectors is not None:
+      arrays['unit'], scales = s2v_vectors.unit_rows(arrays['rows'])
+      if scales is not None:
+        arrays['scales'] = scales
+    meta = { 'version': PARTITIONS_VERSION, 'fingerprint': s2v_model_fingerprint(s2v), 'names': names }
+    return cls(arrays, meta)
+
+
+  @classmethod
+  def load(cls, s2v, path, fingerprint=None):
+    meta, arrays = read_arrays(path)
+    if meta.get('version') != PARTITIONS_VERSION:
+      raise ValueError('partitions {0} have version {1}, expected {2}'.format(path, meta.get('version'), PARTITIONS_VERSION))
+    fingerprint = fingerprint or s2v_model_fingerprint(s2v)
+    if meta.get('fingerprint') != fingerprint:
+      raise ValueError('partitions {0} were built for a different model, rebuild them with scripts/build_s2v_indexes.py'.format(path))
+    return cls(arrays, meta)
+
+
+  # loads the partitions from the model directory, returns None when missing or stale
+  @classmethod
+  def load_if_exists(cls, s2v, model_path, fingerprint=None):
+    path = os.path.join(model_path, PARTITIONS_FILENAME)
+    if not os.path.exists(path):
+      return None
+    try:
+      print('loading s2v partitions from', path)
+      return cls.load(s2v, path, fingerprint)
+    except ValueError as e:
+      print('ignoring s2v partitions:', e)
+      return None
+
+
+  def save(self, path):
+    arrays = { 'rows': self.rows, 'offsets': self.offsets }
+    if self.unit is not None:
+      arrays['unit'] = self.unit
+    if self.scales is not None:
+      arrays['scales'] = self.scales
+    write_arrays(path, arrays, {
+      'version': PARTITIONS_VERSION,
+      'fingerprint': self.fingerprint,
+      'names': self.names,
+    })
+
+
+  # whether the laid out unit vectors are stored the way s2v_vectors stores its table
+  def has_unit_of(self, s2v_vectors):
+    return self.unit is not None and self.unit.dtype == s2v_vectors.unit.dtype and (self.scales is None) == (s2v_vectors.scales is None)
+
+
+  # names of the partitions holding keys of any of generic_senses and of the given
+  # properness, None for either means no restriction
+  def select(self, generic_senses=None, is_proper=None):
+    return [
+      partition_name(g, p)
+      for g in (generic_senses or GENERIC_SENSES)
+      for p in ([False, True] if is_proper is None else [is_proper])
+    ]
+
+
+  # the number of keys in the named partitions, or in all of them
+  def size(self, names=None):
+    return sum(map(lambda x: self.ranges[x][1] - self.ranges[x][0], self.names if names is None else names))
@@ -0,0 +1,126 @@
+import pytest
+import numpy as np
+from s2v_util import S2vUtil
+from s2v_vectors import S2vVectors
+from s2v_vector_search import S2vVectorSearch
+from s2v_partitions import S2vPartitions
+from s2v_key_table import S2vKeyTable
+
+@pytest.fixture
+def s2v_mock():
+    from sense2vec import Sense2Vec
+    rng = np.random.default_rng(2)
+    s2v = Sense2Vec(shape=(64, 8))
+    for i in range(15):
+      s2v.add('word{0}|NOUN'.format(i), rng.standard_normal(8).astype(np.float32))
+      s2v.add('Word{0}|PROPN'.format(i), rng.standard_normal(8).astype(np.float32))
+      s2v.add('word{0}|ADJ'.format(i), rng.standard_normal(8).astype(np.float32))
+      s2v.add('word{0}|VERB'.format(i), rng.standard_normal(8).astype(np.float32))
+    return s2v
+
+
+def test_partitions_group_keys_by_generic_sense_and_properness(s2v_mock):
+    partitions = S2vPartitions.build(S2vUtil(s2v_mock))
+    search = S2vVectorSearch(S2vVectors(s2v_mock), s2v_partitions=partitions)
+    for name, (start, end) in partitions.ranges.items():
+      keys = [s2v_mock.strings[int(search.row_keys[row])] for row in partitions.rows[start:end]]
+      if name == 'n:common':
+        assert sorted(keys) == sorted('word{0}|NOUN'.format(i) for i in range(15))
+      elif name == 'n:proper':
+        assert sorted(keys) == sorted('Word{0}|PROPN'.format(i) for i in range(15))
+      elif name in ['a:common', 'v:common']:
+        assert len(keys) == 15
+      else:
+        assert keys == []
+
+
+def test_partitioned_search_only_scans_the_selected_partitions(s2v_mock):
+    partitions = S2vPartitions.build(S2vUtil(s2v_mock))
+    search = S2vVectorSearch(S2vVectors(s2v_mock), block_size=4, s2v_partitions=partitions)
+    unpartitioned = S2vVectorSearch(S2vVectors(s2v_mock))
+    result = search.most_similar(['word0|NOUN'], n=10, partitions=partitions.select(['n'], False))
+    expected = [r for r in unpartitioned.most_similar(['word0|NOUN'], n=60) if r[0].endswith('|NOUN')][:10]
+    assert [k for k, _ in result] == [k for k, _ in expected]
+    # the same keys, scores may differ in the last bit as the blocks are multiplied with different kernels
+    unpartitioned_result = unpartitioned.most_similar(['word0|NOUN'], n=20)
+    partitioned_result = search.most_similar(['word0|NOUN'], n=20)
+    assert [k for k, _ in unpartitioned_result] == [k for k, _ in partitioned_result]
+    assert np.allclose([s for _, s in unpartitioned_result], [s for _, s in partitioned_result], atol=1e-6)
+
+
+def test_synonyms_filtered_on_input_sense_are_not_under_filled(s2v_mock):
+    from s2v_senses import S2vSenses
+    from s2v_key_case_and_sense_variations import S2vKeyCaseAndSenseVariations
+    from s2v_key_commonizer import S2vKeyCommonizer
+    from s2v_synonyms import S2vSynonyms
+    s2v_util = S2vUtil(s2v_mock)
+    s2v_key_variations = S2vKeyCaseAndSenseVariations(s2v_util, S2vSenses(s2v_util))
+    partitions = S2vPartitions.build(s2v_util)
+    synonyms_service = S2vSynonyms(
+      s2v_util,
+      s2v_key_variations,
+      S2vKeyCommonizer(),
+      s2v_vector_search=S2vVectorSearch(S2vVectors(s2v_mock), s2v_partitions=partitions),
+    )
+    req_args = { 'n': 12, 'match-input-sense': 1 }
+    result = synonyms_service.call({ 'phrase': ['word0|ADJ'], 'is_proper': False }, req_args)
+    assert len(result) == 12
+    assert all(r['sense'] == 'ADJ' for r in result)
+
+
+def test_synonyms_only_search_partitions_that_drop_candidates(s2v_mock):
+    from s2v_senses import S2vSenses
+    from s2v_key_case_and_sense_variations import S2vKeyCaseAndSenseVariations
+    from s2v_key_commonizer import S2vKeyCommonizer
+    from s2v_neighbour_table import S2vNeighbourTable
+    from s2v_synonyms import S2vSynonyms
+    s2v_util = S2vUtil(s2v_mock)
+    partitions = S2vPartitions.build(s2v_util)
+    search = S2vVectorSearch(S2vVectors(s2v_mock), s2v_partitions=partitions)
+    synonyms_service = S2vSynonyms(
+      s2v_util,
+      S2vKeyCaseAndSenseVariations(s2v_util, S2vSenses(s2v_util)),
+      S2vKeyCommonizer(),
+      s2v_vector_search=search,
+      s2v_neighbour_table=S2vNeighbourTable.build(search, 30),
+    )
+    d = { 'phrase': [{ 'wordsense': 'word0|ADJ', 'required': True }], 'is_proper': None }
+    # no sense or properness filter
+    assert synonyms_service.search_partitions(d, ['word0|ADJ'], {}) is None
+    common = dict(d, is_proper=False)
+    assert synonyms_service.search_partitions(common, ['word0|ADJ'], {}) == partitions.select(None, False)
+    # without proper keys in the model the common partitions hold every key
+    key_table = S2vKeyTable.build(s2v_util)
+    key_table.is_propers[:] = False
+    search.s2v_partitions = S2vPartitions.build(s2v_util, key_table)
+    assert synonyms_service.search_partitions(common, ['word0|ADJ'], {}) is None
+    search.s2v_partitions = partitions
+    selected = synonyms_service.search_partitions(common, ['word0|ADJ'], { 'match-input-sense': 1 })
+    assert selected == ['a:common']
+    # a quarter of the 30 neighbours would be left for 20 wanted, searched in the partition
+    assert synonyms_service.lookup_key(['word0|ADJ'], 10, selected) == (('word0|ADJ',), 20, ('a:common',))
+    # three quarters are plenty for 10 wanted, served from the neighbour table
+    three_senses = partitions.select(['n', 'a', 'v'], False)
+    assert synonyms_service.lookup_key(['word0|ADJ'], 5, three_senses) == (('word0|ADJ',), 30, None)
+    assert synonyms_service.lookup_key(['word0|ADJ', 'word1|NOUN'], 5, three_senses) == (('word0|ADJ', 'word1|NOUN'), 10, tuple(three_senses))
+
+
+@pytest.mark.parametrize('dtype', [None, 'int8'])
+def test_partitioned_search_scans_the_partitions_memory_mapped_vectors(s2v_mock, tmp_path, dtype):
+    from s2v_quantized_vectors import S2vQuantizedVectors
+    s2v_util = S2vUtil(s2v_mock)
+    s2v_vectors = S2vVectors(s2v_mock)
+    if dtype:
+      s2v_vectors = S2vVectors(s2v_mock, quantized=S2vQuantizedVectors.build(s2v_vectors, dtype))
+    path = str(tmp_path / 'partitions.s2vmmap')
+    S2vPartitions.build(s2v_util, s2v_vectors=s2v_vectors).save(path)
+    partitions = S2vPartitions.load(s2v_mock, path)
+    assert isinstance(partitions.unit, np.memmap)
+    search = S2vVectorSearch(s2v_vectors, block_size=4, s2v_partitions=partitions)
+    assert search.matrix is partitions.unit
+    # without laid out vectors every block is gathered from the table
+    gathering = S2vVectorSearch(s2v_vectors, block_size=4, s2v_partitions=S2vPartitions.build(s2v_util))
+    assert gathering.matrix is None
+    selected = partitions.select(['n'], None)
+    assert search.most_similar(['word0|NOUN'], n=10, partitions=selected) == gathering.most_similar(['word0|NOUN'], n=10, partitions=selected)
+    assert search.most_similar(['word0|NOUN', 'word1|ADJ'], n=20) == gathering.most_similar(['word0|NOUN', 'word1|ADJ'], n=20)
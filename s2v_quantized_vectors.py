@@ -0,0 +1,99 @@
+import os
+import numpy as np
+from s2v_util import s2v_model_fingerprint
+from s2v_mmap import write_arrays, read_arrays
+
+QUANTIZED_VECTORS_FILENAME = 'quantized_vectors.s2vmmap'
+QUANTIZED_VECTORS_VERSION = 1
+QUANTIZED_DTYPES = ['float16', 'int8']
+QUANTIZE_BLOCK_SIZE = 65536
+
+
+# quantizes unit vectors to float16, or to int8 codes with a float32 scale per row
+# (the row's largest absolute component / 127), returns (codes, scales or None)
+def quantize(unit, dtype):
+  if dtype == 'float16':
+    return unit.astype(np.float16), None
+  if dtype == 'int8':
+    scales = np.abs(unit).max(axis=1) / 127
+    scales[scales == 0] = 1.0
+    codes = np.rint(unit / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+  raise ValueError('unknown quantized dtype {0}, expected one of {1}'.format(dtype, QUANTIZED_DTYPES))
+
+
+# the unit normalised vectors table stored as float16 (half the memory of float32) or
+# per row scaled int8 (a quarter), for S2vVectors to compute similarity and search on:
+#
+# * codes: the quantized unit vector of each row
+# * scales: int8 only, the scale of each row's codes
+# * norms / nonzero: S2vVectors' norm and zero component flag of each row, kept in
+#   full precision so the cosine_similarity quirks stay exact
+class S2vQuantizedVectors:
+
+  def __init__(self, arrays, meta):
+    self.codes = arrays['codes']
+    self.scales = arrays.get('scales')
+    self.norms = arrays['norms']
+    self.nonzero = arrays['nonzero']
+    self.dtype = meta['dtype']
+    self.fingerprint = meta['fingerprint']
+
+
+  @classmethod
+  def build(cls, s2v_vectors, dtype):
+    if dtype not in QUANTIZED_DTYPES:
+      raise ValueError('unknown quantized dtype {0}, expected one of {1}'.format(dtype, QUANTIZED_DTYPES))
+    unit = s2v_vectors.unit
+    codes = np.empty(unit.shape, dtype=np.dtype(dtype))
+    scales = np.empty(unit.shape[0], dtype=np.float32) if dtype == 'int8' else None
+    for start in range(0, unit.shape[0], QUANTIZE_BLOCK_SIZE):
+      block_codes, block_scales = quantize(s2v_vectors.unit_rows(np.arange(start, min(start + QUANTIZE_BLOCK_SIZE, unit.shape[0])))[0], dtype)
+      codes[start:start + len(block_codes)] = block_codes
+      if scales is not None:
+        scales[start:start + len(block_codes)] = block_scales
+    arrays = { 'codes': codes, 'norms': s2v_vectors.norms, 'nonzero': s2v_vectors.nonzero }
+    if scales is not None:
+      arrays['scales'] = scales
+    meta = { 'version': QUANTIZED_VECTORS_VERSION, 'fingerprint': s2v_model_fingerprint(s2v_vectors.s2v), 'dtype': dtype }
+    return cls(arrays, meta)
+
+
+  @classmethod
+  def load(cls, s2v, path, fingerprint=None):
+    meta, arrays = read_arrays(path)
+    if meta.get('version') != QUANTIZED_VECTORS_VERSION:
+      raise ValueError('quantized vectors {0} have version {1}, expected {2}'.format(path, meta.get('version'), QUANTIZED_VECTORS_VERSION))
+    fingerprint = fingerprint or s2v_model_fingerprint(s2v)
+    if meta.get('fingerprint') != fingerprint:
+      raise ValueError('quantized vectors {0} were built for a different model, rebuild them with scripts/quantize_s2v.py'.format(path))
+    return cls(arrays, meta)
+
+
+  # loads the quantized vectors from the model directory, returns None when missing or stale
+  @classmethod
+  def load_if_exists(cls, s2v, model_path, fingerprint=None):
+    path = os.path.join(model_path, QUANTIZED_VECTORS_FILENAME)
+    if not os.path.exists(path):
+      return None
+    try:
+      print('loading s2v quantized vectors from', path)
+      return cls.load(s2v, path, fingerprint)
+    except ValueError as e:
+      print('ignoring s2v quantized vectors:', e)
+      return None
+
+
+  def save(self, path):
+    arrays = { 'codes': self.codes, 'norms': self.norms, 'nonzero': self.nonzero }
+    if self.scales is not None:
+      arrays['scales'] = self.scales
+    write_arrays(path, arrays, {
+      'version': QUANTIZED_VECTORS_VERSION,
+      'fingerprint': self.fingerprint,
+      'dtype': self.dtype,
+    })
+
+
+  def nbytes(self):
+    return self.codes.nbytes + (0 if self.scales is None else self.scales.nbytes)
@@ -0,0 +1,60 @@
+import pytest
+import numpy as np
+from s2v_vectors import S2vVectors
+from s2v_vector_search import S2vVectorSearch
+from s2v_quantized_vectors import S2vQuantizedVectors
+
+@pytest.fixture
+def s2v_mock():
+    from sense2vec import Sense2Vec
+    rng = np.random.default_rng(4)
+    s2v = Sense2Vec(shape=(220, 16))
+    for i in range(200):
+      s2v.add('word{0}|NOUN'.format(i), rng.standard_normal(16).astype(np.float32))
+    s2v.add('same|NOUN', s2v['word0|NOUN'])
+    return s2v
+
+
+@pytest.mark.parametrize('dtype,atol', [('float16', 1e-3), ('int8', 1e-2)])
+def test_similarity_and_search_on_quantized_vectors_stay_close_to_float32(s2v_mock, dtype, atol):
+    s2v_vectors = S2vVectors(s2v_mock)
+    quantized = S2vQuantizedVectors.build(s2v_vectors, dtype)
+    assert quantized.codes.dtype == np.dtype(dtype)
+    quantized_vectors = S2vVectors(s2v_mock, quantized=quantized)
+    phrases = [['word{0}|NOUN'.format(i)] for i in range(20)] + [['word1|NOUN', 'word2|NOUN'], ['same|NOUN']]
+    expected = s2v_vectors.similarity_matrix(phrases, phrases)
+    scores = quantized_vectors.similarity_matrix(phrases, phrases)
+    assert np.allclose(scores, expected, atol=atol)
+    # the cosine_similarity quirks are kept with full precision norms
+    assert scores[0][-1] == 1.0
+
+    search = S2vVectorSearch(s2v_vectors, block_size=32)
+    quantized_search = S2vVectorSearch(quantized_vectors, block_size=32)
+    for keys in [['word3|NOUN'], ['word4|NOUN', 'word5|NOUN']]:
+      expected_result = search.most_similar(keys, n=10)
+      result = quantized_search.most_similar(keys, n=10)
+      assert len(set(k for k, _ in result) & set(k for k, _ in expected_result)) >= 8
+      assert result[0][0] == expected_result[0][0]
+      assert abs(result[0][1] - expected_result[0][1]) < atol
+
+
+def test_quantized_vectors_round_trip_through_disk(s2v_mock, tmp_path):
+    quantized = S2vQuantizedVectors.build(S2vVectors(s2v_mock), 'int8')
+    path = str(tmp_path / 'quantized_vectors.s2vmmap')
+    quantized.save(path)
+    loaded = S2vQuantizedVectors.load(s2v_mock, path)
+    assert loaded.dtype == 'int8'
+    assert np.array_equal(loaded.codes, quantized.codes)
+    assert np.array_equal(loaded.scales, quantized.scales)
+    assert np.array_equal(loaded.norms, quantized.norms)
+    s2v_mock.add('new|NOUN', np.ones(16, dtype=np.float32))
+    with pytest.raises(ValueError):
+      S2vQuantizedVectors.load(s2v_mock, path)
+
+
+def test_quantized_vectors_cant_be_normalized_in_place(s2v_mock):
+    quantized = S2vQuantizedVectors.build(S2vVectors(s2v_mock), 'float16')
+    with pytest.raises(ValueError):
+      S2vVectors(s2v_mock, normalize_in_place=True, quantized=quantized)
+    with pytest.raises(ValueError):
+      S2vQuantizedVectors.build(S2vVectors(s2v_mock), 'int4')
@@ -0,0 +1,48 @@
+import random
+import numpy as np
+
+
+# sense -> key buckets, derived from the caseless index's per-entry sense ids at load so
+# that sampling a key with a given sense is a single draw from the right bucket.
+#
+# by default draws are random, pass a seed to make the sequence of draws reproducible,
+# or deterministic=True to always return the most frequent key of the sense
+class S2vSenseBuckets:
+
+  def __init__(self, s2v_caseless_index, seed=None, deterministic=False):
+    self.s2v = s2v_caseless_index.s2v
+    self.sense_names = s2v_caseless_index.sense_names
+    self.deterministic = deterministic
+    self.random = random.Random(seed)
+    senses = np.asarray(s2v_caseless_index.entry_senses)
+    order = np.argsort(senses, kind='stable')
+    self.bucket_keys = np.asarray(s2v_caseless_index.entry_keys)[order]
+    offsets = np.zeros(len(self.sense_names) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(senses, minlength=len(self.sense_names)))
+    self.buckets = {
+      sense: (int(offsets[i]), int(offsets[i + 1]))
+      for i, sense in enumerate(self.sense_names)
+    }
+    self.most_frequent = {}
+
+
+  def bucket(self, sense):
+    start, end = self.buckets.get(sense, (0, 0))
+    return self.bucket_keys[start:end]
+
+
+  def sample(self, sense):
+    keys = self.bucket(sense)
+    if len(keys) <= 0:
+      return None
+    if self.deterministic:
+      return self.most_frequent_key(sense)
+    return self.s2v.strings[int(keys[self.random.randrange(len(keys))])]
+
+
+  def most_frequent_key(self, sense):
+    if not sense in self.most_frequent:
+      keys = self.bucket(sense)
+      freqs = np.fromiter((self.s2v.freqs.get(int(k), -1) for k in keys), dtype=np.int64, count=len(keys))
+      self.most_frequent[sense] = self.s2v.strings[int(keys[int(np.argmax(freqs))])]
+    return self.most_frequent[sense]
@@ -0,0 +1,37 @@
+import pytest
+from s2v_sense_buckets import S2vSenseBuckets
+
+@pytest.fixture
+def s2v_caseless_index():
+    from sense2vec import Sense2Vec
+    from s2v_caseless_index import S2vCaselessIndex
+    import numpy as np
+    s2v = Sense2Vec(shape=(8, 4))
+    s2v.add('New_York|GPE', np.asarray([1, 1, 1, 1], dtype=np.float32), 10)
+    s2v.add('New_York|NOUN', np.asarray([1, 2, 1, 1], dtype=np.float32), 5)
+    s2v.add('big|ADJ', np.asarray([2, 5, 4, 2], dtype=np.float32), 20)
+    s2v.add('BIG|ADJ', np.asarray([2, 5, 4, 1], dtype=np.float32), 30)
+    s2v.add('apple|NOUN', np.asarray([1, 3, 9, 3], dtype=np.float32), 50)
+    s2v.add('big_apple|NOUN', np.asarray([6, 6, 6, 6], dtype=np.float32), 1)
+    return S2vCaselessIndex.build(s2v)
+
+
+def test_sample_draws_from_the_requested_sense(s2v_caseless_index):
+    buckets = S2vSenseBuckets(s2v_caseless_index)
+    for _ in range(20):
+        assert buckets.sample('NOUN') in ['New_York|NOUN', 'apple|NOUN', 'big_apple|NOUN']
+        assert buckets.sample('ADJ') in ['big|ADJ', 'BIG|ADJ']
+        assert buckets.sample('GPE') == 'New_York|GPE'
+    assert buckets.sample('VERB') is None
+
+
+def test_seeded_samples_are_reproducible(s2v_caseless_index):
+    a = S2vSenseBuckets(s2v_caseless_index, seed=7)
+    b = S2vSenseBuckets(s2v_caseless_index, seed=7)
+    assert [a.sample('NOUN') for _ in range(10)] == [b.sample('NOUN') for _ in range(10)]
+
+
+def test_deterministic_sample_is_the_most_frequent_key_of_the_sense(s2v_caseless_index):
+    buckets = S2vSenseBuckets(s2v_caseless_index, deterministic=True)
+    assert buckets.sample('NOUN') == 'apple|NOUN'
+    assert buckets.sample('ADJ') == 'BIG|ADJ'
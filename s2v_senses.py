@@ -1,21 +1,15 @@
+from s2v_caseless_index import S2vCaselessIndex
+from s2v_metrics import NO_METRICS
+
 
 class S2vSenses:
 
-  def __init__(self, s2v_util):
+  # metrics (a S2vMetrics) times the caseless index lookups
+
+  def __init__(self, s2v_util, s2v_caseless_index=None, metrics=None):
     self.s2v_util = s2v_util
-    self.s2v_caseless_dict = self.build_caseless_dict()
-
-
-  def build_caseless_dict(self):
-    result = {}
-    print('loading caseless s2v dict..')
-    for key in self.s2v_util.s2v.keys():
-      word, sense = self.s2v_util.s2v.split_key(key)
-      word_lower = word.lower().replace('_', ' ')
-      if not word_lower in result:
-        result[word_lower] = []
-      result[word_lower].append(key)
-    return result
+    self.metrics = metrics or NO_METRICS
+    self.s2v_caseless_index = s2v_caseless_index or S2vCaselessIndex.build(self.s2v_util.s2v)
 
 
   def get_noun_based_senses(self, word, whitelist=None):
@@ -24,15 +18,15 @@ class S2vSenses:
 
     if not whitelist:
       whitelist = self.s2v_util.s2v_noun_tags
-    
-    shortlist = self.s2v_caseless_dict[word] if word in self.s2v_caseless_dict else None
+
+    with self.metrics.stage('senses', 'sense_lookup'):
+      shortlist = self.s2v_caseless_index.get(word)
     if not shortlist:
       return result
 
     noun_keys = []
     propn_keys = []
-    for key in shortlist:
-      w, sense = self.s2v_util.s2v.split_key(key)
+    for key, sense in shortlist:
       if sense in whitelist:
         if sense == 'NOUN':
           noun_keys.append(key)
@@ -47,17 +41,17 @@ class S2vSenses:
   def get_adjective_based_senses(self, word, whitelist=None):
     result = []
     word = word.lower()
-    
+
     if not whitelist:
       whitelist = self.s2v_util.s2v_adj_tags
-    
-    shortlist = self.s2v_caseless_dict[word] if word in self.s2v_caseless_dict else None
+
+    with self.metrics.stage('senses', 'sense_lookup'):
+      shortlist = self.s2v_caseless_index.get(word)
     if not shortlist:
       return result
 
-    for key in shortlist:
-      w, sense = self.s2v_util.s2v.split_key(key)
+    for key, sense in shortlist:
       if sense in whitelist:
         result.append(key)
 
-    return result
\ No newline at end of file
+    return result
@@ -1,21 +1,72 @@
 import os
+import numpy as np
+from s2v_vectors import S2vVectors
+from s2v_util import dedup, scatter, dedup_stats
+from s2v_metrics import NO_METRICS
+from s2v_trace import current_trace
 
 
 class S2vSimilarity:
 
-  def __init__(self, s2v_util, s2v_key_variations, s2v_key_commonizer):
+  # result_cache (a S2vLruCache) caches scores across requests, keyed on the commonized inputs in
+  # either order (the score is symmetric) and the attempt-phrase-join-for-compound-phrases arg
+  #
+  # singleflight (a S2vSingleflight) coalesces concurrent scoring of the same pair (the result
+  # cache key) into one, the other threads wait for its score
+  #
+  # metrics (a S2vMetrics) times the commonize, variations and scoring stages
+  #
+  # traced requests (see s2v_trace) skip the result cache and singleflight, and record the
+  # score of every variation pair
+
+  def __init__(self, s2v_util, s2v_key_variations, s2v_key_commonizer, s2v_vectors=None, result_cache=None, singleflight=None, metrics=None):
     self.s2v_util = s2v_util
+    self.metrics = metrics or NO_METRICS
+    self.result_cache = result_cache
+    self.singleflight = singleflight
     self.s2v_key_variations = s2v_key_variations
     self.s2v_key_commonizer = s2v_key_commonizer
-    self.req_args = {}
+    self.s2v_vectors = s2v_vectors or S2vVectors(self.s2v_util.s2v)
 
 
   def call(self, k1, k2, req_args={}):
-    self.req_args = req_args
+    with self.metrics.stage('similarity', 'commonize'):
+      k1_common_input, k2_common_input = self.commonize_input(k1), self.commonize_input(k2)
+    return self.score(k1_common_input, k2_common_input, req_args)
+
+
+  # similarity for every (k1, k2) pair of a request, the same results as calling call for each of
+  # them. pairs that are identical once commonized (in either order) are scored once.
+  #
+  # stats (a dict) is filled with the number of pairs, distinct pairs and deduplicated pairs
+  def call_batch(self, pairs, req_args={}, stats=None):
+    with self.metrics.stage('similarity', 'commonize'):
+      common_inputs = list(map(lambda x: (self.commonize_input(x[0]), self.commonize_input(x[1])), pairs))
+    common_inputs, positions = dedup(common_inputs, lambda x: self.result_cache_key(x[0], x[1], req_args))
+    if stats is not None:
+      stats.update(dedup_stats(len(pairs), len(common_inputs)))
+    return scatter(list(map(lambda x: self.score(x[0], x[1], req_args), common_inputs)), positions)
+
+
+  def score(self, k1_common_input, k2_common_input, req_args):
+    if self.singleflight is None or current_trace() is not None:
+      return self.cached_score(k1_common_input, k2_common_input, req_args)
+    return self.singleflight.do(
+      self.result_cache_key(k1_common_input, k2_common_input, req_args),
+      lambda: self.cached_score(k1_common_input, k2_common_input, req_args),
+    )
+
+
+  def cached_score(self, k1_common_input, k2_common_input, req_args):
     try:
-      k1_common_input = self.commonize_input(k1)
-      k2_common_input = self.commonize_input(k2)
-      result = self.s2v_similarity_wrapper(k1_common_input, k2_common_input)
+      if self.result_cache is None or current_trace() is not None:
+        return self.s2v_similarity_wrapper(k1_common_input, k2_common_input, req_args)
+
+      cache_key = self.result_cache_key(k1_common_input, k2_common_input, req_args)
+      found, result = self.result_cache.lookup(cache_key)
+      if not found:
+        result = self.s2v_similarity_wrapper(k1_common_input, k2_common_input, req_args)
+        self.result_cache.set(cache_key, result)
     except Exception as e:
       err = str(e)
       if err.find("unsupported operand type") != -1:
@@ -26,6 +77,15 @@ class S2vSimilarity:
     return result
 
 
+  def result_cache_key(self, k1_common_input, k2_common_input, req_args):
+    k1_key = (self.s2v_util.phrase_key(k1_common_input['phrase']), k1_common_input['is_proper'])
+    k2_key = (self.s2v_util.phrase_key(k2_common_input['phrase']), k2_common_input['is_proper'])
+    return (
+      tuple(sorted([k1_key, k2_key], key=repr)),
+      req_args.get('attempt-phrase-join-for-compound-phrases'),
+    )
+
+
   def commonize_input(self, d):
     d_list = None
     if isinstance(d, str):
@@ -41,14 +101,17 @@ class S2vSimilarity:
     return { 'phrase': d_common_input, 'is_proper': is_proper }
 
 
-  def s2v_similarity_wrapper(self, k1, k2):
-    key_variation_combinations = self.collect_key_variation_combinations(k1, k2)
-    return self.s2v_similarity_select_best(key_variation_combinations)
+  def s2v_similarity_wrapper(self, k1, k2, req_args):
+    with self.metrics.stage('similarity', 'variations'):
+      key_variation_combinations = self.collect_key_variation_combinations(k1, k2, req_args)
+    self.metrics.inc('s2v_variation_combinations_total', len(key_variation_combinations), service='similarity')
+    with self.metrics.stage('similarity', 'scoring'):
+      return self.s2v_similarity_select_best(key_variation_combinations)
 
 
-  def collect_key_variation_combinations(self, k1, k2):
+  def collect_key_variation_combinations(self, k1, k2, req_args={}):
     combinations = []
-    attempt_phrase_join_for_compound_phrases = self.req_args.get('attempt-phrase-join-for-compound-phrases')
+    attempt_phrase_join_for_compound_phrases = req_args.get('attempt-phrase-join-for-compound-phrases')
     k1_variations = self.s2v_key_variations.call(
       k1['phrase'], 
       attempt_phrase_join_for_compound_phrases,
@@ -73,35 +136,41 @@ class S2vSimilarity:
     return combinations
 
 
+  # scores every k1/k2 variation pair with one matrix product over the distinct
+  # phrase vectors on each side, rather than a s2v.similarity call per pair
   def s2v_similarity_select_best(self, similarity_combinations):
     result = 0.0
-    for k1, k2 in similarity_combinations:
-      k1_mapped = list(map(
-        lambda x: x['wordsense'],
-        k1,
-      ))
-      k2_mapped = list(map(
-        lambda x: x['wordsense'],
-        k2,
-      ))
-
-      if None in k1_mapped or None in k2_mapped:
-        r = 0.0
-      else:
-        if os.getenv('S2V_VERBOSE'):
-          print()
-          print('similarity comparing')
-          print('k1', k1_mapped)
-          print('k2', k2_mapped)
-        r = self.s2v_util.s2v.similarity(k1_mapped, k2_mapped)
-        if os.getenv('S2V_VERBOSE'):
-          print('result', r)
-          print()
-      if r > result:
-        result = r
+    if len(similarity_combinations) <= 0:
+      return result
+
+    k1_phrases, k1_index = self.index_phrases(map(lambda x: x[0], similarity_combinations))
+    k2_phrases, k2_index = self.index_phrases(map(lambda x: x[1], similarity_combinations))
+    scores = self.s2v_vectors.similarity_matrix(k1_phrases, k2_phrases)[k1_index, k2_index]
+    trace = current_trace()
+    if trace is not None:
+      for i, r in enumerate(scores):
+        trace.event('similarity', k1=list(k1_phrases[k1_index[i]]), k2=list(k2_phrases[k2_index[i]]), score=round(float(r), 3))
+
+    best = scores.max()
+    if best > result:
+      result = best
     return round(float(result), 3)
 
 
+  # returns the distinct wordsense tuples and, for each input, its position among them
+  def index_phrases(self, keys):
+    phrases = []
+    positions = {}
+    index = []
+    for k in keys:
+      phrase = tuple(map(lambda x: x['wordsense'], k))
+      if not phrase in positions:
+        positions[phrase] = len(phrases)
+        phrases.append(phrase)
+      index.append(positions[phrase])
+    return phrases, np.asarray(index, dtype=np.int64)
+
+
 if __name__ == '__main__':
   from sense2vec import Sense2Vec
   from s2v_util import S2vUtil
@@ -33,7 +33,7 @@ def similarity_service(s2v_mock):
 def test_similarity_combinations_includes_phrase_joined(similarity_service, s2v_mock):
     k1 = ["New_York|LOC"]
     k2 = ["big|ADJ", "apple|NOUN"]
-    similarity_service.req_args = { 'attempt-phrase-join-for-compound-phrases': 1 }
+    req_args = { 'attempt-phrase-join-for-compound-phrases': 1 }
     k1_common_input = similarity_service.commonize_input(k1)
     k2_common_input = similarity_service.commonize_input(k2)
     expected = [
@@ -46,7 +46,7 @@ def test_similarity_combinations_includes_phrase_joined(similarity_service, s2v_
         [{'wordsense': 'big_apple|NOUN', 'required': True, 'is_joined': True}],
       ], 
     ]
-    result = similarity_service.collect_key_variation_combinations(k1_common_input, k2_common_input)
+    result = similarity_service.collect_key_variation_combinations(k1_common_input, k2_common_input, req_args)
     print('result!!')
     print(result)
     assert result == expected
@@ -85,4 +85,45 @@ def test_param_attempt_phrase_join_for_compound_phrase(similarity_service, s2v_m
     assert result == expected
     assert result_without_compound_phrase_join != expected
     assert result_without_compound_phrase_join == expected_without_compound_phrase_join
-    
\ No newline at end of file
+    
+
+def test_select_best_matches_pairwise_s2v_similarity(similarity_service, s2v_mock):
+    phrases = [
+      [{'wordsense': 'New_York|GPE'}],
+      [{'wordsense': 'New_York|NOUN'}],
+      [{'wordsense': 'big|ADJ'}, {'wordsense': 'apple|NOUN'}],
+      [{'wordsense': 'BIG|ADJ'}, {'wordsense': 'apple|NOUN'}],
+      [{'wordsense': 'big_apple|NOUN'}],
+    ]
+    for k1 in phrases:
+      for k2 in phrases:
+        k1_mapped = list(map(lambda x: x['wordsense'], k1))
+        k2_mapped = list(map(lambda x: x['wordsense'], k2))
+        expected = round(float(max(0.0, s2v_mock.similarity(k1_mapped, k2_mapped))), 3)
+        assert similarity_service.s2v_similarity_select_best([[k1, k2]]) == expected
+    combinations = [[k1, k2] for k1 in phrases[:2] for k2 in phrases[2:]]
+    expected = max(map(lambda x: round(float(s2v_mock.similarity(
+      list(map(lambda y: y['wordsense'], x[0])),
+      list(map(lambda y: y['wordsense'], x[1])),
+    )), 3), combinations))
+    assert similarity_service.s2v_similarity_select_best(combinations) == expected
+
+
+def test_batch_scores_pairs_identical_once_commonized_once(similarity_service, s2v_mock):
+    scored = []
+    score = similarity_service.score
+    def counting_score(k1, k2, req_args):
+      scored.append((k1, k2))
+      return score(k1, k2, req_args)
+    similarity_service.score = counting_score
+    pairs = [
+      [["New_York|LOC"], ["big|ADJ", "apple|NOUN"]],
+      [["big|ADJ", "apple|NOUN"], "New_York|LOC"],
+      [{ 'phrase': "New_York|LOC" }, ["big|ADJ", "apple|NOUN"]],
+      [["apple|NOUN"], ["big|ADJ"]],
+    ]
+    stats = {}
+    result = similarity_service.call_batch(pairs, {}, stats)
+    assert len(scored) == 2
+    assert stats == { 'items': 4, 'distinct': 2, 'deduplicated': 2 }
+    assert result == [similarity_service.call(k1, k2) for k1, k2 in pairs]
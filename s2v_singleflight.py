@@ -0,0 +1,94 @@
+import threading
+
+
+class S2vInflightCall:
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.result = None
+    self.error = None
+    self.abandoned = False
+
+
+# coalesces concurrent identical computations: the first thread to start a key computes it
+# (the leader), threads starting the same key while it is in flight wait for the leader's
+# result instead of computing it again. an error raised by the leader is raised in every waiter,
+# a leader interrupted by a BaseException (KeyboardInterrupt, SystemExit) abandons the call and
+# its waiters compute the key themselves.
+#
+# a waiter that has not been answered after timeout seconds stops waiting and computes the
+# key itself, so a stuck leader can't hold up its waiters past the timeout (None waits forever)
+class S2vSingleflight:
+
+  def __init__(self, timeout=None):
+    self.timeout = timeout
+    self.lock = threading.Lock()
+    self.calls = {}
+    self.leaders = 0
+    self.coalesced = 0
+    self.timeouts = 0
+
+
+  # returns fn() computed once across the threads doing key at the same time,
+  # copy_result is applied to the result handed to waiters
+  def do(self, key, fn, copy_result=lambda x: x):
+    call, leader = self.begin(key)
+    if leader:
+      try:
+        result = fn()
+      except Exception as e:
+        self.finish(key, call, error=e)
+        raise
+      except BaseException:
+        self.finish(key, call, abandoned=True)
+        raise
+      self.finish(key, call, result)
+      return result
+    return self.wait(call, fn, copy_result)
+
+
+  # returns the in flight call of key and whether the calling thread leads it,
+  # a leader must finish the call
+  def begin(self, key):
+    with self.lock:
+      call = self.calls.get(key)
+      if call is not None:
+        self.coalesced += 1
+        return call, False
+      call = S2vInflightCall()
+      self.calls[key] = call
+      self.leaders += 1
+      return call, True
+
+
+  def finish(self, key, call, result=None, error=None, abandoned=False):
+    call.result = result
+    call.error = error
+    call.abandoned = abandoned
+    with self.lock:
+      if self.calls.get(key) is call:
+        del self.calls[key]
+    call.done.set()
+
+
+  # waits for the leader of call, falling back to fn() on timeout or when it was abandoned
+  def wait(self, call, fn, copy_result=lambda x: x):
+    if not call.done.wait(self.timeout):
+      with self.lock:
+        self.timeouts += 1
+      return fn()
+    if call.abandoned:
+      return fn()
+    if call.error is not None:
+      raise call.error
+    return copy_result(call.result)
+
+
+  def stats(self):
+    with self.lock:
+      return {
+        'in_flight': len(self.calls),
+        'leaders': self.leaders,
+        'coalesced': self.coalesced,
+        'timeouts': self.timeouts,
+      }
@@ -0,0 +1,166 @@
+import threading
+import pytest
+from s2v_singleflight import S2vSingleflight
+
+THREADS = 6
+
+
+def run_threads(target):
+    results = [None] * THREADS
+    errors = [None] * THREADS
+    def run(i):
+      try:
+        results[i] = target()
+      except Exception as e:
+        errors[i] = e
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(THREADS)]
+    for t in threads:
+      t.start()
+    return threads, results, errors
+
+
+def wait_for_coalesced(singleflight, coalesced):
+    while singleflight.stats()['coalesced'] < coalesced:
+      threading.Event().wait(0.001)
+
+
+def test_concurrent_identical_calls_are_computed_once():
+    singleflight = S2vSingleflight()
+    release = threading.Event()
+    computed = []
+    def compute():
+      computed.append(1)
+      release.wait()
+      return ['result']
+    threads, results, errors = run_threads(lambda: singleflight.do('key', compute, list))
+    wait_for_coalesced(singleflight, THREADS - 1)
+    release.set()
+    for t in threads:
+      t.join()
+    assert len(computed) == 1
+    assert results == [['result']] * THREADS
+    assert len(set(map(id, results))) == THREADS
+    assert singleflight.stats() == { 'in_flight': 0, 'leaders': 1, 'coalesced': THREADS - 1, 'timeouts': 0 }
+    assert singleflight.do('key', lambda: ['again']) == ['again']
+
+
+def test_errors_are_raised_in_every_waiter():
+    singleflight = S2vSingleflight()
+    release = threading.Event()
+    def compute():
+      release.wait()
+      raise ValueError('failed')
+    threads, results, errors = run_threads(lambda: singleflight.do('key', compute))
+    wait_for_coalesced(singleflight, THREADS - 1)
+    release.set()
+    for t in threads:
+      t.join()
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert singleflight.stats()['in_flight'] == 0
+
+
+def test_waiters_compute_themselves_when_the_leader_is_interrupted():
+    singleflight = S2vSingleflight()
+    release = threading.Event()
+    def interrupted():
+      release.wait()
+      raise KeyboardInterrupt()
+    leader = threading.Thread(target=lambda: pytest.raises(KeyboardInterrupt, singleflight.do, 'key', interrupted))
+    leader.start()
+    while singleflight.stats()['leaders'] < 1:
+      threading.Event().wait(0.001)
+    threads, results, errors = run_threads(lambda: singleflight.do('key', lambda: 'computed by waiter'))
+    wait_for_coalesced(singleflight, 1)
+    release.set()
+    leader.join()
+    for t in threads:
+      t.join()
+    assert errors == [None] * THREADS
+    assert results == ['computed by waiter'] * THREADS
+    assert singleflight.stats()['in_flight'] == 0
+
+
+def test_waiters_compute_themselves_after_timeout():
+    singleflight = S2vSingleflight(timeout=0.01)
+    inflight, leader = singleflight.begin('key')
+    assert leader
+    assert singleflight.do('key', lambda: 'computed by waiter') == 'computed by waiter'
+    assert singleflight.stats()['timeouts'] == 1
+    singleflight.finish('key', inflight, 'computed by leader')
+    assert singleflight.stats()['in_flight'] == 0
+
+
+def test_synonyms_batch_waits_for_an_identical_search_in_flight():
+    import numpy as np
+    from sense2vec import Sense2Vec
+    from s2v_util import S2vUtil
+    from s2v_senses import S2vSenses
+    from s2v_key_case_and_sense_variations import S2vKeyCaseAndSenseVariations
+    from s2v_key_commonizer import S2vKeyCommonizer
+    from s2v_synonyms import S2vSynonyms
+    rng = np.random.default_rng(6)
+    s2v = Sense2Vec(shape=(32, 4))
+    for i in range(24):
+      s2v.add('word{0}|NOUN'.format(i), rng.standard_normal(4).astype(np.float32))
+    s2v_util = S2vUtil(s2v)
+    singleflight = S2vSingleflight()
+    service = S2vSynonyms(
+      s2v_util,
+      S2vKeyCaseAndSenseVariations(s2v_util, S2vSenses(s2v_util)),
+      S2vKeyCommonizer(),
+      allow_non_cached_keys=True,
+      singleflight=singleflight,
+    )
+    expected = service.call(['word1|NOUN'])
+    in_flight_result = [{ 'word': 'in flight', 'sense': 'NOUN', 'score': 1.0 }]
+    key = service.result_cache_key(service.commonize_input(['word0|NOUN']), {})
+    inflight, leader = singleflight.begin(key)
+    batch = []
+    t = threading.Thread(target=lambda: batch.append(service.call_batch([['word0|NOUN'], ['word1|NOUN']])))
+    t.start()
+    wait_for_coalesced(singleflight, 1)
+    singleflight.finish(key, inflight, in_flight_result)
+    t.join()
+    assert batch == [[in_flight_result, expected]]
+    assert batch[0][0] is not in_flight_result
+
+
+def test_synonyms_batch_only_fails_the_waiters_of_the_failing_item():
+    import numpy as np
+    from sense2vec import Sense2Vec
+    from s2v_util import S2vUtil
+    from s2v_senses import S2vSenses
+    from s2v_key_case_and_sense_variations import S2vKeyCaseAndSenseVariations
+    from s2v_key_commonizer import S2vKeyCommonizer
+    from s2v_synonyms import S2vSynonyms
+    rng = np.random.default_rng(6)
+    s2v = Sense2Vec(shape=(32, 4))
+    for i in range(24):
+      s2v.add('word{0}|NOUN'.format(i), rng.standard_normal(4).astype(np.float32))
+    s2v_util = S2vUtil(s2v)
+    singleflight = S2vSingleflight()
+    service = S2vSynonyms(
+      s2v_util,
+      S2vKeyCaseAndSenseVariations(s2v_util, S2vSenses(s2v_util)),
+      S2vKeyCommonizer(),
+      allow_non_cached_keys=True,
+      singleflight=singleflight,
+    )
+    expected = service.call(['word1|NOUN'])
+    collect_variations = service.collect_variations
+    def failing_collect_variations(d, req_args):
+      if d['phrase'][0]['wordsense'] == 'word0|NOUN':
+        raise ValueError('failed')
+      return collect_variations(d, req_args)
+    service.collect_variations = failing_collect_variations
+    finished = {}
+    finish = singleflight.finish
+    def recording_finish(key, call, result=None, error=None, abandoned=False):
+      finished[key[0][0][0]] = error or result
+      finish(key, call, result, error, abandoned)
+    singleflight.finish = recording_finish
+    with pytest.raises(ValueError):
+      service.call_batch([['word0|NOUN'], ['word1|NOUN']])
+    assert isinstance(finished['word0|NOUN'], ValueError)
+    assert finished['word1|NOUN'] == expected
+    assert singleflight.stats()['in_flight'] == 0
@@ -1,36 +1,111 @@
 import re
 import os
+import copy
+import numpy as np
 from functools import cmp_to_key
+from s2v_vectors import S2vVectors
+from s2v_vector_search import S2vVectorSearch
+from s2v_key_table import S2vKeyTable
+from s2v_util import dedup, scatter, dedup_stats
+from s2v_metrics import NO_METRICS
+from s2v_trace import current_trace
 
 MAX_CACHED_KEYS=15
+# request args that change the synonyms returned for an input
+RESULT_CACHE_REQ_ARGS = [
+  'n',
+  'min-score',
+  'min-word-len',
+  'match-input-sense',
+  'reduce-multicase',
+  'reduce-compound-nouns',
+  'attempt-phrase-join-for-compound-phrases',
+]
 
 class S2vSynonyms:
 
-  # allow_non_cached_keys when set to True will pass the list of keys in the call through to s2v.most_similar 
-  # disregarding most_similar cache. s2v most_similar cache is single key based, multiple keys will be ignored 
-  # except for the last key in the list. 
-  # allow_non_cached_keys when set to False will pass through single key list entries to most_similar, 
-  # multiple keys will be first joined and asserted as existing before passing to most_similar
-  # 
-  # allow_non_cached_keys defaults to False and will currently throw exception if set to True because:
-  # * s2v 1.0.2 most_similar will use cache when available, but will always use the cache and if multiple keys 
-  #   are sent to most_similar it will just use the last key to collect most_similar entries
-  # * even if i fix this above (by first checking if the key is in cache and process accordingly (in s2v.most_similar)), 
-  #   the most_similar cosine similarity is very slow, would need to run on a gpu
-
-  def __init__(self, s2v_util, s2v_key_variations, s2v_key_commonizer, allow_non_cached_keys=False):
+  # allow_non_cached_keys when set to True will also look up synonyms for multiple key phrase variations,
+  # multiple keys are averaged and searched exactly against the whole vocabulary by S2vVectorSearch
+  # (s2v 1.0.2 most_similar can't be used for these: it always uses the cache when available and
+  # if multiple keys are sent it just uses the last key to collect most_similar entries).
+  # single keys are still served from the most_similar cache.
+  # allow_non_cached_keys when set to False will pass through single key list entries to most_similar,
+  # multiple keys are skipped, callers are expected to join them first (attempt-phrase-join-for-compound-phrases)
+  #
+  # allow_non_cached_keys defaults to False because the exact search keeps a normalized copy of the
+  # vectors table in memory and costs a full scan of it per multiple key variation
+
+  #
+  # s2v_neighbour_table (see scripts/build_s2v_indexes.py) replaces the most_similar cache bundled
+  # with the model for single keys, lifting the MAX_CACHED_KEYS ceiling to the depth of the table
+  #
+  # when s2v_vector_search is built with s2v_partitions, variations of inputs filtered on sense
+  # (match-input-sense) or properness are searched exactly but only in the partitions of the
+  # vocabulary (generic sense and properness) that the filters would keep, so the n results aren't
+  # thinned out by the filtering afterwards. single keys stay on a neighbour table deep enough to
+  # fill the search, see lookup_key
+  #
+  # result_cache (a S2vLruCache) caches results across requests, keyed on the commonized input and
+  # the request args in RESULT_CACHE_REQ_ARGS
+  #
+  # the word, sense and properness of every synonym found are read from s2v_key_table
+  #
+  # singleflight (a S2vSingleflight) coalesces concurrent searches of the same input and request
+  # args (the result cache key) into one, the other threads wait for its result
+  #
+  # metrics (a S2vMetrics) times the commonize, variations, most_similar and filter stages
+  #
+  # traced requests (see s2v_trace) skip the result cache and singleflight, and record the
+  # neighbours fetched for each variation and the counts before / after each filter
+
+  def __init__(self, s2v_util, s2v_key_variations, s2v_key_commonizer, allow_non_cached_keys=False, s2v_vector_search=None, s2v_neighbour_table=None, result_cache=None, s2v_key_table=None, singleflight=None, metrics=None):
     self.s2v_util = s2v_util
+    self.metrics = metrics or NO_METRICS
+    self.s2v_key_table = s2v_key_table or S2vKeyTable.build(self.s2v_util)
+    self.result_cache = result_cache
+    self.singleflight = singleflight
     self.s2v_key_variations = s2v_key_variations
     self.s2v_key_commonizer = s2v_key_commonizer
+    self.s2v_neighbour_table = s2v_neighbour_table
+    self.max_cached_keys = s2v_neighbour_table.depth if s2v_neighbour_table else MAX_CACHED_KEYS
     self.allow_non_cached_keys = allow_non_cached_keys
-    if self.allow_non_cached_keys:
-      raise ValueError('allow_non_cached_keys cannot currently be truthy, see comment in S2vSynonyms class for more info')
+    self.s2v_vector_search = s2v_vector_search
+    if self.allow_non_cached_keys and not self.s2v_vector_search:
+      self.s2v_vector_search = S2vVectorSearch(S2vVectors(self.s2v_util.s2v))
 
 
   def call(self, d, req_args={}):
-    return self.most_similar_wrapper(
-      self.commonize_input(d), 
-      req_args,
+    with self.metrics.stage('synonyms', 'commonize'):
+      d_common_input = self.commonize_input(d)
+    if current_trace() is not None:
+      return self.most_similar_wrapper(d_common_input, req_args)
+    if self.singleflight is None:
+      return self.cached_most_similar(d_common_input, req_args)
+    return self.singleflight.do(
+      self.result_cache_key(d_common_input, req_args),
+      lambda: self.cached_most_similar(d_common_input, req_args),
+      copy.deepcopy,
+    )
+
+
+  def cached_most_similar(self, d_common_input, req_args):
+    if self.result_cache is None:
+      return self.most_similar_wrapper(d_common_input, req_args)
+
+    cache_key = self.result_cache_key(d_common_input, req_args)
+    found, result = self.result_cache.lookup(cache_key)
+    if found:
+      return copy.deepcopy(result)
+    result = self.most_similar_wrapper(d_common_input, req_args)
+    self.result_cache.set(cache_key, copy.deepcopy(result))
+    return result
+
+
+  def result_cache_key(self, d_common_input, req_args):
+    return (
+      self.s2v_util.phrase_key(d_common_input['phrase']),
+      d_common_input['is_proper'],
+      tuple(map(lambda x: req_args.get(x), RESULT_CACHE_REQ_ARGS)),
     )
 
 
@@ -49,22 +124,143 @@ class S2vSynonyms:
     return { 'phrase': d_common_input, 'is_proper': is_proper }
 
 
+  # synonyms for every item of a request, the same results as calling call for each of them.
+  # items that are identical once commonized are searched once. the neighbour lookups of all
+  # the distinct items' variations are collected first, then the distinct lookups are resolved
+  # together (see most_similar_batch) and fanned back out to the items. items already being
+  # searched by another thread (see singleflight) are waited for once the rest are done.
+  #
+  # stats (a dict) is filled with the number of items, distinct items and deduplicated items
+  def call_batch(self, items, req_args={}, stats=None):
+    n_results = self.n_results(req_args)
+    with self.metrics.stage('synonyms', 'commonize'):
+      d_common_inputs = list(map(self.commonize_input, items))
+    d_common_inputs, positions = dedup(d_common_inputs, lambda x: self.result_cache_key(x, req_args))
+    if stats is not None:
+      stats.update(dedup_stats(len(items), len(d_common_inputs)))
+    results = [None] * len(d_common_inputs)
+    searches = []
+    waiting = []
+    traced = current_trace() is not None
+    for i, d_common_input in enumerate(d_common_inputs):
+      cache_key = self.result_cache_key(d_common_input, req_args)
+      if traced:
+        searches.append((i, d_common_input, cache_key, None))
+        continue
+      if self.result_cache is not None:
+        found, result = self.result_cache.lookup(cache_key)
+        if found:
+          results[i] = copy.deepcopy(result)
+          continue
+      inflight = None
+      if self.singleflight is not None:
+        inflight, leader = self.singleflight.begin(cache_key)
+        if not leader:
+          waiting.append((i, d_common_input, inflight))
+          continue
+      searches.append((i, d_common_input, cache_key, inflight))
+
+    try:
+      searched = self.search_batch(list(map(lambda x: x[1], searches)), n_results, req_args)
+    except BaseException:
+      # the waiters of the items this batch leads compute them themselves
+      for _, _, cache_key, inflight in searches:
+        if inflight is not None:
+          self.singleflight.finish(cache_key, inflight, abandoned=True)
+      raise
+    error = None
+    for (i, _, cache_key, inflight), result in zip(searches, searched):
+      if isinstance(result, Exception):
+        error = error or result
+        if inflight is not None:
+          self.singleflight.finish(cache_key, inflight, error=result)
+        continue
+      if self.result_cache is not None and not traced:
+        self.result_cache.set(cache_key, copy.deepcopy(result))
+      if inflight is not None:
+        self.singleflight.finish(cache_key, inflight, result)
+      results[i] = result
+    if error is not None:
+      raise error
+    for i, d_common_input, inflight in waiting:
+      results[i] = self.singleflight.wait(inflight, lambda: self.cached_most_similar(d_common_input, req_args), copy.deepcopy)
+    return scatter(results, positions, copy.deepcopy)
+
+
+  # the synonyms of each of the commonized inputs, searched together. an input whose search
+  # raises gets the exception as its entry, the others are still searched: when the batched
+  # neighbour lookups raise, each input looks its own up
+  def search_batch(self, d_common_inputs, n_results, req_args):
+    searches = []
+    lookups = []
+    for d_common_input in d_common_inputs:
+      try:
+        d_keys = list(map(lambda x: x['wordsense'], d_common_input['phrase']))
+        partitions = self.search_partitions(d_common_input, d_keys, req_args)
+        d_variations = self.collect_variations(d_common_input, req_args)
+      except Exception as e:
+        searches.append(e)
+        continue
+      searches.append((d_common_input, d_keys, partitions, d_variations))
+      for d_variation in d_variations:
+        d_variation_keys = list(map(lambda x: x['wordsense'], d_variation['key']))
+        if self.searches_variation(d_variation_keys):
+          lookups.append(self.lookup_key(d_variation_keys, n_results, partitions))
+    try:
+      with self.metrics.stage('synonyms', 'most_similar'):
+        found = self.most_similar_batch(lookups)
+    except Exception:
+      found = None
+    results = []
+    for search in searches:
+      if isinstance(search, Exception):
+        results.append(search)
+        continue
+      d_common_input, d_keys, partitions, d_variations = search
+      try:
+        results.append(self.merge_variation_results(d_common_input, d_keys, d_variations, n_results, partitions, req_args, found))
+      except Exception as e:
+        results.append(e)
+    return results
+
+
   def most_similar_wrapper(self, d, req_args):
-    result = []
-    k_len = len(d['phrase'])
     d_keys = list(map(lambda x: x['wordsense'], d['phrase']))
-    n_results = req_args.get('n') and int(req_args.get('n')) or 10
+    n_results = self.n_results(req_args)
+    partitions = self.search_partitions(d, d_keys, req_args)
+    d_variations = self.collect_variations(d, req_args)
+    return self.merge_variation_results(d, d_keys, d_variations, n_results, partitions, req_args)
+
+
+  def n_results(self, req_args):
+    return req_args.get('n') and int(req_args.get('n')) or 10
+
+
+  def collect_variations(self, d, req_args):
     attempt_phrase_join_for_compound_phrases = req_args.get('attempt-phrase-join-for-compound-phrases')
-    d_variations = self.s2v_key_variations.call(
-      d['phrase'], 
-      must_only_phrase_join_for_compound_phrases = attempt_phrase_join_for_compound_phrases,
-      flag_joined_phrase_variations = True,
-      phrase_is_proper = d['is_proper'],
-      limit = 25,
-    )
+    with self.metrics.stage('synonyms', 'variations'):
+      variations = self.s2v_key_variations.call(
+        d['phrase'], 
+        must_only_phrase_join_for_compound_phrases = attempt_phrase_join_for_compound_phrases,
+        flag_joined_phrase_variations = True,
+        phrase_is_proper = d['is_proper'],
+        limit = 25,
+      )
+    self.metrics.inc('s2v_variation_combinations_total', len(variations), service='synonyms')
+    return variations
+
+
+  def searches_variation(self, d_variation_keys):
+    return len(d_variation_keys) <= 1 or self.allow_non_cached_keys
+
 
+  # merges the synonyms of d's variations priority group by priority group, found holds the
+  # neighbours already looked up by most_similar_batch, without it they are looked up here
+  def merge_variation_results(self, d, d_keys, d_variations, n_results, partitions, req_args, found=None):
+    result = []
     current_priority = 1
     current_priority_group = []
+    trace = current_trace()
     for d_variation in d_variations:
       priority = d_variation['priority']
       if priority != current_priority:
@@ -83,18 +279,34 @@ class S2vSynonyms:
       d_variation_keys = list(map(lambda x: x['wordsense'], d_variation['key']))
       d_variation_keys_words = self.s2v_util.words_only(d_variation['key'])
 
-      if os.getenv('S2V_VERBOSE'):
-        print()
-        print('k', d_variation_keys, ':')
-        print()
-      if len(d_variation_keys) <= 1 or self.allow_non_cached_keys:
-        for r in self.s2v_util.s2v.most_similar(d_variation_keys, n=min([MAX_CACHED_KEYS, max([n_results * 2, 10])])):
+      if self.searches_variation(d_variation_keys):
+        if found is None:
+          with self.metrics.stage('synonyms', 'most_similar'):
+            similar = self.most_similar(d_variation_keys, n_results, partitions)
+        else:
+          similar = found[self.lookup_key(d_variation_keys, n_results, partitions)]
+          if isinstance(similar, Exception):
+            raise similar
+        kept = 0
+        for r in similar:
           value, score = r
-          if os.getenv('S2V_VERBOSE'):
-            print(value, score)
-          word, sense = self.s2v_util.s2v.split_key(value)
-          if self.matches_required_properness(word, d['is_proper']):
+          row = self.s2v_key_table.row(value)
+          if self.matches_required_properness(row, d['is_proper']):
+            kept += 1
+            word = self.s2v_key_table.word(row)
+            sense = self.s2v_key_table.sense(row)
             current_priority_group = self.merge_synonym_result_with_list(current_priority_group, word, sense, score)
+        if trace is not None:
+          trace.event(
+            'neighbours',
+            keys=d_variation_keys,
+            priority=priority,
+            searched=True,
+            neighbours=list(map(lambda x: [x[0], round(float(x[1]), 3)], similar)),
+            matching_properness=kept,
+          )
+      elif trace is not None:
+        trace.event('neighbours', keys=d_variation_keys, priority=priority, searched=False)
 
     result, reached_limit = self.merge_current_priority_group_with_result(
       current_priority_group,
@@ -106,6 +318,111 @@ class S2vSynonyms:
     return result
 
 
+  def most_similar(self, keys, n_results, partitions=None):
+    keys, n, partitions = self.lookup_key(keys, n_results, partitions)
+    if partitions is not None or len(keys) > 1:
+      return self.s2v_vector_search.most_similar(list(keys), n=n, partitions=None if partitions is None else list(partitions))
+    if self.s2v_neighbour_table:
+      return self.s2v_neighbour_table.most_similar(list(keys), n=n)
+    return self.s2v_util.s2v.most_similar(list(keys), n=n)
+
+
+  # how the neighbours of keys are looked up, as (keys, n, partitions) with n the number of
+  # neighbours fetched. vector searches fetch n_results * 2 (at least 10). single keys fetch as
+  # many, up to max_cached_keys, from the neighbour table or the model's most_similar cache.
+  # single keys limited to partitions stay on the neighbour table when it is deep enough for
+  # the partitions' share of its neighbours to fill the search, fetching all of them for the
+  # filters to pick from
+  def lookup_key(self, keys, n_results, partitions):
+    n = max([n_results * 2, 10])
+    if partitions is not None and len(keys) <= 1 and self.s2v_neighbour_table:
+      s2v_partitions = self.s2v_vector_search.s2v_partitions
+      if self.s2v_neighbour_table.depth * s2v_partitions.size(partitions) >= n * s2v_partitions.size():
+        return (tuple(keys), self.s2v_neighbour_table.depth, None)
+    if partitions is not None or len(keys) > 1:
+      return (tuple(keys), n, None if partitions is None else tuple(partitions))
+    return (tuple(keys), min([self.max_cached_keys, n]), None)
+
+
+  # resolves the distinct lookups (see lookup_key) together, routed the same way as most_similar:
+  # the vector searches of each set of partitions as one matrix product, single keys as one gather
+  # from the neighbour table or the model's most_similar cache. returns a dict of lookup -> the
+  # most_similar result, or the ValueError most_similar would have raised for it
+  def most_similar_batch(self, lookups):
+    found = {}
+    searches = {}
+    single_keys = {}
+    for lookup in lookups:
+      keys, n, partitions = lookup
+      if lookup in found:
+        continue
+      found[lookup] = None
+      if partitions is not None or len(keys) > 1:
+        searches.setdefault((n, partitions), []).append(lookup)
+      else:
+        single_keys.setdefault(n, []).append(lookup)
+
+    for (n, partitions), search_lookups in searches.items():
+      results = self.s2v_vector_search.most_similar_batch(
+        list(map(lambda x: list(x[0]), search_lookups)),
+        n=n,
+        partitions=None if partitions is None else list(partitions),
+      )
+      found.update(zip(search_lookups, results))
+    for n, key_lookups in single_keys.items():
+      keys = list(map(lambda x: x[0][0], key_lookups))
+      if self.s2v_neighbour_table:
+        results = self.s2v_neighbour_table.most_similar_batch(keys, n=n)
+      else:
+        results = self.s2v_most_similar_batch(keys, n)
+      found.update(zip(key_lookups, results))
+    return found
+
+
+  # s2v.most_similar for single keys, served with one gather from the model's most_similar
+  # cache where s2v.most_similar would use it
+  def s2v_most_similar_batch(self, keys, n):
+    s2v = self.s2v_util.s2v
+    results = [None] * len(keys)
+    cached = []
+    for i, key in enumerate(keys):
+      if key not in s2v:
+        results[i] = ValueError("Can't find key {0} in table".format(key))
+      elif s2v.cache and s2v.cache['indices'].shape[1] >= n and s2v.vectors.find(key=key) < s2v.cache['indices'].shape[0]:
+        cached.append(i)
+      else:
+        results[i] = s2v.most_similar([key], n=n)
+    if cached:
+      n = min(len(s2v.vectors), n)
+      rows = np.fromiter((s2v.vectors.find(key=keys[i]) for i in cached), dtype=np.int64, count=len(cached))
+      indices = s2v.cache['indices'][rows, :n]
+      scores = s2v.cache['scores'][rows, :n]
+      row_keys = self.s2v_key_table.row_keys
+      for i, row_indices, row_scores in zip(cached, indices, scores):
+        results[i] = [
+          (s2v.strings[int(row_keys[r])], score)
+          for r, score in zip(row_indices, row_scores)
+          if 0 <= r < len(row_keys) and row_keys[r] != 0
+        ]
+    return results
+
+
+  # the vocabulary partitions worth searching for d, None to search without partitions: when
+  # neither the input sense nor properness filters the synonyms, or the partitions they keep
+  # hold the whole vocabulary anyway, a partitioned search would drop no candidates
+  def search_partitions(self, d, d_keys, req_args):
+    if not self.s2v_vector_search or not self.s2v_vector_search.s2v_partitions:
+      return None
+    s2v_partitions = self.s2v_vector_search.s2v_partitions
+    generic_sense = self.input_generic_sense(d_keys) if req_args.get('match-input-sense') else None
+    if generic_sense is None and d['is_proper'] is None:
+      return None
+    partitions = s2v_partitions.select([generic_sense] if generic_sense else None, d['is_proper'])
+    if s2v_partitions.size(partitions) >= s2v_partitions.size():
+      return None
+    return partitions
+
+
   def merge_synonym_result_with_list(self, result, word, sense, score):
     new_result = []
     score = round(float(score), 3)
@@ -140,7 +457,8 @@ class S2vSynonyms:
     req_args,
     d_keys,
   ):
-    current_priority_group = self.reduce_results_based_on_req_args(current_priority_group, d_keys, req_args)
+    with self.metrics.stage('synonyms', 'filter'):
+      current_priority_group = self.reduce_results_based_on_req_args(current_priority_group, d_keys, req_args)
     current_priority_group.sort(key=cmp_to_key(self.sort_by_score))
     result_len = len(result)
     count_remaining = n_results - result_len
@@ -158,27 +476,35 @@ class S2vSynonyms:
 
 
   def reduce_results_based_on_req_args(self, results, d, req_args):
+    trace = current_trace()
     if req_args.get('reduce-multicase'):
-      results = self.filter_reduce_multicase(results, d)
+      results = self.traced_filter(trace, 'reduce-multicase', results, self.filter_reduce_multicase(results, d))
 
     # if req_args.get('reduce-multi-wordform'):
     #   results = self.filter_reduce_multi_wordform(results, d)
 
     if req_args.get('match-input-sense'):
-      results = self.filter_match_input_sense(results, d)
+      results = self.traced_filter(trace, 'match-input-sense', results, self.filter_match_input_sense(results, d))
 
     if req_args.get('reduce-compound-nouns'):
-      results = self.filter_reduce_compound_nouns(results, d)
+      results = self.traced_filter(trace, 'reduce-compound-nouns', results, self.filter_reduce_compound_nouns(results, d))
 
     if req_args.get('min-word-len'):
-      results = self.filter_min_word_len(results, int(req_args.get('min-word-len')))
+      results = self.traced_filter(trace, 'min-word-len', results, self.filter_min_word_len(results, int(req_args.get('min-word-len'))))
 
     if req_args.get('min-score'):
-      results = self.filter_min_score(results, float(req_args.get('min-score')))
+      results = self.traced_filter(trace, 'min-score', results, self.filter_min_score(results, float(req_args.get('min-score'))))
 
     return results
 
 
+  # records the counts before and after a filter in the trace, returns the filtered results
+  def traced_filter(self, trace, name, before, after):
+    if trace is not None:
+      trace.event('filter', filter=name, before=len(before), after=len(after))
+    return after
+
+
   # remove synonyms that match input sense first word or last word 
   # like input: foo then remove synonyms like: foo_bar or baz_foo
   def filter_reduce_compound_nouns(self, data, d):
@@ -220,25 +546,24 @@ class S2vSynonyms:
 
 
   def filter_match_input_sense(self, results, d):
+    generic_sense = self.input_generic_sense(d)
+    if generic_sense is None:
+      return results
+    return list(filter(self.sense_matches_result(generic_sense), results))
+
+
+  # only if all input term senses map to the same sense
+  # return its generic sense, otherwise (or if unknown) return None
+  def input_generic_sense(self, d):
     input_list = [d] if isinstance(d, str) else d
-    if len(input_list) == 1:
-      term, sense = self.s2v_util.s2v.split_key(input_list[0])
-      generic_sense = self.s2v_util.get_generic_sense(sense)
-      if generic_sense == 'unknown':
-        return results
-      return list(filter(self.sense_matches_result(generic_sense), results))
-
-    # only if all input term senses map to the same sense
-    # filter on this sense, otherwise return all results
-    distinct_input_senses = self.s2v_util.uniq(map(self.extract_sense_from_s2v_tuple, d))
+    distinct_input_senses = self.s2v_util.uniq(map(self.extract_sense_from_s2v_tuple, input_list))
     if len(distinct_input_senses) > 1:
-      return results
+      return None
 
     generic_sense = self.s2v_util.get_generic_sense(distinct_input_senses[0])
     if generic_sense == 'unknown':
-      return results
-
-    return list(filter(self.sense_matches_result(generic_sense), results))
+      return None
+    return generic_sense
 
 
   def filter_min_score(self, results, min_score):
@@ -251,7 +576,7 @@ class S2vSynonyms:
 
   def sense_matches_result(self, input_sense):
     def h(r):
-      return input_sense == self.s2v_util.get_generic_sense(self.extract_sense_from_result(r))
+      return input_sense == self.s2v_key_table.generic_sense_by_sense.get(self.extract_sense_from_result(r), 'unknown')
     return h
 
 
@@ -263,11 +588,10 @@ class S2vSynonyms:
     return d.get('sense')
 
 
-  def matches_required_properness(self, phrase, is_proper):
+  def matches_required_properness(self, row, is_proper):
     if is_proper is None:
       return True
-    phrase_properness = self.s2v_util.phrase_is_proper([phrase])
-    return phrase_properness == is_proper
+    return self.s2v_key_table.is_proper(row) == is_proper
 
   # def filter_reduce_multi_wordform(self, data, d):
   #   seen, result = set(), []
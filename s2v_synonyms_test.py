@@ -0,0 +1,96 @@
+import pytest
+import numpy as np
+from s2v_util import S2vUtil
+from s2v_senses import S2vSenses
+from s2v_key_case_and_sense_variations import S2vKeyCaseAndSenseVariations
+from s2v_key_commonizer import S2vKeyCommonizer
+from s2v_vectors import S2vVectors
+from s2v_vector_search import S2vVectorSearch
+from s2v_neighbour_table import S2vNeighbourTable
+from s2v_partitions import S2vPartitions
+from s2v_synonyms import S2vSynonyms
+
+ITEMS = [
+  ['word0|NOUN'],
+  ['word1|NOUN'],
+  ['word0|NOUN'],
+  { 'phrase': ['Word2|PROPN'], 'is_proper': True },
+  ['word3|ADJ', 'word4|NOUN'],
+  ['word5|ADJ', 'missing|NOUN'],
+  ['Word6|PROPN'],
+  ['word7|VERB'],
+]
+
+@pytest.fixture
+def s2v_mock():
+    from sense2vec import Sense2Vec
+    rng = np.random.default_rng(5)
+    s2v = Sense2Vec(shape=(96, 8))
+    for i in range(20):
+      s2v.add('word{0}|NOUN'.format(i), rng.standard_normal(8).astype(np.float32))
+      s2v.add('Word{0}|PROPN'.format(i), rng.standard_normal(8).astype(np.float32))
+      s2v.add('word{0}|ADJ'.format(i), rng.standard_normal(8).astype(np.float32))
+      s2v.add('word{0}|VERB'.format(i), rng.standard_normal(8).astype(np.float32))
+    s2v.add('word3_word4|NOUN', rng.standard_normal(8).astype(np.float32))
+    # a most_similar cache like the one bundled with the model
+    table = S2vNeighbourTable.build(S2vVectorSearch(S2vVectors(s2v)), 20)
+    s2v.cache = { 'indices': np.asarray(table.indices), 'scores': np.asarray(table.scores) }
+    return s2v
+
+
+def synonyms_service(s2v, **kwargs):
+    s2v_util = S2vUtil(s2v)
+    s2v_key_variations = S2vKeyCaseAndSenseVariations(s2v_util, S2vSenses(s2v_util))
+    return S2vSynonyms(s2v_util, s2v_key_variations, S2vKeyCommonizer(), **kwargs)
+
+
+@pytest.mark.parametrize('search', ['cache', 'neighbour_table', 'non_cached_keys', 'partitions'])
+@pytest.mark.parametrize('req_args', [
+  {},
+  { 'n': 5, 'match-input-sense': 1, 'reduce-multicase': 1 },
+  { 'n': 12, 'attempt-phrase-join-for-compound-phrases': 1, 'min-score': 0.1 },
+])
+def test_batch_results_match_per_item_results(s2v_mock, search, req_args):
+    kwargs = {}
+    if search == 'neighbour_table':
+      kwargs['s2v_neighbour_table'] = S2vNeighbourTable.build(S2vVectorSearch(S2vVectors(s2v_mock)), 30)
+    elif search == 'non_cached_keys':
+      kwargs['allow_non_cached_keys'] = True
+    elif search == 'partitions':
+      partitions = S2vPartitions.build(S2vUtil(s2v_mock))
+      kwargs['s2v_vector_search'] = S2vVectorSearch(S2vVectors(s2v_mock), s2v_partitions=partitions)
+    service = synonyms_service(s2v_mock, **kwargs)
+    expected = [service.call(item, req_args) for item in ITEMS]
+    assert service.call_batch(ITEMS, req_args) == expected
+    assert any(len(r) > 0 for r in expected)
+
+
+def test_batch_resolves_each_distinct_lookup_once(s2v_mock):
+    service = synonyms_service(s2v_mock, allow_non_cached_keys=True)
+    searched = []
+    most_similar_batch = service.s2v_vector_search.most_similar_batch
+    def counting_most_similar_batch(keys_list, n=10, partitions=None):
+      searched.append(keys_list)
+      return most_similar_batch(keys_list, n, partitions)
+    service.s2v_vector_search.most_similar_batch = counting_most_similar_batch
+    service.call_batch([['word3|ADJ', 'word4|NOUN']] * 3 + [['word5|ADJ', 'word4|NOUN']])
+    assert len(searched) == 1
+    assert len(searched[0]) == len(set(map(tuple, searched[0])))
+
+
+
+def test_batch_searches_items_identical_once_commonized_once(s2v_mock):
+    service = synonyms_service(s2v_mock)
+    calls = []
+    merge_variation_results = service.merge_variation_results
+    def counting_merge_variation_results(d, *args, **kwargs):
+      calls.append(d)
+      return merge_variation_results(d, *args, **kwargs)
+    service.merge_variation_results = counting_merge_variation_results
+    items = [['word0|NOUN'], 'word0|NOUN', { 'phrase': 'word0|NOUN' }, ['word1|NOUN'], ['word0|NOUN']]
+    stats = {}
+    result = service.call_batch(items, {}, stats)
+    assert len(calls) == 2
+    assert stats == { 'items': 5, 'distinct': 2, 'deduplicated': 3 }
+    assert result == [service.call(item) for item in items]
+    assert result[0] is not result[1]
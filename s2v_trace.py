@@ -0,0 +1,86 @@
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from time import perf_counter
+
+# the trace of the request being served in this context (thread), None when it isn't traced.
+# the services read it once per call and only record when it is set, so tracing costs a
+# context variable lookup when it is off
+CURRENT_TRACE = ContextVar('s2v_trace', default=None)
+
+
+def current_trace():
+  return CURRENT_TRACE.get()
+
+
+# makes trace the current trace for the with block, a None trace leaves tracing off
+def tracing(trace):
+  if trace is None:
+    return nullcontext()
+  return traced(trace)
+
+
+@contextmanager
+def traced(trace):
+  token = CURRENT_TRACE.set(trace)
+  try:
+    yield trace
+  finally:
+    CURRENT_TRACE.reset(token)
+
+
+class S2vTraceTimer:
+  __slots__ = ('trace', 'service', 'stage', 'start')
+
+  def __init__(self, trace, service, stage):
+    self.trace = trace
+    self.service = service
+    self.stage = stage
+
+
+  def __enter__(self):
+    self.start = perf_counter()
+    return self
+
+
+  def __exit__(self, *exc):
+    self.trace.step(self.service, self.stage, self.start, perf_counter() - self.start)
+
+
+# the structured trace of one request: the timed steps (the same service / stage pairs that
+# S2vMetrics times, with their start offsets so nested steps can be told apart) and the events
+# the services record along the way (variations tried, neighbours fetched, filters applied, ...)
+#
+# a trace is recorded by the one thread serving its request, traced requests skip the result
+# caches and singleflight so the trace shows the whole computation
+class S2vTrace:
+
+  def __init__(self):
+    self.start = perf_counter()
+    self.steps = []
+    self.events = []
+
+
+  def stage(self, service, stage):
+    return S2vTraceTimer(self, service, stage)
+
+
+  def step(self, service, stage, start, seconds):
+    self.steps.append({
+      'service': service,
+      'stage': stage,
+      'start_ms': round((start - self.start) * 1000, 3),
+      'ms': round(seconds * 1000, 3),
+    })
+
+
+  def event(self, event, **fields):
+    fields['event'] = event
+    self.events.append(fields)
+
+
+  def to_dict(self):
+    return {
+      'ms': round((perf_counter() - self.start) * 1000, 3),
+      'steps': self.steps,
+      'events': self.events,
+    }
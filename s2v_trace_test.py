@@ -0,0 +1,106 @@
+import json
+import pytest
+import numpy as np
+from s2v_trace import S2vTrace, current_trace, tracing
+from s2v_metrics import S2vMetrics, NO_METRICS
+
+@pytest.fixture
+def services():
+    from sense2vec import Sense2Vec
+    from s2v_util import S2vUtil
+    from s2v_senses import S2vSenses
+    from s2v_cache import S2vLruCache
+    from s2v_singleflight import S2vSingleflight
+    from s2v_key_case_and_sense_variations import S2vKeyCaseAndSenseVariations
+    from s2v_key_commonizer import S2vKeyCommonizer
+    from s2v_similarity import S2vSimilarity
+    from s2v_synonyms import S2vSynonyms
+    s2v = Sense2Vec(shape=(24, 4))
+    rng = np.random.default_rng(7)
+    for word in ['big', 'apple', 'Apple', 'pear', 'large', 'car', 'bus']:
+      for sense in ['NOUN', 'ADJ']:
+        s2v.add('{0}|{1}'.format(word, sense), rng.standard_normal(4).astype(np.float32))
+    s2v_util = S2vUtil(s2v)
+    s2v_key_variations = S2vKeyCaseAndSenseVariations(s2v_util, S2vSenses(s2v_util), memo_cache=S2vLruCache(10))
+    synonyms = S2vSynonyms(
+      s2v_util,
+      s2v_key_variations,
+      S2vKeyCommonizer(),
+      allow_non_cached_keys=True,
+      result_cache=S2vLruCache(10),
+      singleflight=S2vSingleflight(),
+    )
+    similarity = S2vSimilarity(
+      s2v_util,
+      s2v_key_variations,
+      S2vKeyCommonizer(),
+      result_cache=S2vLruCache(10),
+      singleflight=S2vSingleflight(),
+    )
+    return synonyms, similarity
+
+
+def events(trace, event):
+    return [e for e in trace.events if e['event'] == event]
+
+
+def test_tracing_is_scoped_to_the_with_block():
+    trace = S2vTrace()
+    assert current_trace() is None
+    with tracing(trace):
+      assert current_trace() is trace
+      with tracing(None):
+        assert current_trace() is trace
+    assert current_trace() is None
+    with NO_METRICS.stage('synonyms', 'filter'):
+      pass
+    with tracing(trace):
+      with NO_METRICS.stage('synonyms', 'filter'):
+        pass
+      with S2vMetrics().stage('synonyms', 'commonize'):
+        pass
+    assert list(map(lambda x: (x['service'], x['stage']), trace.steps)) == [('synonyms', 'filter'), ('synonyms', 'commonize')]
+
+
+def test_traced_synonyms(services):
+    synonyms, _ = services
+    req_args = { 'n': 3, 'min-score': 0.1, 'reduce-multicase': True }
+    items = [['big|ADJ', 'apple|NOUN'], ['apple|NOUN']]
+    expected = synonyms.call_batch(items, req_args)
+    trace = S2vTrace()
+    with tracing(trace):
+      assert synonyms.call_batch(items, req_args) == expected
+    assert synonyms.result_cache.stats()['hits'] == 0
+
+    variations = events(trace, 'variations')
+    assert list(map(lambda x: x['phrase'], variations)) == items
+    assert variations[1]['memoized']
+    assert { 'key': ['apple|NOUN'], 'priority': 1 } in variations[1]['variations']
+    neighbours = events(trace, 'neighbours')
+    assert ['apple|NOUN'] in list(map(lambda x: x['keys'], neighbours))
+    assert all(len(x['neighbours']) > 0 for x in neighbours if x['searched'])
+    filters = events(trace, 'filter')
+    assert list(map(lambda x: x['filter'], filters))[:2] == ['reduce-multicase', 'min-score']
+    assert all(x['after'] <= x['before'] for x in filters)
+    assert { 'commonize', 'most_similar', 'filter' } <= set(map(lambda x: x['stage'], trace.steps))
+    json.dumps(trace.to_dict())
+
+    trace = S2vTrace()
+    with tracing(trace):
+      synonyms.call_batch([['pear|NOUN']], req_args)
+    assert not events(trace, 'variations')[0]['memoized']
+    assert events(trace, 'key_senses') == [{ 'event': 'key_senses', 'key': 'pear|NOUN', 'source': 'senses', 'senses': ['pear|NOUN'] }]
+
+
+def test_traced_similarity(services):
+    _, similarity = services
+    pairs = [[['car|NOUN'], ['bus|NOUN']]]
+    expected = similarity.call_batch(pairs)
+    trace = S2vTrace()
+    with tracing(trace):
+      assert similarity.call_batch(pairs) == expected
+    assert similarity.result_cache.stats()['hits'] == 0
+    scored = events(trace, 'similarity')
+    assert max([0.0] + list(map(lambda x: x['score'], scored))) == expected[0]
+    assert list(map(lambda x: (x['phrase'], x['memoized']), events(trace, 'variations'))) == [(['car|NOUN'], True), (['bus|NOUN'], True)]
+    json.dumps(trace.to_dict())
@@ -1,4 +1,6 @@
 import re
+import hashlib
+import numpy as np
 # from textblob import Word
 
 PUNCTUATION = r'\`\>\<\■\|\^\~!-#-+=*,-/:;?\\[-\\]_{}\xa1\xa7\xab\xb6\xb7\xbb\xbf\u037e\u0387\u055a-\u055f\u0589\u058a\u05be\u05c0\u05c3\u05c6\u05f3\u05f4\u0609\u060a\u060c\u060d\u061b\u061e\u061f\u066a-\u066d\u06d4\u0700-\u070d\u07f7-\u07f9\u0830-\u083e\u085e\u0964\u0965\u0970\u0af0\u0df4\u0e4f\u0e5a\u0e5b\u0f04-\u0f12\u0f14\u0f3a-\u0f3d\u0f85\u0fd0-\u0fd4\u0fd9\u0fda\u104a-\u104f\u10fb\u1360-\u1368\u1400\u166d\u166e\u169b\u169c\u16eb-\u16ed\u1735\u1736\u17d4-\u17d6\u17d8-\u17da\u1800-\u180a\u1944\u1945\u1a1e\u1a1f\u1aa0-\u1aa6\u1aa8-\u1aad\u1b5a-\u1b60\u1bfc-\u1bff\u1c3b-\u1c3f\u1c7e\u1c7f\u1cc0-\u1cc7\u1cd3\u2010-\u2027\u2030-\u2043\u2045-\u2051\u2053-\u205e\u207d\u207e\u208d\u208e\u2329\u232a\u2768-\u2775\u27c5\u27c6\u27e6-\u27ef\u2983-\u2998\u29d8-\u29db\u29fc\u29fd\u2cf9-\u2cfc\u2cfe\u2cff\u2d70\u2e00-\u2e2e\u2e30-\u2e3b\u3001-\u3003\u3008-\u3011\u3014-\u301f\u3030\u303d\u30a0\u30fb\ua4fe\ua4ff\ua60d-\ua60f\ua673\ua67e\ua6f2-\ua6f7\ua874-\ua877\ua8ce\ua8cf\ua8f8-\ua8fa\ua92e\ua92f\ua95f\ua9c1-\ua9cd\ua9de\ua9df\uaa5c-\uaa5f\uaade\uaadf\uaaf0\uaaf1\uabeb\ufd3e\ufd3f\ufe10-\ufe19\ufe30-\ufe52\ufe54-\ufe61\ufe63\ufe68\ufe6a\ufe6b\uff01-\uff03\uff05-\uff0a\uff0c-\uff0f\uff1a\uff1b\uff1f\uff20\uff3b-\uff3d\uff3f\uff5b\uff5d\uff5f-\uff65'
@@ -17,12 +19,51 @@ def flatten(items):
 def remove_punctuation(word):
   return re.sub(PUNCTUATION_PATTERN, ' ', word)
 
+
+# groups items by key(item), returns the distinct items (first occurrences, in order) and
+# for each of them the positions it occurs at
+def dedup(items, key):
+  positions = {}
+  distinct = []
+  for i, item in enumerate(items):
+    k = key(item)
+    if not k in positions:
+      positions[k] = []
+      distinct.append(item)
+    positions[k].append(i)
+  return distinct, list(positions.values())
+
+
+# places each distinct result at the positions its item occurred at (see dedup), repeats
+# get a copy_result of it
+def scatter(results, positions, copy_result=lambda x: x):
+  scattered = [None] * sum(map(len, positions))
+  for result, item_positions in zip(results, positions):
+    for j, i in enumerate(item_positions):
+      scattered[i] = result if j == 0 else copy_result(result)
+  return scattered
+
+
+def dedup_stats(items_len, distinct_len):
+  return { 'items': items_len, 'distinct': distinct_len, 'deduplicated': items_len - distinct_len }
+
+
+# identifies the model's vocabulary layout (keys, rows and vector shape), used to tag
+# derived index files so that an index built against a different model is rejected
+def s2v_model_fingerprint(s2v):
+  key2row = s2v.vectors.key2row
+  keys = np.fromiter(key2row.keys(), dtype=np.uint64, count=len(key2row))
+  rows = np.fromiter(key2row.values(), dtype=np.int64, count=len(key2row))
+  h = hashlib.sha1()
+  h.update(np.asarray(s2v.vectors.shape, dtype=np.int64).tobytes())
+  h.update(keys.tobytes())
+  h.update(rows.tobytes())
+  return h.hexdigest()
+
 class S2vUtil:
 
   def __init__(self, s2v):
     self.s2v = s2v
-    self.s2v_all_keys = list(s2v.keys())
-    self.s2v_all_keys_len = len(self.s2v_all_keys)
     self.s2v_ner_tags = ['NUM', 'PERSON', 'NORP', 'FACILITY', 'ORG', 'GPE', 'LOC',
       'PRODUCT', 'EVENT', 'LANGUAGE', 'WORK_OF_ART']
     self.s2v_noun_tags = ['PROPN', 'NOUN', 'n'] + self.s2v_ner_tags
@@ -108,4 +149,9 @@ class S2vUtil:
 
 
   def words_only(self, k):
-    return flatten(map(lambda x: self.s2v.split_key(x['wordsense'])[0].split(' '), k))
\ No newline at end of file
+    return flatten(map(lambda x: self.s2v.split_key(x['wordsense'])[0].split(' '), k))
+
+
+  # hashable identity of a commonized phrase, used as (part of) cache keys
+  def phrase_key(self, k):
+    return tuple(map(lambda x: (x['wordsense'], x.get('required'), x.get('is_joined')), k))
@@ -0,0 +1,135 @@
+import numpy as np
+from s2v_vectors import dequantize, unit_dot
+
+DEFAULT_BLOCK_SIZE = 65536
+
+
+# exact cosine neighbour search over the whole vocabulary.
+#
+# searches s2v_vectors' unit normalised table so a query is a plain matrix
+# product, the table is scanned in row blocks (bounding the size of the temporary score
+# matrix) keeping a running top-k per query with argpartition. numpy hands each block's
+# product to BLAS which uses all of its threads, so limit them with OPENBLAS_NUM_THREADS
+# / OMP_NUM_THREADS if that competes with the server's own threads. a quantized table
+# is converted to float32 a block at a time.
+#
+# with s2v_partitions the search runs over the rows laid out partition by partition, so that a
+# search limited to some partitions only scans their contiguous slices. the partitions' own
+# memory-mapped copy of the unit vectors in that order is scanned when it is stored the way
+# s2v_vectors stores them (see scripts/build_s2v_indexes.py), otherwise every block is gathered
+# from the table as it is scanned. without partitions (and no empty rows) the table is
+# searched as it is
+class S2vVectorSearch:
+
+  def __init__(self, s2v_vectors, block_size=DEFAULT_BLOCK_SIZE, s2v_partitions=None):
+    self.s2v_vectors = s2v_vectors
+    self.s2v = s2v_vectors.s2v
+    self.block_size = block_size
+    self.s2v_partitions = s2v_partitions
+    key2row = self.s2v.vectors.key2row
+    self.row_keys = np.zeros(self.s2v.vectors.shape[0], dtype=np.uint64)
+    self.row_keys[np.fromiter(key2row.values(), dtype=np.int64, count=len(key2row))] = \
+      np.fromiter(key2row.keys(), dtype=np.uint64, count=len(key2row))
+    if s2v_partitions:
+      self.rows = np.asarray(s2v_partitions.rows, dtype=np.int64)
+      self.ranges = s2v_partitions.ranges
+    else:
+      # rows of the table that have no key assigned are left out
+      self.rows = np.flatnonzero(self.row_keys != 0)
+      self.ranges = { 'all': (0, len(self.rows)) }
+    self.positions = np.full(len(self.row_keys), -1, dtype=np.int64)
+    self.positions[self.rows] = np.arange(len(self.rows))
+    if s2v_partitions and s2v_partitions.has_unit_of(s2v_vectors):
+      self.matrix, self.scales = s2v_partitions.unit, s2v_partitions.scales
+    elif np.array_equal(self.rows, np.arange(len(self.row_keys))):
+      self.matrix, self.scales = s2v_vectors.unit, s2v_vectors.scales
+    else:
+      if s2v_partitions:
+        print('s2v partitions have no vectors stored like the vectors table, rebuild them with scripts/build_s2v_indexes.py -p to scan them memory-mapped')
+      self.matrix, self.scales = None, None
+
+
+  # the unit rows and scales at positions start:end of rows
+  def block(self, start, end):
+    if self.matrix is None:
+      return self.s2v_vectors.unit_rows(self.rows[start:end])
+    return self.matrix[start:end], None if self.scales is None else self.scales[start:end]
+
+
+  # the normalised vectors of the given s2v rows
+  def row_vectors(self, rows):
+    return dequantize(*self.s2v_vectors.unit_rows(rows))
+
+
+  # same contract as s2v.most_similar: the phrase vector of keys is compared to every
+  # key in the table (or in the given partitions) and the n best (key, score) tuples
+  # are returned, excluding keys
+  def most_similar(self, keys, n=10, partitions=None):
+    if isinstance(keys, str):
+      keys = [keys]
+    query = self.s2v_vectors.phrase_unit(keys)
+    if query is None:
+      raise ValueError("Can't find key(s) {0} in table".format(keys))
+    rows, scores = self.search(query[0][None, :], n + len(keys), partitions)
+    result = []
+    for row, score in zip(rows[0], scores[0]):
+      key = self.s2v.strings[int(self.row_keys[row])]
+      if key not in keys:
+        result.append((key, score))
+    return result[:n]
+
+
+  # most_similar for each of keys_list, searched together as one matrix of queries. each
+  # entry is the most_similar result for those keys or the ValueError it would raise
+  def most_similar_batch(self, keys_list, n=10, partitions=None):
+    results = [None] * len(keys_list)
+    valid = []
+    queries = []
+    for i, keys in enumerate(keys_list):
+      query = self.s2v_vectors.phrase_unit(keys)
+      if query is None:
+        results[i] = ValueError("Can't find key(s) {0} in table".format(keys))
+      else:
+        valid.append(i)
+        queries.append(query[0])
+    if not valid:
+      return results
+    rows, scores = self.search(np.stack(queries), n + max(map(lambda i: len(keys_list[i]), valid)), partitions)
+    for i, query_rows, query_scores in zip(valid, rows, scores):
+      keys = keys_list[i]
+      result = []
+      for row, score in zip(query_rows, query_scores):
+        key = self.s2v.strings[int(self.row_keys[row])]
+        if key not in keys:
+          result.append((key, score))
+      results[i] = result[:n]
+    return results
+
+
+  # returns the s2v rows and scores of the n nearest rows for each query vector (normalised
+  # here, unit vectors pass through unchanged), best first, as two (len(queries), n) arrays
+  def search(self, queries, n, partitions=None):
+    queries = np.asarray(queries, dtype=np.float32)
+    norms = np.linalg.norm(queries, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    queries = queries / norms
+    ranges = list(self.ranges.values()) if partitions is None else [self.ranges[p] for p in partitions]
+    n = min(n, sum(map(lambda x: x[1] - x[0], ranges)))
+    best_positions = np.zeros((len(queries), 0), dtype=np.int64)
+    best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+    if n <= 0:
+      return best_positions, best_scores
+    for range_start, range_end in ranges:
+      for start in range(range_start, range_end, self.block_size):
+        end = min(start + self.block_size, range_end)
+        scores = unit_dot(queries, *self.block(start, end))
+        k = min(n, end - start)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_positions = np.concatenate([best_positions, top + start], axis=1)
+        best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+        if best_positions.shape[1] > n:
+          keep = np.argpartition(-best_scores, n - 1, axis=1)[:, :n]
+          best_positions = np.take_along_axis(best_positions, keep, axis=1)
+          best_scores = np.take_along_axis(best_scores, keep, axis=1)
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    return self.rows[np.take_along_axis(best_positions, order, axis=1)], np.take_along_axis(best_scores, order, axis=1)
@@ -0,0 +1,69 @@
+import pytest
+import numpy as np
+from s2v_vectors import S2vVectors
+from s2v_vector_search import S2vVectorSearch
+
+@pytest.fixture
+def s2v_mock():
+    from sense2vec import Sense2Vec
+    rng = np.random.default_rng(0)
+    # more rows than keys, the unused rows must never be returned
+    s2v = Sense2Vec(shape=(60, 8))
+    for i in range(50):
+      s2v.add('word{0}|NOUN'.format(i), rng.standard_normal(8).astype(np.float32))
+    return s2v
+
+
+def brute_force_most_similar(s2v, keys, n):
+    query = np.vstack([s2v[k] for k in keys]).mean(axis=0)
+    scored = []
+    for key in s2v.keys():
+      if key not in keys:
+        v = s2v[key]
+        scored.append((key, float(np.dot(query, v) / (np.linalg.norm(query) * np.linalg.norm(v)))))
+    scored.sort(key=lambda x: -x[1])
+    return scored[:n]
+
+
+@pytest.mark.parametrize('block_size', [7, 64])
+def test_most_similar_is_exact_for_multiple_keys(s2v_mock, block_size):
+    search = S2vVectorSearch(S2vVectors(s2v_mock), block_size=block_size)
+    for keys in [['word1|NOUN'], ['word1|NOUN', 'word2|NOUN'], ['word3|NOUN', 'word4|NOUN', 'word5|NOUN']]:
+      result = search.most_similar(keys, n=10)
+      expected = brute_force_most_similar(s2v_mock, keys, 10)
+      assert [k for k, _ in result] == [k for k, _ in expected]
+      assert np.allclose([s for _, s in result], [s for _, s in expected], atol=1e-5)
+
+
+def test_most_similar_never_returns_more_than_the_keys_in_the_table(s2v_mock):
+    search = S2vVectorSearch(S2vVectors(s2v_mock), block_size=16)
+    result = search.most_similar(['word1|NOUN', 'word2|NOUN'], n=100)
+    assert len(result) == 48
+    assert len(set(k for k, _ in result)) == 48
+
+
+def test_synonyms_for_multiple_key_phrases_when_non_cached_keys_allowed():
+    from sense2vec import Sense2Vec
+    from s2v_util import S2vUtil
+    from s2v_senses import S2vSenses
+    from s2v_key_case_and_sense_variations import S2vKeyCaseAndSenseVariations
+    from s2v_key_commonizer import S2vKeyCommonizer
+    from s2v_synonyms import S2vSynonyms
+    s2v = Sense2Vec(shape=(6, 4))
+    s2v.add('big|ADJ', np.asarray([2, 5, 4, 2], dtype=np.float32))
+    s2v.add('apple|NOUN', np.asarray([1, 3, 9, 3], dtype=np.float32))
+    s2v.add('large|ADJ', np.asarray([2, 5, 3, 2], dtype=np.float32))
+    s2v.add('pear|NOUN', np.asarray([1, 4, 8, 3], dtype=np.float32))
+    s2v.add('car|NOUN', np.asarray([9, 1, 1, 1], dtype=np.float32))
+    s2v_util = S2vUtil(s2v)
+    s2v_key_variations = S2vKeyCaseAndSenseVariations(s2v_util, S2vSenses(s2v_util))
+    k = ['big|ADJ', 'apple|NOUN']
+
+    without_non_cached_keys = S2vSynonyms(s2v_util, s2v_key_variations, S2vKeyCommonizer())
+    assert without_non_cached_keys.call(k, { 'n': 2 }) == []
+
+    with_non_cached_keys = S2vSynonyms(s2v_util, s2v_key_variations, S2vKeyCommonizer(), allow_non_cached_keys=True)
+    result = with_non_cached_keys.call(k, { 'n': 2 })
+    expected = brute_force_most_similar(s2v, ['big|ADJ', 'apple|NOUN'], 2)
+    assert [r['word'] + '|' + r['sense'] for r in result] == [k for k, _ in expected]
+    assert [r['score'] for r in result] == [round(s, 3) for _, s in expected]
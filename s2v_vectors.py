@@ -0,0 +1,172 @@
+import numpy as np
+from s2v_cache import S2vLruCache
+
+NORMALIZE_BLOCK_SIZE = 65536
+
+
+# euclidean norms of the rows of a matrix, every norm (of table rows and of phrase vectors)
+# is computed with this so that equal vectors always get exactly equal norms
+def row_norms(m):
+  return np.sqrt(np.einsum('ij,ij->i', m, m))
+
+
+# float32 vectors of rows stored as float32, float16 or per row scaled int8 codes
+# (scales is None unless int8, see s2v_quantized_vectors)
+def dequantize(codes, scales=None):
+  vectors = codes.astype(np.float32)
+  if scales is not None:
+    vectors *= scales[..., None]
+  return vectors
+
+
+# dot products of float32 queries with rows of codes, without dequantizing the int8 rows:
+# their scale is applied to the scores instead
+def unit_dot(queries, codes, scales=None):
+  scores = queries @ codes.astype(np.float32, copy=False).T
+  if scales is not None:
+    scores *= scales[None, :]
+  return scores
+
+
+# vector math over phrases (lists of s2v keys), a phrase vector is the average of its
+# keys' vectors, the same as s2v.similarity and s2v.most_similar use.
+#
+# keeps a unit normalised float32 copy of the vectors table (unit) with the norm of every row
+# (norms), so cosine similarity is a plain dot product of unit vectors. with normalize_in_place
+# the model's own table is normalised instead of copied (it needs a writable table, so not a
+# memory-mapped one), after that s2v.similarity / s2v.most_similar of multiple keys average unit
+# vectors and no longer match, only use the methods here for those.
+#
+# the unit vectors of multi key phrases are averaged once and kept in phrase_cache (an
+# S2vLruCache keyed on the tuple of keys, by default holding 10000 phrases), single keys are
+# read from the table and never cached
+#
+# with quantized (S2vQuantizedVectors) the unit table is its float16 or int8 codes instead of a
+# float32 copy, similarity and search then run on those (the float32 table is still read for
+# the rows of multi key phrases)
+class S2vVectors:
+
+  def __init__(self, s2v, normalize_in_place=False, phrase_cache=None, quantized=None, normalized=None):
+    self.s2v = s2v
+    self.phrase_cache = phrase_cache if phrase_cache is not None else S2vLruCache(10000)
+    self.scales = None
+    data = s2v.vectors.data
+    if normalize_in_place and quantized is not None:
+      raise ValueError("can't normalize vectors in place when using quantized vectors")
+    if normalize_in_place and not data.flags.writeable:
+      raise ValueError("can't normalize read only (memory-mapped) vectors in place")
+    # whether the model's table holds the unit vectors (raw vectors are then unit * norm)
+    self.table_normalized = normalize_in_place or normalized is not None
+    if normalized is not None:
+      # the table was normalised ahead of time (S2vModelBundle), with its norms and nonzero flags
+      self.unit = data
+      self.norms = normalized.norms
+      self.nonzero = normalized.nonzero
+    elif quantized is None:
+      self.norms = np.zeros(data.shape[0], dtype=np.float32)
+      # whether all of a row's components are non zero, see similarity_matrix
+      self.nonzero = np.zeros(data.shape[0], dtype=bool)
+      self.unit = data if normalize_in_place else np.empty(data.shape, dtype=np.float32)
+      for start in range(0, data.shape[0], NORMALIZE_BLOCK_SIZE):
+        block = np.asarray(data[start:start + NORMALIZE_BLOCK_SIZE], dtype=np.float32)
+        norms = row_norms(block)
+        self.norms[start:start + len(block)] = norms
+        self.nonzero[start:start + len(block)] = block.all(axis=1)
+        norms[norms == 0] = 1.0
+        self.unit[start:start + len(block)] = block / norms[:, None]
+    if quantized is not None:
+      self.unit = quantized.codes
+      self.scales = quantized.scales
+      self.norms = quantized.norms
+      self.nonzero = quantized.nonzero
+
+
+  def rows(self, keys):
+    rows = []
+    for key in keys:
+      if key is None or key not in self.s2v:
+        return None
+      rows.append(self.s2v.vectors.find(key=key))
+    return rows
+
+
+  # the raw (not normalised) vectors of the given rows
+  def row_vectors(self, rows):
+    vectors = np.asarray(self.s2v.vectors.data[rows], dtype=np.float32)
+    if self.table_normalized:
+      return vectors * self.norms[rows, None]
+    return vectors
+
+
+  # the unit normalised rows of the table at the given rows and their scales (None unless
+  # int8), as stored, without a copy when that is all of them in order
+  def unit_rows(self, rows):
+    if len(rows) == len(self.unit) and np.array_equal(rows, np.arange(len(self.unit))):
+      return self.unit, self.scales
+    return self.unit[rows], None if self.scales is None else self.scales[rows]
+
+
+  # the float32 unit vector of a row
+  def unit_vector(self, row):
+    if self.unit.dtype == np.float32:
+      return self.unit[row]
+    return dequantize(self.unit[row], None if self.scales is None else self.scales[row])
+
+
+  def phrase_vector(self, keys):
+    rows = self.rows(keys)
+    if rows is None:
+      return None
+    return self.row_vectors(rows).mean(axis=0)
+
+
+  # the unit phrase vector (read only), its norm and whether all its components are non zero,
+  # None when a key is missing. single keys are read straight from the normalised table
+  def phrase_unit(self, keys):
+    if len(keys) > 1:
+      found, cached = self.phrase_cache.lookup(tuple(keys))
+      if found:
+        return cached
+    rows = self.rows(keys)
+    if rows is None:
+      return None
+    if len(rows) == 1:
+      return self.unit_vector(rows[0]), self.norms[rows[0]], self.nonzero[rows[0]]
+    vector = self.row_vectors(rows).mean(axis=0, keepdims=True)
+    norm = row_norms(vector)[0]
+    unit = vector[0] / (norm if norm != 0 else 1.0)
+    unit.flags.writeable = False
+    result = (unit, norm, bool(vector.all()))
+    self.phrase_cache.set(tuple(keys), result)
+    return result
+
+
+  # stacks the unit phrase vectors into a matrix, with their norms and whether they can be
+  # scored (phrases with a missing key or a zero component can't and get a zero row)
+  def phrase_units(self, phrases):
+    matrix = np.zeros((len(phrases), self.unit.shape[1]), dtype=np.float32)
+    norms = np.zeros(len(phrases), dtype=np.float32)
+    ok = np.zeros(len(phrases), dtype=bool)
+    for i, keys in enumerate(phrases):
+      unit = self.phrase_unit(keys)
+      if unit is not None:
+        matrix[i], norms[i], ok[i] = unit
+    matrix[~ok] = 0.0
+    return matrix, norms, ok
+
+
+  # all pairs cosine similarity between two lists of phrases, as dot products of unit vectors.
+  # mirrors sense2vec.util.cosine_similarity so scores match s2v.similarity: a vector
+  # with any zero component scores 0.0 and two vectors of equal norm score 1.0
+  def similarity_matrix(self, phrases_a, phrases_b):
+    a, a_norms, a_ok = self.phrase_units(phrases_a)
+    b, b_norms, b_ok = self.phrase_units(phrases_b)
+    scores = a @ b.T
+    scores[a_norms[:, None] == b_norms[None, :]] = 1.0
+    scores[~a_ok, :] = 0.0
+    scores[:, ~b_ok] = 0.0
+    return scores
+
+
+  def stats(self):
+    return { 'phrase_cache': self.phrase_cache.stats() }
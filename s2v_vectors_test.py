@@ -0,0 +1,72 @@
+import pytest
+import numpy as np
+from s2v_vectors import S2vVectors
+
+@pytest.fixture
+def s2v_mock():
+    from sense2vec import Sense2Vec
+    rng = np.random.default_rng(1)
+    s2v = Sense2Vec(shape=(40, 8))
+    for i in range(30):
+      s2v.add('word{0}|NOUN'.format(i), rng.standard_normal(8).astype(np.float32))
+    s2v.add('same|NOUN', s2v['word0|NOUN'])
+    s2v.add('zero|NOUN', np.asarray([1, 2, 0, 1, 2, 1, 3, 1], dtype=np.float32))
+    return s2v
+
+
+def phrases(s2v):
+    keys = list(s2v.keys())
+    result = [[k] for k in keys]
+    for i in range(0, 28, 3):
+      result.append(keys[i:i + 2])
+      result.append(keys[i:i + 3])
+    return result + [['missing|NOUN'], ['word1|NOUN', 'missing|NOUN']]
+
+
+def expected_similarity(s2v, a, b):
+    if any(k not in s2v for k in a + b):
+      return 0.0
+    return s2v.similarity(a, b)
+
+
+@pytest.mark.parametrize('normalize_in_place', [False, True])
+def test_similarity_matrix_matches_s2v_similarity(s2v_mock, normalize_in_place):
+    all_phrases = phrases(s2v_mock)
+    expected = [[round(float(expected_similarity(s2v_mock, a, b)), 3) for b in all_phrases] for a in all_phrases]
+    s2v_vectors = S2vVectors(s2v_mock, normalize_in_place=normalize_in_place)
+    scores = s2v_vectors.similarity_matrix(all_phrases, all_phrases)
+    assert [[round(float(s), 3) for s in row] for row in scores] == expected
+    assert s2v_vectors.similarity_matrix([['word0|NOUN']], [['same|NOUN']])[0][0] == 1.0
+    assert s2v_vectors.similarity_matrix([['zero|NOUN']], [['word1|NOUN']])[0][0] == 0.0
+
+
+def test_normalize_in_place_normalizes_the_models_table(s2v_mock):
+    data = s2v_mock.vectors.data.copy()
+    s2v_vectors = S2vVectors(s2v_mock, normalize_in_place=True)
+    assert s2v_vectors.unit is s2v_mock.vectors.data
+    rows = list(s2v_mock.vectors.key2row.values())
+    assert np.allclose(np.linalg.norm(s2v_mock.vectors.data[rows], axis=1), 1.0, atol=1e-6)
+    assert np.allclose(s2v_vectors.row_vectors(rows), data[rows], atol=1e-5)
+    assert np.allclose(s2v_vectors.phrase_vector(['word1|NOUN', 'word2|NOUN']), data[rows[1:3]].mean(axis=0), atol=1e-5)
+
+
+def test_normalize_in_place_needs_a_writable_table(s2v_mock):
+    s2v_mock.vectors.data.flags.writeable = False
+    with pytest.raises(ValueError):
+      S2vVectors(s2v_mock, normalize_in_place=True)
+
+
+def test_multi_key_phrase_vectors_are_cached(s2v_mock):
+    from s2v_cache import S2vLruCache
+    s2v_vectors = S2vVectors(s2v_mock, phrase_cache=S2vLruCache(2))
+    uncached = S2vVectors(s2v_mock, phrase_cache=S2vLruCache(0))
+    all_phrases = phrases(s2v_mock)
+    first = s2v_vectors.similarity_matrix(all_phrases, [['word1|NOUN', 'word2|NOUN'], ['word3|NOUN']])
+    assert np.array_equal(first, uncached.similarity_matrix(all_phrases, [['word1|NOUN', 'word2|NOUN'], ['word3|NOUN']]))
+    s2v_vectors.phrase_cache.hits = s2v_vectors.phrase_cache.misses = 0
+    assert np.array_equal(s2v_vectors.similarity_matrix([['word1|NOUN', 'word2|NOUN']], [['word1|NOUN', 'word2|NOUN']]), [[1.0]])
+    stats = s2v_vectors.stats()['phrase_cache']
+    assert stats['hits'] == 2 and stats['misses'] == 0 and stats['size'] == 2
+    unit, _, _ = s2v_vectors.phrase_unit(['word1|NOUN', 'word2|NOUN'])
+    with pytest.raises(ValueError):
+      unit[0] = 0.0
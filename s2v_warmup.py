@@ -0,0 +1,90 @@
+import threading
+import numpy as np
+from time import perf_counter
+
+WARMUP_BATCH_SIZE = 64
+
+
+# primes a serving process before it reports ready: reads the unit vectors of the top_n most
+# frequent keys (s2v_key_table's freqs) and looks up their synonyms with req_args in batches, which
+# fills the variation memo, result and phrase caches and pages in the vectors, neighbours and
+# index pages the most frequent inputs touch.
+#
+# start runs the warmup once in a background thread, run runs it in the calling thread (before
+# a server serves, see gunicorn.conf.py: the workers forked after it inherit the warm caches
+# and the ready state). a failed warmup still ends in ready, it only leaves the caches colder
+class S2vWarmup:
+
+  def __init__(self, s2v_key_table, synonyms_service, s2v_vectors=None, top_n=1000, req_args={}):
+    self.s2v_key_table = s2v_key_table
+    self.synonyms_service = synonyms_service
+    self.s2v_vectors = s2v_vectors
+    self.top_n = top_n
+    self.req_args = req_args
+    self.lock = threading.Lock()
+    self.started = False
+    self.reset()
+
+
+  def reset(self):
+    self.ready = threading.Event()
+    self.state = 'pending'
+    self.keys_warmed = 0
+    self.seconds = None
+    self.error = None
+
+
+  def start(self):
+    with self.lock:
+      if self.started:
+        return
+      self.started = True
+    if self.top_n <= 0:
+      self.state = 'done'
+      self.ready.set()
+      return
+    threading.Thread(target=self.run, name='s2v-warmup', daemon=True).start()
+
+
+  # the top_n most frequent keys, most frequent first, keys without a frequency count as 0
+  def top_keys(self):
+    row_keys = self.s2v_key_table.row_keys
+    freqs = np.where(row_keys != 0, np.maximum(self.s2v_key_table.freqs, 0), -1)
+    n = min(self.top_n, int(np.count_nonzero(row_keys)))
+    if n <= 0:
+      return []
+    rows = np.argpartition(-freqs, n - 1)[:n]
+    rows = rows[np.argsort(-freqs[rows], kind='stable')]
+    return list(map(self.s2v_key_table.key, rows))
+
+
+  def run(self):
+    start = perf_counter()
+    self.state = 'running'
+    try:
+      keys = self.top_keys()
+      if self.s2v_vectors is not None and keys:
+        self.s2v_vectors.unit_rows(np.asarray(self.s2v_vectors.rows(keys), dtype=np.int64))
+      for i in range(0, len(keys), WARMUP_BATCH_SIZE):
+        batch = keys[i:i + WARMUP_BATCH_SIZE]
+        self.synonyms_service.call_batch(list(map(lambda x: [x], batch)), self.req_args)
+        self.keys_warmed += len(batch)
+      self.state = 'done'
+    except Exception as e:
+      print('s2v warmup failed:', e)
+      self.state = 'failed'
+      self.error = str(e)
+    finally:
+      self.seconds = round(perf_counter() - start, 3)
+      self.ready.set()
+
+
+  def status(self):
+    return {
+      'ready': self.ready.is_set(),
+      'state': self.state,
+      'keys_warmed': self.keys_warmed,
+      'top_n': self.top_n,
+      'seconds': self.seconds,
+      'error': self.error,
+    }
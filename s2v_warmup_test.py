@@ -0,0 +1,67 @@
+import pytest
+import numpy as np
+from s2v_warmup import S2vWarmup
+
+@pytest.fixture
+def s2v_mock():
+    from sense2vec import Sense2Vec
+    s2v = Sense2Vec(shape=(20, 4))
+    rng = np.random.default_rng(8)
+    for i, word in enumerate(['apple', 'pear', 'big', 'large', 'car', 'bus', 'plastic']):
+      s2v.add('{0}|NOUN'.format(word), rng.standard_normal(4).astype(np.float32), freq=(i + 1) * 10)
+    for word in ['rare', 'odd', 'unusual', 'scarce', 'few', 'sparse']:
+      s2v.add('{0}|NOUN'.format(word), rng.standard_normal(4).astype(np.float32))
+    return s2v
+
+
+@pytest.fixture
+def synonyms(s2v_mock):
+    from s2v_util import S2vUtil
+    from s2v_senses import S2vSenses
+    from s2v_cache import S2vLruCache
+    from s2v_key_case_and_sense_variations import S2vKeyCaseAndSenseVariations
+    from s2v_key_commonizer import S2vKeyCommonizer
+    from s2v_synonyms import S2vSynonyms
+    s2v_util = S2vUtil(s2v_mock)
+    return S2vSynonyms(
+      s2v_util,
+      S2vKeyCaseAndSenseVariations(s2v_util, S2vSenses(s2v_util), memo_cache=S2vLruCache(100)),
+      S2vKeyCommonizer(),
+      allow_non_cached_keys=True,
+      result_cache=S2vLruCache(100),
+    )
+
+
+def test_warmup_primes_the_most_frequent_keys(s2v_mock, synonyms):
+    from s2v_vectors import S2vVectors
+    warmup = S2vWarmup(synonyms.s2v_key_table, synonyms, S2vVectors(s2v_mock), top_n=3, req_args={ 'n': '5' })
+    assert warmup.top_keys() == ['plastic|NOUN', 'bus|NOUN', 'car|NOUN']
+    # keys without a frequency come last
+    assert S2vWarmup(synonyms.s2v_key_table, synonyms, top_n=8).top_keys()[:7] == ['plastic|NOUN', 'bus|NOUN', 'car|NOUN', 'large|NOUN', 'big|NOUN', 'pear|NOUN', 'apple|NOUN']
+    assert not warmup.status()['ready']
+    warmup.start()
+    assert warmup.ready.wait(10)
+    assert warmup.status() == { 'ready': True, 'state': 'done', 'keys_warmed': 3, 'top_n': 3, 'seconds': warmup.seconds, 'error': None }
+    assert len(synonyms.result_cache) == 3
+    synonyms.call_batch([['bus|NOUN']], { 'n': '5' })
+    assert synonyms.result_cache.stats()['hits'] == 1
+    # started once
+    warmup.start()
+    assert warmup.status()['keys_warmed'] == 3
+
+
+def test_warmup_of_no_keys_is_ready_at_once(s2v_mock, synonyms):
+    warmup = S2vWarmup(synonyms.s2v_key_table, synonyms, top_n=0)
+    warmup.start()
+    assert warmup.ready.is_set()
+    assert warmup.status()['state'] == 'done'
+
+
+def test_failed_warmup_still_ends_ready(synonyms):
+    class FailingSynonyms:
+      def call_batch(self, items, req_args):
+        raise ValueError('no synonyms')
+    warmup = S2vWarmup(synonyms.s2v_key_table, FailingSynonyms(), top_n=2)
+    warmup.run()
+    assert warmup.status()['ready']
+    assert (warmup.status()['state'], warmup.status()['error']) == ('failed', 'no synonyms')
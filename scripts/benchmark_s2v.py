@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+
+# times the services (S2vSenses, S2vKeyCaseAndSenseVariations, S2vSynonyms, S2vSimilarity) on
+# representative inputs for synthetic models of each of the given sizes (generated in memory,
+# see scripts/generate_s2v_model.py) or for a model directory, and writes a json report to
+# compare between commits. inputs are phrases of 1 to 3 keys sampled by damped frequency, a
+# noun head with adjective / noun modifiers. every benchmark is timed after a warmup pass over
+# its inputs, with the result and variation caches off (the phrase vector cache stays on, as
+# in the server). setup costs (generating the model, building its indexes) are reported too.
+
+# cd sense2vec-rest
+# python -m scripts.benchmark_s2v -k 10000,100000,1000000 -o benchmark.json
+# python -m scripts.benchmark_s2v -m /sense2vec-model -o benchmark.json
+#
+# against the report of an earlier commit:
+# python -m scripts.benchmark_s2v -k 10000,100000 -o benchmark.json -c benchmark_before.json
+
+
+import json
+import time
+import platform
+import subprocess
+from datetime import datetime, timezone
+import plac
+import numpy as np
+from wasabi import msg
+from sense2vec import Sense2Vec
+from s2v_util import S2vUtil
+from s2v_senses import S2vSenses
+from s2v_caseless_index import S2vCaselessIndex
+from s2v_key_table import S2vKeyTable
+from s2v_key_case_and_sense_variations import S2vKeyCaseAndSenseVariations
+from s2v_key_commonizer import S2vKeyCommonizer
+from s2v_similarity import S2vSimilarity
+from s2v_synonyms import S2vSynonyms
+from s2v_vectors import S2vVectors
+from s2v_vector_search import S2vVectorSearch
+from scripts.generate_s2v_model import generate_s2v
+
+REPORT_VERSION = 1
+BATCH_SIZE = 32
+
+
+def timed(fn):
+  start = time.perf_counter()
+  result = fn()
+  return result, time.perf_counter() - start
+
+
+def git_commit():
+  try:
+    return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+# returns sample(count, phrase_length), count phrases of phrase_length keys: modifiers from the
+# adjective and noun keys and a noun head, sampled by the square root of their frequency so
+# frequent keys come up more often without every input being one of the top few keys
+def phrase_sampler(s2v_util, rng):
+  s2v = s2v_util.s2v
+  nouns = []
+  modifiers = []
+  for key in s2v.keys():
+    sense = s2v.split_key(key)[1]
+    if sense in s2v_util.s2v_noun_tags:
+      nouns.append(key)
+      modifiers.append(key)
+    elif sense in s2v_util.s2v_adj_tags:
+      modifiers.append(key)
+
+  def sampler(keys):
+    weights = np.sqrt(np.asarray([max(s2v.get_freq(key) or 1, 1) for key in keys], dtype=np.float64))
+    weights /= weights.sum()
+    return lambda size: [keys[i] for i in rng.choice(len(keys), size=size, p=weights)]
+
+  sample_nouns = sampler(nouns)
+  sample_modifiers = sampler(modifiers)
+
+  def sample(count, phrase_length):
+    heads = sample_nouns(count)
+    firsts = sample_modifiers(count * max(phrase_length - 1, 1))
+    return [
+      firsts[i * (phrase_length - 1):(i + 1) * (phrase_length - 1)] + [head]
+      for i, head in enumerate(heads)
+    ]
+
+  return sample
+
+
+# calls fn on every input after a warmup pass over them, the timings of the timed pass in us
+def time_calls(fn, inputs):
+  for x in inputs:
+    fn(x)
+  timings = []
+  for x in inputs:
+    start = time.perf_counter()
+    fn(x)
+    timings.append((time.perf_counter() - start) * 1e6)
+  return timings
+
+
+def summarize(name, phrase_length, timings, items_per_call=1):
+  timings = np.asarray(timings) / items_per_call
+  return {
+    'name': name,
+    'phrase_length': phrase_length,
+    'calls': len(timings),
+    'items_per_call': items_per_call,
+    'mean_us': round(float(timings.mean()), 2),
+    'p50_us': round(float(np.percentile(timings, 50)), 2),
+    'p95_us': round(float(np.percentile(timings, 95)), 2),
+    'p99_us': round(float(np.percentile(timings, 99)), 2),
+    'max_us': round(float(timings.max()), 2),
+  }
+
+
+def benchmark_model(s2v, sample, phrase_lengths, seed):
+  setup = {}
+  s2v_util = S2vUtil(s2v)
+  s2v_caseless_index, setup['caseless_index_seconds'] = timed(lambda: S2vCaselessIndex.build(s2v))
+  s2v_key_table, setup['key_table_seconds'] = timed(lambda: S2vKeyTable.build(s2v_util))
+  s2v_vectors, setup['vectors_seconds'] = timed(lambda: S2vVectors(s2v))
+  s2v_senses = S2vSenses(s2v_util, s2v_caseless_index)
+  s2v_key_variations = S2vKeyCaseAndSenseVariations(s2v_util, s2v_senses)
+  synonyms = S2vSynonyms(
+    s2v_util,
+    s2v_key_variations,
+    S2vKeyCommonizer(),
+    allow_non_cached_keys=True,
+    s2v_vector_search=S2vVectorSearch(s2v_vectors),
+    s2v_key_table=s2v_key_table,
+  )
+  similarity = S2vSimilarity(s2v_util, s2v_key_variations, S2vKeyCommonizer(), s2v_vectors)
+  sample_phrases = phrase_sampler(s2v_util, np.random.default_rng(seed))
+  req_args = { 'n': 10, 'min-score': 0.5, 'reduce-multicase': True, 'match-input-sense': True }
+
+  results = []
+  pairs = sample_phrases(sample, 2)
+  results.append(summarize('senses.noun_based', 1, time_calls(s2v_senses.get_noun_based_senses, list(map(lambda x: s2v.split_key(x[1])[0], pairs)))))
+  results.append(summarize('senses.adjective_based', 1, time_calls(s2v_senses.get_adjective_based_senses, list(map(lambda x: s2v.split_key(x[0])[0], pairs)))))
+  for phrase_length in phrase_lengths:
+    phrases = sample_phrases(sample, phrase_length)
+    others = sample_phrases(sample, phrase_length)
+    commonized = list(map(synonyms.commonize_input, phrases))
+    results.append(summarize('variations', phrase_length, time_calls(
+      lambda d: s2v_key_variations.call(d['phrase'], flag_joined_phrase_variations=True, phrase_is_proper=d['is_proper'], limit=25),
+      commonized,
+    )))
+    results.append(summarize('synonyms', phrase_length, time_calls(lambda x: synonyms.call_batch([x], req_args), phrases)))
+    batches = [phrases[i:i + BATCH_SIZE] for i in range(0, len(phrases), BATCH_SIZE)]
+    results.append(summarize('synonyms.batch', phrase_length, time_calls(lambda x: synonyms.call_batch(x, req_args), batches), BATCH_SIZE))
+    results.append(summarize('similarity', phrase_length, time_calls(lambda x: similarity.call_batch([x]), list(map(list, zip(phrases, others))))))
+  return setup, results
+
+
+def compare(report, previous):
+  before = {}
+  for model in previous['models']:
+    for result in model['benchmarks']:
+      before[(model['keys'], result['name'], result['phrase_length'])] = result['mean_us']
+  rows = []
+  for model in report['models']:
+    for result in model['benchmarks']:
+      key = (model['keys'], result['name'], result['phrase_length'])
+      if key in before:
+        rows.append(key + (before[key], result['mean_us'], round(result['mean_us'] / before[key], 3) if before[key] else None))
+  if not rows:
+    msg.warn("no benchmarks in common with the earlier report")
+    return
+  msg.table(rows, header=('keys', 'benchmark', 'length', 'before us', 'now us', 'ratio'), divider=True, title="compared to {0}".format(previous.get('commit')))
+
+
+@plac.annotations(
+    keys=("Comma separated sizes of the synthetic models to benchmark", "option", "k", str),
+    model_path=("Benchmark this model directory instead of synthetic models", "option", "m", str),
+    dims=("Vector dimensions of the synthetic models", "option", "d", int),
+    sample=("Inputs per benchmark", "option", "s", int),
+    phrase_lengths=("Comma separated phrase lengths (keys per input) to benchmark", "option", "l", str),
+    seed=("Random seed of the models and inputs", "option", "S", int),
+    output=("Path to write the report to as json", "option", "o", str),
+    compare_to=("Report of an earlier run to compare the mean timings to", "option", "c", str),
+)
+def main(keys='10000,100000', model_path=None, dims=128, sample=200, phrase_lengths='1,2,3', seed=0, output=None, compare_to=None):
+  phrase_lengths = list(map(int, phrase_lengths.split(',')))
+  report = {
+    'version': REPORT_VERSION,
+    'commit': git_commit(),
+    'created': datetime.now(timezone.utc).isoformat(),
+    'python': platform.python_version(),
+    'numpy': np.__version__,
+    'platform': platform.platform(),
+    'sample': sample,
+    'models': [],
+  }
+  sizes = [None] if model_path else list(map(int, keys.split(',')))
+  for size in sizes:
+    if model_path:
+      msg.info("loading model from disk")
+      s2v, load_seconds = timed(lambda: Sense2Vec().from_disk(model_path))
+      model = { 'source': model_path, 'setup': { 'load_seconds': load_seconds } }
+    else:
+      msg.info("generating a synthetic model of {0} keys".format(size))
+      s2v, generate_seconds = timed(lambda: generate_s2v(size, dims, seed=seed))
+      model = { 'source': 'synthetic', 'setup': { 'generate_seconds': generate_seconds } }
+    model['keys'] = len(s2v)
+    model['dims'] = s2v.vectors.shape[1]
+    setup, benchmarks = benchmark_model(s2v, sample, phrase_lengths, seed)
+    model['setup'].update(setup)
+    model['benchmarks'] = benchmarks
+    report['models'].append(model)
+
+    msg.table(
+      [(r['name'], r['phrase_length'], r['mean_us'], r['p50_us'], r['p95_us'], r['p99_us']) for r in benchmarks],
+      header=('benchmark', 'length', 'mean us', 'p50 us', 'p95 us', 'p99 us'),
+      divider=True,
+      title="{0} keys, {1} dims".format(model['keys'], model['dims']),
+    )
+    msg.text("setup: " + ', '.join('{0} {1:.2f}'.format(k, v) for k, v in model['setup'].items()))
+
+  if compare_to:
+    with open(compare_to) as f:
+      compare(report, json.load(f))
+  if output:
+    with open(output, 'w') as f:
+      json.dump(report, f, indent=2)
+    msg.good("saved report", output)
+
+if __name__ == "__main__":
+  try:
+    plac.call(main)
+  except KeyboardInterrupt:
+    msg.warn("Cancelled.")
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+# starts the server under gunicorn with the given number of workers, sends it some requests
+# and reports the memory of the master and of each worker process from /proc/<pid>/smaps_rollup
+# (linux only). RSS counts shared pages in full in every process, PSS divides them between the
+# processes sharing them, so the PSS of the workers is what each extra worker really costs.
+# fails when any of the requests isn't answered with a 2xx status, the memory of workers that
+# didn't serve them would be meaningless.
+
+# cd sense2vec-rest
+# python -m scripts.benchmark_worker_memory /sense2vec-model -w 4
+#
+# compared to every worker loading its own copy of the model:
+# python -m scripts.benchmark_worker_memory /sense2vec-model -w 4 --no-preload --no-mmap
+#
+# write the report as json:
+# python -m scripts.benchmark_worker_memory /sense2vec-model -w 4 -o worker_memory.json
+
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import subprocess
+import urllib.request
+import urllib.error
+import plac
+from wasabi import msg
+
+SMAPS_FIELDS = ['Rss', 'Pss', 'Shared_Clean', 'Shared_Dirty', 'Private_Clean', 'Private_Dirty']
+
+
+def free_port():
+  with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    return s.getsockname()[1]
+
+
+# memory of a process in kB
+def process_memory(pid):
+  memory = {}
+  with open('/proc/{0}/smaps_rollup'.format(pid)) as f:
+    for line in f:
+      parts = line.split()
+      if parts[0].rstrip(':') in SMAPS_FIELDS:
+        memory[parts[0].rstrip(':')] = int(parts[1])
+  return {
+    'rss_kb': memory['Rss'],
+    'pss_kb': memory['Pss'],
+    'shared_kb': memory['Shared_Clean'] + memory['Shared_Dirty'],
+    'private_kb': memory['Private_Clean'] + memory['Private_Dirty'],
+  }
+
+
+def child_pids(pid):
+  children = []
+  for entry in os.listdir('/proc'):
+    if entry.isdigit():
+      try:
+        with open('/proc/{0}/stat'.format(entry)) as f:
+          # the command name (2nd field) is in parentheses and may hold spaces
+          if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+            children.append(int(entry))
+      except (OSError, IndexError):
+        continue
+  return sorted(children)
+
+
+def post(url, body):
+  # a json content type, urllib's default form one would have flask parse the body as a form
+  request = urllib.request.Request(url, data=json.dumps(body).encode('utf-8'), method='POST', headers={ 'Content-Type': 'application/json' })
+  try:
+    with urllib.request.urlopen(request, timeout=60) as response:
+      return response.status
+  except urllib.error.HTTPError as e:
+    return e.code
+
+
+# waits for /readyz, answered once the workers are warm (see S2vWarmup and gunicorn.conf.py)
+def wait_until_serving(url, process, timeout):
+  deadline = time.time() + timeout
+  while time.time() < deadline:
+    if process.poll() is not None:
+      raise RuntimeError('gunicorn exited with {0}'.format(process.returncode))
+    try:
+      urllib.request.urlopen(url + '/readyz', timeout=5)
+      return
+    except urllib.error.HTTPError as e:
+      if e.code != 503:
+        raise
+      time.sleep(0.5)
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+      time.sleep(0.5)
+  raise RuntimeError('gunicorn did not start serving within {0}s'.format(timeout))
+
+
+@plac.annotations(
+    model_path=("Path to sense2vec model directory", "positional", None, str),
+    workers=("Number of gunicorn workers", "option", "w", int),
+    threads=("Threads per gunicorn worker", "option", "t", int),
+    requests=("Requests to send before measuring, spread over the workers", "option", "r", int),
+    no_preload=("Load the app in every worker instead of once in the master", "flag", "P"),
+    no_mmap=("Read the vectors into memory instead of memory-mapping them", "flag", "M"),
+    timeout=("Seconds to wait for the server to start", "option", "s", int),
+    output=("Path to write the report to as json", "option", "o", str),
+)
+def main(model_path, workers=4, threads=4, requests=200, no_preload=False, no_mmap=False, timeout=600, output=None):
+  port = free_port()
+  url = 'http://127.0.0.1:{0}'.format(port)
+  env = dict(
+    os.environ,
+    S2V_MODEL_PATH=model_path,
+    GUNICORN_PRELOAD='0' if no_preload else '1',
+  )
+  if no_mmap:
+    env.pop('S2V_MMAP_VECTORS', None)
+  else:
+    env['S2V_MMAP_VECTORS'] = '1'
+  app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  msg.info("starting gunicorn with {0} workers ({1})".format(workers, 'no preload' if no_preload else 'preload'))
+  process = subprocess.Popen([
+    sys.executable, '-m', 'gunicorn',
+    '--bind', '127.0.0.1:{0}'.format(port),
+    '--workers', str(workers),
+    '--threads', str(threads),
+    '--timeout', str(timeout),
+    'wsgi:app',
+  ], cwd=app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+  try:
+    wait_until_serving(url, process, timeout)
+    # the first requests can be served before every worker has finished loading
+    deadline = time.time() + timeout
+    while len(child_pids(process.pid)) < workers and time.time() < deadline:
+      time.sleep(0.5)
+    msg.good("serving", url)
+
+    statuses = {}
+    for i in range(requests):
+      status = post(url + '/', [['plastic|NOUN']]) if i % 2 == 0 else post(url + '/similarity', [[['plastic|NOUN'], ['bottle|NOUN']]])
+      statuses[status] = statuses.get(status, 0) + 1
+    msg.text("sent {0} requests, statuses {1}".format(requests, statuses))
+    failed = sum(count for status, count in statuses.items() if not 200 <= status < 300)
+    if failed:
+      msg.fail("{0} of {1} requests failed, statuses {2}".format(failed, requests, statuses), exits=1)
+
+    master = dict(process_memory(process.pid), pid=process.pid, role='master')
+    worker_memory = [dict(process_memory(pid), pid=pid, role='worker') for pid in child_pids(process.pid)]
+  finally:
+    process.send_signal(signal.SIGTERM)
+    try:
+      process.wait(30)
+    except subprocess.TimeoutExpired:
+      process.kill()
+
+  report = {
+    'model_path': model_path,
+    'workers': workers,
+    'threads': threads,
+    'preload': not no_preload,
+    'mmap_vectors': not no_mmap,
+    'requests': requests,
+    'statuses': { str(status): count for status, count in statuses.items() },
+    'processes': [master] + worker_memory,
+    'total_rss_kb': sum(map(lambda x: x['rss_kb'], [master] + worker_memory)),
+    'total_pss_kb': sum(map(lambda x: x['pss_kb'], [master] + worker_memory)),
+    'mean_worker_pss_kb': round(sum(map(lambda x: x['pss_kb'], worker_memory)) / max(len(worker_memory), 1)),
+  }
+  header = ('role', 'pid', 'rss MB', 'pss MB', 'shared MB', 'private MB')
+  rows = [(
+    p['role'],
+    p['pid'],
+    round(p['rss_kb'] / 1024, 1),
+    round(p['pss_kb'] / 1024, 1),
+    round(p['shared_kb'] / 1024, 1),
+    round(p['private_kb'] / 1024, 1),
+  ) for p in report['processes']]
+  msg.table(rows, header=header, divider=True)
+  msg.text("total rss {0} MB, total pss {1} MB, mean worker pss {2} MB".format(
+    round(report['total_rss_kb'] / 1024, 1),
+    round(report['total_pss_kb'] / 1024, 1),
+    round(report['mean_worker_pss_kb'] / 1024, 1),
+  ))
+  if output:
+    with open(output, 'w') as f:
+      json.dump(report, f, indent=2)
+    msg.good("saved report", output)
+
+if __name__ == "__main__":
+  try:
+    plac.call(main)
+  except KeyboardInterrupt:
+    msg.warn("Cancelled.")
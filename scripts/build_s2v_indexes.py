@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+# builds the derived index files that the server memory-maps at startup instead of
+# computing them in every worker. the files are written into the model directory and
+# are tagged with the model's fingerprint, rebuild them whenever the model changes.
+
+# cd sense2vec-rest
+# python -m scripts.build_s2v_indexes /sense2vec-model
+#
+# to also build a 200 deep neighbour table (replaces the model's most_similar cache, this is
+# a full vocabulary x vocabulary scan so expect it to take a long time on large models):
+# python -m scripts.build_s2v_indexes /sense2vec-model -n 200
+#
+# to also partition the vocabulary by sense and properness (the server then searches synonyms
+# exactly within the partitions a request's filters keep, instead of filtering cached neighbours).
+# the partitions hold a copy of the unit vectors laid out partition by partition, float32 or with
+# -q the quantized vectors in the model directory (scripts/quantize_s2v.py, for a server run with
+# S2V_QUANTIZED_VECTORS):
+# python -m scripts.build_s2v_indexes /sense2vec-model -p
+# python -m scripts.build_s2v_indexes /sense2vec-model -p -q
+
+
+import os
+import plac
+from wasabi import msg
+from sense2vec import Sense2Vec
+from s2v_util import S2vUtil
+from s2v_caseless_index import S2vCaselessIndex, CASELESS_INDEX_FILENAME
+from s2v_key_table import S2vKeyTable, KEY_TABLE_FILENAME
+from s2v_partitions import S2vPartitions, PARTITIONS_FILENAME
+from s2v_vectors import S2vVectors
+from s2v_quantized_vectors import S2vQuantizedVectors
+from s2v_vector_search import S2vVectorSearch
+from s2v_neighbour_table import S2vNeighbourTable, NEIGHBOUR_TABLE_FILENAME, DEFAULT_BUILD_BATCH_SIZE
+
+
+@plac.annotations(
+    model_path=("Path to sense2vec model directory", "positional", None, str),
+    out_dir=("Directory to write the index files to, defaults to the model directory", "option", "o", str),
+    partitions=("Also build the sense/properness partitions for partitioned synonym search", "flag", "p"),
+    quantized=("Lay out the quantized vectors of the model directory in the partitions", "flag", "q"),
+    neighbours=("Depth of the neighbour table to build, 0 to skip it", "option", "n", int),
+    batch_size=("Rows searched per matrix product when building the neighbour table", "option", "b", int),
+)
+def main(model_path, out_dir=None, partitions=False, quantized=False, neighbours=0, batch_size=DEFAULT_BUILD_BATCH_SIZE):
+  out_dir = out_dir or model_path
+  msg.info("loading model from disk")
+  s2v = Sense2Vec().from_disk(model_path)
+  msg.good("model loaded", "{0} keys".format(len(s2v)))
+
+  caseless_index = S2vCaselessIndex.build(s2v)
+  caseless_index_path = os.path.join(out_dir, CASELESS_INDEX_FILENAME)
+  caseless_index.save(caseless_index_path)
+  msg.good("saved caseless index", "{0} words -> {1}".format(caseless_index.words_len, caseless_index_path))
+
+  s2v_util = S2vUtil(s2v)
+  key_table = S2vKeyTable.build(s2v_util)
+  key_table_path = os.path.join(out_dir, KEY_TABLE_FILENAME)
+  key_table.save(key_table_path)
+  msg.good("saved key table", key_table_path)
+
+  if partitions:
+    quantized_vectors = None
+    if quantized:
+      quantized_vectors = S2vQuantizedVectors.load_if_exists(s2v, model_path)
+      if quantized_vectors is None:
+        msg.fail("no current quantized vectors in {0}, run scripts/quantize_s2v.py first".format(model_path), exits=1)
+    s2v_partitions = S2vPartitions.build(s2v_util, key_table, S2vVectors(s2v, quantized=quantized_vectors))
+    partitions_path = os.path.join(out_dir, PARTITIONS_FILENAME)
+    s2v_partitions.save(partitions_path)
+    for name, (start, end) in s2v_partitions.ranges.items():
+      msg.text("{0}: {1} keys".format(name, end - start))
+    msg.good("saved partitions", partitions_path)
+
+  if neighbours > 0:
+    msg.info("building {0} deep neighbour table".format(neighbours))
+    def progress(done, total):
+      msg.text("{0}/{1} rows".format(done, total))
+    s2v_vector_search = S2vVectorSearch(S2vVectors(s2v))
+    neighbour_table = S2vNeighbourTable.build(s2v_vector_search, neighbours, batch_size, progress)
+    neighbour_table_path = os.path.join(out_dir, NEIGHBOUR_TABLE_FILENAME)
+    neighbour_table.save(neighbour_table_path)
+    msg.good("saved neighbour table", neighbour_table_path)
+
+if __name__ == "__main__":
+  try:
+    plac.call(main)
+  except KeyboardInterrupt:
+    msg.warn("Cancelled.")
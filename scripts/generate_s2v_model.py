@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+# generates a synthetic sense2vec model directory for benchmarks (see scripts/benchmark_s2v.py)
+# and load tests, shaped like the real ones: made up words, some of them multiword keys
+# (new_york style), spread over a configurable mix of senses, with title / upper cased variants
+# of a share of them, zipf distributed frequencies (rows ordered most frequent first, like the
+# released models) and a prebuilt most_similar cache.
+#
+# vectors are drawn around topic centroids, the senses and case variants of a word close to
+# each other, so neighbours are meaningful. the most_similar cache is searched within each
+# key's topic only, which keeps generating a 1M key model under half a minute.
+
+# cd sense2vec-rest
+# python -m scripts.generate_s2v_model /tmp/s2v-synthetic -k 1000000
+# python -m scripts.generate_s2v_model /tmp/s2v-synthetic -k 100000 -d 300 -m NOUN:0.6,ADJ:0.2,PROPN:0.2
+
+
+import time
+import plac
+import numpy as np
+from wasabi import msg
+from sense2vec import Sense2Vec
+from spacy.strings import StringStore, get_string_id
+from spacy.vectors import Vectors
+
+DEFAULT_SENSE_MIX = 'NOUN:0.45,PROPN:0.12,ADJ:0.15,VERB:0.15,ADV:0.04,GPE:0.03,ORG:0.03,PERSON:0.03'
+SYLLABLES = [c + v for c in 'bcdfghjklmnprstvwz' for v in 'aeiou'] + ['th', 'sh', 'ch', 'qu', 'x']
+TOPIC_SIZE = 1000
+
+
+def parse_sense_mix(sense_mix):
+  senses = []
+  weights = []
+  for part in sense_mix.split(','):
+    sense, weight = part.split(':')
+    senses.append(sense.strip())
+    weights.append(float(weight))
+  weights = np.asarray(weights)
+  return senses, weights / weights.sum()
+
+
+# count distinct made up lowercase words of 2 to 4 syllables
+def made_up_words(count, rng):
+  words = set()
+  while len(words) < count:
+    needed = count - len(words)
+    lengths = rng.integers(2, 5, size=needed * 2)
+    syllables = rng.integers(len(SYLLABLES), size=(needed * 2, 4))
+    for length, row in zip(lengths, syllables):
+      words.add(''.join(SYLLABLES[s] for s in row[:length]))
+  return sorted(words)[:count]
+
+
+# (key, lemma) pairs of the model's keys, lemma the index of the word whose senses and case
+# variants the key is one of
+def generate_keys(keys, senses, sense_weights, case_variants, multiword, extra_senses, rng):
+  # a few more lemmas than the keys per lemma suggest, the surplus is left unused
+  lemma_count = int(keys / (1 + extra_senses + case_variants * 1.25) * 1.2) + 10
+  words = made_up_words(lemma_count * 2, rng)
+  rng.shuffle(words)
+  lemma_words = []
+  for i in range(lemma_count):
+    if rng.random() < multiword:
+      lemma_words.append('_'.join(words[lemma_count + (i * 3 + j) % lemma_count] for j in range(rng.integers(2, 4))))
+    else:
+      lemma_words.append(words[i])
+
+  generated = []
+  seen = set()
+
+  def add(word, sense, lemma):
+    key = '{0}|{1}'.format(word, sense)
+    if key not in seen:
+      seen.add(key)
+      generated.append((key, lemma))
+
+  primary = rng.choice(len(senses), size=lemma_count, p=sense_weights)
+  for lemma, (word, sense_index) in enumerate(zip(lemma_words, primary)):
+    sense = senses[sense_index]
+    add(word if sense in ('NOUN', 'ADJ', 'VERB', 'ADV') else word.title(), sense, lemma)
+    if rng.random() < extra_senses:
+      add(word, senses[rng.choice(len(senses), p=sense_weights)], lemma)
+    if rng.random() < case_variants:
+      add(word.title(), 'PROPN' if sense == 'NOUN' else sense, lemma)
+      if rng.random() < 0.25:
+        add(word.upper(), sense, lemma)
+    if len(generated) >= keys:
+      break
+  return generated[:keys]
+
+
+# the topic neighbours of every row, best first, as the most_similar cache of the model
+def topic_cache(vectors, topics, depth):
+  norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+  unit = vectors / np.where(norms > 0, norms, 1)
+  order = np.argsort(topics, kind='stable')
+  groups = np.split(order, np.flatnonzero(np.diff(topics[order])) + 1)
+  depth = min([depth] + [len(members) - 1 for members in groups])
+  if depth <= 0:
+    return None
+  indices = np.zeros((len(vectors), depth), dtype=np.int32)
+  scores = np.zeros((len(vectors), depth), dtype=np.float32)
+  for members in groups:
+    sims = unit[members] @ unit[members].T
+    np.fill_diagonal(sims, -np.inf)
+    top = np.argpartition(-sims, depth - 1, axis=1)[:, :depth]
+    top_sims = np.take_along_axis(sims, top, axis=1)
+    best_first = np.argsort(-top_sims, axis=1, kind='stable')
+    indices[members] = members[np.take_along_axis(top, best_first, axis=1)]
+    scores[members] = np.take_along_axis(top_sims, best_first, axis=1)
+  return { 'indices': indices, 'scores': scores }
+
+
+# a synthetic Sense2Vec of keys keys (see the module comment), cache_depth 0 for no most_similar cache
+def generate_s2v(keys=100000, dims=128, sense_mix=DEFAULT_SENSE_MIX, case_variants=0.2, multiword=0.15, extra_senses=0.3, cache_depth=20, seed=0):
+  rng = np.random.default_rng(seed)
+  senses, sense_weights = parse_sense_mix(sense_mix)
+  generated = generate_keys(keys, senses, sense_weights, case_variants, multiword, extra_senses, rng)
+  lemmas = np.fromiter((lemma for _, lemma in generated), dtype=np.int64, count=len(generated))
+  lemma_count = int(lemmas.max()) + 1
+
+  # a lemma's vector is its topic's centroid plus noise, its keys are close variations of it
+  topic_count = max(1, len(generated) // TOPIC_SIZE)
+  lemma_topics = rng.permutation(lemma_count) % topic_count
+  centroids = rng.standard_normal((topic_count, dims)).astype(np.float32)
+  lemma_vectors = centroids[lemma_topics] + rng.standard_normal((lemma_count, dims)).astype(np.float32) * 0.8
+  vectors = lemma_vectors[lemmas] + rng.standard_normal((len(generated), dims)).astype(np.float32) * 0.3
+  vectors *= rng.lognormal(0.0, 0.25, size=(len(generated), 1)).astype(np.float32)
+
+  # zipf frequencies, rows ordered by descending frequency
+  ranks = rng.permutation(len(generated)) + 1
+  freqs = (1e7 / ranks ** 1.07).astype(np.int64) + 1
+  order = np.argsort(-freqs, kind='stable')
+  key_strings = [generated[i][0] for i in order]
+  vectors = np.ascontiguousarray(vectors[order])
+  freqs = freqs[order]
+
+  s2v = Sense2Vec(shape=(0, dims), senses=sorted(set(senses)))
+  hashes = [get_string_id(key) for key in key_strings]
+  s2v.vectors = Vectors(data=vectors, keys=hashes, name='sense2vec')
+  s2v.strings = StringStore(key_strings)
+  s2v.freqs = dict(zip(hashes, map(int, freqs)))
+  if cache_depth > 0:
+    s2v.cache = topic_cache(vectors, lemma_topics[lemmas[order]], cache_depth)
+  return s2v
+
+
+@plac.annotations(
+    out_path=("Directory to write the model to", "positional", None, str),
+    keys=("Number of keys", "option", "k", int),
+    dims=("Vector dimensions", "option", "d", int),
+    sense_mix=("Share of each sense among the words, SENSE:weight,...", "option", "m", str),
+    case_variants=("Share of words with title (and some upper) cased variants", "option", "c", float),
+    multiword=("Share of multiword keys", "option", "w", float),
+    extra_senses=("Share of words with a second sense", "option", "e", float),
+    cache_depth=("Neighbours per key in the most_similar cache, 0 for no cache", "option", "n", int),
+    seed=("Random seed", "option", "S", int),
+)
+def main(out_path, keys=100000, dims=128, sense_mix=DEFAULT_SENSE_MIX, case_variants=0.2, multiword=0.15, extra_senses=0.3, cache_depth=20, seed=0):
+  msg.info("generating {0} keys of {1} dimensions".format(keys, dims))
+  start = time.perf_counter()
+  s2v = generate_s2v(keys, dims, sense_mix, case_variants, multiword, extra_senses, cache_depth, seed)
+  msg.good("generated", "{0} keys in {1:.2f}s".format(len(s2v), time.perf_counter() - start))
+  s2v.to_disk(out_path)
+  msg.good("saved model", out_path)
+
+if __name__ == "__main__":
+  try:
+    plac.call(main)
+  except KeyboardInterrupt:
+    msg.warn("Cancelled.")
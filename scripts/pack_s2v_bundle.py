@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+# packs a sense2vec model directory (vectors, keys, strings, frequencies, most_similar cache)
+# and its index files into a single versioned bundle that the server memory-maps at startup
+# with S2V_MODEL_BUNDLE, instead of deserializing the model into every process. the caseless
+# index and key table are built when the directory has no current ones, the partitions, the
+# neighbour table and the quantized vectors are packed when they have been built
+# (scripts/build_s2v_indexes.py, scripts/quantize_s2v.py). repack whenever any of them change.
+
+# cd sense2vec-rest
+# python -m scripts.pack_s2v_bundle /sense2vec-model
+# S2V_MODEL_BUNDLE=/sense2vec-model/model.s2vbundle python server.py
+
+
+import os
+import time
+import plac
+from wasabi import msg
+from sense2vec import Sense2Vec
+from s2v_bundle import S2vModelBundle, BUNDLE_FILENAME
+
+
+@plac.annotations(
+    model_path=("Path to sense2vec model directory", "positional", None, str),
+    out_path=("Path of the bundle to write, defaults to model.s2vbundle in the model directory", "option", "o", str),
+)
+def main(model_path, out_path=None):
+  out_path = out_path or os.path.join(model_path, BUNDLE_FILENAME)
+  msg.info("loading model from disk")
+  start = time.perf_counter()
+  s2v = Sense2Vec().from_disk(model_path)
+  msg.good("model loaded", "{0} keys in {1:.2f}s".format(len(s2v), time.perf_counter() - start))
+
+  indexes = S2vModelBundle.pack(s2v, out_path, model_path)
+  msg.good("saved bundle", "{0} ({1:.1f} MB)".format(out_path, os.path.getsize(out_path) / 1e6))
+  msg.text("indexes: {0}".format(', '.join(indexes.keys())))
+
+  start = time.perf_counter()
+  bundle = S2vModelBundle.open(out_path)
+  msg.good("bundle opened", "{0} keys in {1:.4f}s".format(len(bundle.s2v), time.perf_counter() - start))
+
+if __name__ == "__main__":
+  try:
+    plac.call(main)
+  except KeyboardInterrupt:
+    msg.warn("Cancelled.")
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# writes the model's unit normalised vectors as float16 or per row scaled int8 into the model
+# directory (quantized_vectors.s2vmmap), for the server to run similarity and synonym searches
+# on with S2V_QUANTIZED_VECTORS=1, and reports how far the quantized results drift from float32:
+# neighbour recall and score drift of synonym searches, score drift of similarity pairs, and the
+# memory and brute force scan time of both tables. partitions built before keep float32
+# vectors, rebuild them with scripts/build_s2v_indexes.py -p -q to scan the quantized ones.
+
+# cd sense2vec-rest
+# python -m scripts.quantize_s2v /sense2vec-model -d int8
+# python -m scripts.quantize_s2v /sense2vec-model -d float16 -s 2000 -r quantize_report.json
+
+
+import os
+import json
+import time
+import plac
+import numpy as np
+from wasabi import msg
+from sense2vec import Sense2Vec
+from s2v_vectors import S2vVectors
+from s2v_vector_search import S2vVectorSearch
+from s2v_quantized_vectors import S2vQuantizedVectors, QUANTIZED_VECTORS_FILENAME
+
+
+# random phrases of the model's keys, half single keys and half two key phrases
+def sample_phrases(keys, count, rng):
+  firsts = rng.integers(len(keys), size=count)
+  seconds = (firsts + rng.integers(1, max(len(keys), 2), size=count)) % len(keys)
+  return [[keys[a]] if i % 2 == 0 else [keys[a], keys[b]] for i, (a, b) in enumerate(zip(firsts, seconds))]
+
+
+def synonyms_report(search, quantized_search, phrases, n):
+  expected = search.most_similar_batch(phrases, n)
+  found = quantized_search.most_similar_batch(phrases, n)
+  recalls = []
+  top_matches = 0
+  drifts = []
+  rounded_changed = 0
+  for expected_result, result in zip(expected, found):
+    expected_scores = dict(expected_result)
+    recalls.append(len(set(k for k, _ in result) & set(expected_scores)) / max(len(expected_result), 1))
+    top_matches += bool(result) and bool(expected_result) and result[0][0] == expected_result[0][0]
+    for key, score in result:
+      if key in expected_scores:
+        drifts.append(abs(float(score) - float(expected_scores[key])))
+        rounded_changed += round(float(score), 3) != round(float(expected_scores[key]), 3)
+  return {
+    'phrases': len(phrases),
+    'n': n,
+    'mean_recall': round(float(np.mean(recalls)), 4),
+    'min_recall': round(float(np.min(recalls)), 4),
+    'top_1_agreement': round(top_matches / len(phrases), 4),
+    'mean_score_drift': float(np.mean(drifts)) if drifts else 0.0,
+    'max_score_drift': float(np.max(drifts)) if drifts else 0.0,
+    'rounded_scores_changed': round(rounded_changed / max(len(drifts), 1), 4),
+  }
+
+
+def similarity_report(s2v_vectors, quantized_vectors, phrases_a, phrases_b):
+  expected = np.diagonal(s2v_vectors.similarity_matrix(phrases_a, phrases_b))
+  found = np.diagonal(quantized_vectors.similarity_matrix(phrases_a, phrases_b))
+  drifts = np.abs(found.astype(np.float64) - expected)
+  return {
+    'pairs': len(phrases_a),
+    'mean_score_drift': float(drifts.mean()),
+    'max_score_drift': float(drifts.max()),
+    'rounded_scores_changed': round(float(np.mean(np.round(found, 3) != np.round(expected, 3))), 4),
+  }
+
+
+def scan_seconds(search, queries, n, repeats=3):
+  best = None
+  for _ in range(repeats):
+    start = time.perf_counter()
+    search.search(queries, n)
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+@plac.annotations(
+    model_path=("Path to sense2vec model directory", "positional", None, str),
+    dtype=("Quantized type, float16 or int8", "option", "d", str),
+    out_dir=("Directory to write the quantized vectors to, defaults to the model directory", "option", "o", str),
+    sample=("Number of phrases compared in the accuracy report", "option", "s", int),
+    n=("Number of synonyms per phrase compared in the accuracy report", "option", "n", int),
+    scan_queries=("Number of queries in the timed full table scans", "option", "q", int),
+    seed=("Random seed of the sampled phrases", "option", "S", int),
+    report=("Write the accuracy report as json to this path", "option", "r", str),
+)
+def main(model_path, dtype='int8', out_dir=None, sample=1000, n=10, scan_queries=64, seed=0, report=None):
+  out_dir = out_dir or model_path
+  msg.info("loading model from disk")
+  s2v = Sense2Vec().from_disk(model_path)
+  msg.good("model loaded", "{0} keys".format(len(s2v)))
+
+  s2v_vectors = S2vVectors(s2v)
+  quantized = S2vQuantizedVectors.build(s2v_vectors, dtype)
+  quantized_path = os.path.join(out_dir, QUANTIZED_VECTORS_FILENAME)
+  quantized.save(quantized_path)
+  msg.good("saved {0} vectors".format(dtype), quantized_path)
+
+  msg.info("comparing {0} results to float32".format(dtype))
+  quantized_vectors = S2vVectors(s2v, quantized=quantized)
+  search = S2vVectorSearch(s2v_vectors)
+  quantized_search = S2vVectorSearch(quantized_vectors)
+  rng = np.random.default_rng(seed)
+  keys = list(s2v.keys())
+  phrases = sample_phrases(keys, sample, rng)
+  queries = search.row_vectors(search.rows[rng.choice(len(search.rows), size=min(scan_queries, len(search.rows)), replace=False)])
+  result = {
+    'dtype': dtype,
+    'keys': len(keys),
+    'memory': {
+      'float32_bytes': int(s2v_vectors.unit.nbytes),
+      'quantized_bytes': int(quantized.nbytes()),
+      'ratio': round(s2v_vectors.unit.nbytes / quantized.nbytes(), 2),
+    },
+    'synonyms': synonyms_report(search, quantized_search, phrases, n),
+    'similarity': similarity_report(s2v_vectors, quantized_vectors, phrases, sample_phrases(keys, sample, rng)),
+    'scan': {
+      'queries': len(queries),
+      'float32_seconds': scan_seconds(search, queries, n),
+      'quantized_seconds': scan_seconds(quantized_search, queries, n),
+    },
+  }
+
+  msg.table([(k, v) for k, v in result['memory'].items()], title="memory")
+  msg.table([(k, v) for k, v in result['synonyms'].items()], title="synonyms")
+  msg.table([(k, v) for k, v in result['similarity'].items()], title="similarity")
+  msg.table([(k, v) for k, v in result['scan'].items()], title="full table scan")
+  if report:
+    with open(report, 'w') as f:
+      json.dump(result, f, indent=2)
+    msg.good("wrote report", report)
+
+if __name__ == "__main__":
+  try:
+    plac.call(main)
+  except KeyboardInterrupt:
+    msg.warn("Cancelled.")
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+
+# replays recorded requests against the app at a given concurrency and reports throughput,
+# latency percentiles (overall and per endpoint), error rate and the peak RSS of the serving
+# processes, to size workers / threads and to catch regressions before deploying.
+#
+# requests are read from a jsonl file, one request per line:
+#   {"path": "/", "args": {"n": 10, "reduce-multicase": 1}, "body": [["plastic|NOUN"]]}
+#   {"path": "/similarity", "body": [[["plastic|NOUN"], ["bottle|NOUN"]]]}
+#
+# with -m test-client the app from server.py is loaded in this process (configured by the usual
+# S2V_* environment variables) and called through the flask test client from -c threads. with
+# -m gunicorn a local gunicorn is started the way the Dockerfile starts it (see gunicorn.conf.py)
+# and sent -c concurrent http requests. the peak RSS is sampled from /proc (linux only), in
+# gunicorn mode it sums the master and its workers.
+
+# cd sense2vec-rest
+# S2V_MODEL_PATH=/sense2vec-model python -m scripts.replay_s2v_load requests.jsonl -c 8
+# python -m scripts.replay_s2v_load requests.jsonl -m gunicorn -M /sense2vec-model -w 2 -t 4 -c 16 -r 5
+# python -m scripts.replay_s2v_load requests.jsonl -m gunicorn -M /sense2vec-model -o load_report.json
+
+
+import os
+import sys
+import json
+import time
+import signal
+import subprocess
+import threading
+import urllib.parse
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+import plac
+import numpy as np
+from wasabi import msg
+from scripts.benchmark_worker_memory import free_port, child_pids, wait_until_serving
+
+MODES = ['test-client', 'gunicorn']
+RSS_SAMPLE_SECONDS = 0.1
+
+
+def read_requests(path):
+  requests = []
+  with open(path) as f:
+    for line in f:
+      if line.strip():
+        r = json.loads(line)
+        requests.append((r.get('path', '/'), r.get('args') or {}, json.dumps(r['body']).encode('utf-8')))
+  return requests
+
+
+def rss_kb(pid):
+  try:
+    with open('/proc/{0}/status'.format(pid)) as f:
+      for line in f:
+        if line.startswith('VmRSS:'):
+          return int(line.split()[1])
+  except OSError:
+    pass
+  return 0
+
+
+# samples the summed RSS of pids() every RSS_SAMPLE_SECONDS until stopped, keeping the peak
+class RssMonitor(threading.Thread):
+
+  def __init__(self, pids):
+    super().__init__(daemon=True)
+    self.pids = pids
+    self.peak_kb = 0
+    self.stopped = threading.Event()
+
+
+  def sample(self):
+    self.peak_kb = max(self.peak_kb, sum(map(rss_kb, self.pids())))
+
+
+  def run(self):
+    while not self.stopped.is_set():
+      self.sample()
+      self.stopped.wait(RSS_SAMPLE_SECONDS)
+
+
+  def stop(self):
+    self.stopped.set()
+    self.join()
+    self.sample()
+
+
+# send(request) for requests through the flask test client, one client per thread, once the
+# app has finished its warmup
+def test_client_sender():
+  from server import app, warmup
+  warmup.ready.wait()
+  local = threading.local()
+
+  def send(request):
+    path, args, body = request
+    if not hasattr(local, 'client'):
+      local.client = app.test_client()
+    return local.client.post(path, query_string=args, data=body).status_code
+
+  return send
+
+
+def http_sender(url, timeout):
+  def send(request):
+    path, args, body = request
+    query = '?' + urllib.parse.urlencode(args) if args else ''
+    try:
+      # a json content type, urllib's default form one would have flask parse the body as a form
+      http_request = urllib.request.Request(url + path + query, data=body, method='POST', headers={ 'Content-Type': 'application/json' })
+      with urllib.request.urlopen(http_request, timeout=timeout) as response:
+        response.read()
+        return response.status
+    except urllib.error.HTTPError as e:
+      return e.code
+
+  return send
+
+
+def start_gunicorn(model_path, workers, threads, timeout):
+  port = free_port()
+  env = dict(os.environ, GUNICORN_WORKERS=str(workers), GUNICORN_THREADS=str(threads))
+  if model_path:
+    env['S2V_MODEL_PATH'] = model_path
+  app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  process = subprocess.Popen([
+    sys.executable, '-m', 'gunicorn',
+    '--bind', '127.0.0.1:{0}'.format(port),
+    '--timeout', str(timeout),
+    'wsgi:app',
+  ], cwd=app_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+  url = 'http://127.0.0.1:{0}'.format(port)
+  try:
+    wait_until_serving(url, process, timeout)
+    deadline = time.time() + timeout
+    while len(child_pids(process.pid)) < workers and time.time() < deadline:
+      time.sleep(0.5)
+  except Exception:
+    stop_gunicorn(process)
+    raise
+  return process, url
+
+
+def stop_gunicorn(process):
+  process.send_signal(signal.SIGTERM)
+  try:
+    process.wait(30)
+  except subprocess.TimeoutExpired:
+    process.kill()
+
+
+# sends every request from concurrency threads, returns (path, status, seconds) per request
+# (status None when sending raised) and the wall clock seconds of the whole replay
+def replay(send, requests, concurrency):
+  def timed_send(request):
+    start = time.perf_counter()
+    try:
+      status = send(request)
+    except Exception:
+      status = None
+    return request[0], status, time.perf_counter() - start
+
+  start = time.perf_counter()
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    results = list(executor.map(timed_send, requests))
+  return results, time.perf_counter() - start
+
+
+def latency_summary(seconds):
+  ms = np.asarray(seconds) * 1000
+  return {
+    'mean_ms': round(float(ms.mean()), 3),
+    'p50_ms': round(float(np.percentile(ms, 50)), 3),
+    'p95_ms': round(float(np.percentile(ms, 95)), 3),
+    'p99_ms': round(float(np.percentile(ms, 99)), 3),
+    'max_ms': round(float(ms.max()), 3),
+  }
+
+
+def summarize(results, elapsed):
+  errors = sum(1 for _, status, _ in results if status is None or status >= 400)
+  statuses = {}
+  for _, status, _ in results:
+    statuses[str(status)] = statuses.get(str(status), 0) + 1
+  endpoints = {}
+  for path in sorted(set(r[0] for r in results)):
+    endpoint_results = [r for r in results if r[0] == path]
+    endpoints[path] = dict(latency_summary([r[2] for r in endpoint_results]), requests=len(endpoint_results))
+  return {
+    'requests': len(results),
+    'seconds': round(elapsed, 3),
+    'throughput_rps': round(len(results) / elapsed, 2) if elapsed > 0 else None,
+    'errors': errors,
+    'error_rate': round(errors / max(len(results), 1), 4),
+    'statuses': statuses,
+    'latency': latency_summary([r[2] for r in results]),
+    'endpoints': endpoints,
+  }
+
+
+@plac.annotations(
+    requests_path=("Path to the jsonl file of requests to replay", "positional", None, str),
+    mode=("Where to send the requests, test-client (in process) or gunicorn", "option", "m", str, MODES),
+    concurrency=("Number of requests in flight at once", "option", "c", int),
+    repeat=("Times to replay the requests", "option", "r", int),
+    warmup=("Requests sent (and left out of the report) before the replay", "option", "W", int),
+    model_path=("Model directory, sets S2V_MODEL_PATH for the app", "option", "M", str),
+    workers=("Number of gunicorn workers (gunicorn mode)", "option", "w", int),
+    threads=("Threads per gunicorn worker (gunicorn mode)", "option", "t", int),
+    timeout=("Seconds to wait for the server to start and for each request", "option", "s", int),
+    output=("Path to write the report to as json", "option", "o", str),
+)
+def main(requests_path, mode='test-client', concurrency=4, repeat=1, warmup=0, model_path=None, workers=1, threads=4, timeout=600, output=None):
+  requests = read_requests(requests_path)
+  if not requests:
+    msg.fail("no requests in {0}".format(requests_path), exits=1)
+  msg.info("replaying {0} requests x {1} at concurrency {2} ({3})".format(len(requests), repeat, concurrency, mode))
+
+  process = None
+  if mode == 'gunicorn':
+    process, url = start_gunicorn(model_path, workers, threads, timeout)
+    send = http_sender(url, timeout)
+    pids = lambda: [process.pid] + child_pids(process.pid)
+    msg.good("serving", "{0} ({1} workers, {2} threads)".format(url, workers, threads))
+  else:
+    if model_path:
+      os.environ['S2V_MODEL_PATH'] = model_path
+    send = test_client_sender()
+    pids = lambda: [os.getpid()]
+  try:
+    if warmup:
+      replay(send, (requests * (warmup // len(requests) + 1))[:warmup], concurrency)
+    monitor = RssMonitor(pids)
+    monitor.start()
+    results, elapsed = replay(send, requests * repeat, concurrency)
+    monitor.stop()
+  finally:
+    if process is not None:
+      stop_gunicorn(process)
+
+  report = dict(
+    summarize(results, elapsed),
+    mode=mode,
+    concurrency=concurrency,
+    workers=workers if mode == 'gunicorn' else None,
+    threads=threads if mode == 'gunicorn' else None,
+    peak_rss_mb=round(monitor.peak_kb / 1024, 1),
+    requests_path=requests_path,
+  )
+  latency = report['latency']
+  msg.table([
+    ('requests', report['requests']),
+    ('throughput (req/s)', report['throughput_rps']),
+    ('error rate', report['error_rate']),
+    ('p50 / p95 / p99 ms', '{0} / {1} / {2}'.format(latency['p50_ms'], latency['p95_ms'], latency['p99_ms'])),
+    ('max ms', latency['max_ms']),
+    ('peak rss MB', report['peak_rss_mb']),
+  ], title="replay")
+  msg.table(
+    [(path, e['requests'], e['mean_ms'], e['p50_ms'], e['p95_ms'], e['p99_ms']) for path, e in report['endpoints'].items()],
+    header=('endpoint', 'requests', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms'),
+    divider=True,
+  )
+  if report['errors']:
+    msg.warn("{0} requests failed, statuses {1}".format(report['errors'], report['statuses']))
+  if output:
+    with open(output, 'w') as f:
+      json.dump(report, f, indent=2)
+    msg.good("saved report", output)
+
+if __name__ == "__main__":
+  try:
+    plac.call(main)
+  except KeyboardInterrupt:
+    msg.warn("Cancelled.")
@@ -1,91 +1,258 @@
 #!/usr/bin/python3
 
 import os
-from flask import Flask, request, Response
+from time import perf_counter
+from flask import Flask, request, Response, g
 import json
-import datetime
-from sense2vec import Sense2Vec
-from s2v_util import S2vUtil
+from urllib.parse import parse_qsl
+from s2v_model import load_s2v
+from s2v_bundle import S2vModelBundle
+from s2v_util import S2vUtil, s2v_model_fingerprint
 from s2v_senses import S2vSenses
+from s2v_caseless_index import S2vCaselessIndex
+from s2v_key_table import S2vKeyTable
+from s2v_sense_buckets import S2vSenseBuckets
 from s2v_key_case_and_sense_variations import S2vKeyCaseAndSenseVariations
+from s2v_cache import S2vLruCache
+from s2v_singleflight import S2vSingleflight
+from s2v_metrics import S2vMetrics, cache_collector, singleflight_collector
+from s2v_trace import S2vTrace, tracing
+from s2v_warmup import S2vWarmup
 from s2v_key_commonizer import S2vKeyCommonizer
 from s2v_similarity import S2vSimilarity
 from s2v_synonyms import S2vSynonyms
+from s2v_vectors import S2vVectors
+from s2v_quantized_vectors import S2vQuantizedVectors
+from s2v_vector_search import S2vVectorSearch
+from s2v_neighbour_table import S2vNeighbourTable
+from s2v_partitions import S2vPartitions
 
 app = Flask(__name__)
+# the number of items of a request that were identical to an earlier item and not recomputed
+DEDUP_HEADER = 'X-S2v-Deduplicated-Items'
+# with S2V_VERBOSE every request is traced (see s2v_trace) and its trace printed to the log
+trace_all_requests = bool(os.getenv('S2V_VERBOSE'))
 port = 80 if os.getuid() == 0 else 8000
+model_path = os.getenv('S2V_MODEL_PATH', "/sense2vec-model")
 
 print("loading model from disk..")
-s2v = Sense2Vec().from_disk("/sense2vec-model")
+# with S2V_MODEL_BUNDLE (a file written by scripts/pack_s2v_bundle.py) the model and its
+# indexes are memory-mapped from that one file, indexes it doesn't hold are still looked
+# up in model_path. with S2V_MMAP_VECTORS the vectors table is memory-mapped instead of read
+# into each worker, see gunicorn.conf.py for sharing the rest of the loaded model between workers
+s2v_bundle = S2vModelBundle.open(os.getenv('S2V_MODEL_BUNDLE')) if os.getenv('S2V_MODEL_BUNDLE') else None
+if s2v_bundle:
+  s2v = s2v_bundle.s2v
+  s2v_fingerprint = s2v_bundle.fingerprint
+else:
+  s2v = load_s2v(model_path, mmap=bool(os.getenv('S2V_MMAP_VECTORS')))
+  s2v_fingerprint = s2v_model_fingerprint(s2v)
 print("model loaded.")
+
+
+def bundled(name):
+  return s2v_bundle.index(name) if s2v_bundle else None
+
+
+# with S2V_METRICS_DIR (set by gunicorn.conf.py) /metrics sums the metrics of every worker
+metrics = S2vMetrics(multiprocess_dir=os.getenv('S2V_METRICS_DIR'))
 s2v_util = S2vUtil(s2v)
-s2v_senses = S2vSenses(s2v_util)
-s2v_key_variations = S2vKeyCaseAndSenseVariations(s2v_util, s2v_senses)
+s2v_caseless_index = bundled('caseless_index') or S2vCaselessIndex.load_or_build(s2v, model_path, s2v_fingerprint)
+s2v_key_table = bundled('key_table') or S2vKeyTable.load_or_build(s2v_util, model_path, s2v_fingerprint)
+s2v_senses = S2vSenses(s2v_util, s2v_caseless_index, metrics=metrics)
+s2v_sense_buckets = S2vSenseBuckets(
+  s2v_caseless_index,
+  seed=os.getenv('S2V_RANDOM_SEED') and int(os.getenv('S2V_RANDOM_SEED')),
+  deterministic=bool(os.getenv('S2V_DETERMINISTIC_SAMPLING')),
+)
+s2v_key_variations = S2vKeyCaseAndSenseVariations(
+  s2v_util,
+  s2v_senses,
+  s2v_sense_buckets,
+  memo_cache=S2vLruCache(int(os.getenv('S2V_VARIATIONS_CACHE_SIZE', 20000))),
+)
 s2v_key_commonizer = S2vKeyCommonizer()
-similarity_service = S2vSimilarity(s2v_util, s2v_key_variations, s2v_key_commonizer)
-synonyms_service = S2vSynonyms(s2v_util, s2v_key_variations, s2v_key_commonizer)
+# with S2V_NORMALIZE_VECTORS_IN_PLACE the vectors table is normalised in place rather than
+# copied, halving its memory (not possible with S2V_MMAP_VECTORS, whose table is read only).
+# with S2V_QUANTIZED_VECTORS similarity and search run on the float16 / int8 vectors written by
+# scripts/quantize_s2v.py instead of a float32 copy
+s2v_quantized_vectors = (bundled('quantized_vectors') or S2vQuantizedVectors.load_if_exists(s2v, model_path, s2v_fingerprint)) \
+  if os.getenv('S2V_QUANTIZED_VECTORS') else None
+s2v_vectors = S2vVectors(
+  s2v,
+  normalize_in_place=bool(os.getenv('S2V_NORMALIZE_VECTORS_IN_PLACE')),
+  phrase_cache=S2vLruCache(int(os.getenv('S2V_PHRASE_VECTOR_CACHE_SIZE', 10000))),
+  quantized=s2v_quantized_vectors,
+  normalized=s2v_bundle,
+)
+allow_non_cached_keys = bool(os.getenv('S2V_ALLOW_NON_CACHED_KEYS'))
+s2v_partitions = bundled('partitions') or S2vPartitions.load_if_exists(s2v, model_path, s2v_fingerprint)
+s2v_vector_search = S2vVectorSearch(s2v_vectors, s2v_partitions=s2v_partitions) if allow_non_cached_keys or s2v_partitions else None
+s2v_neighbour_table = bundled('neighbour_table') or S2vNeighbourTable.load_if_exists(s2v, model_path, s2v_fingerprint)
+result_cache_size = int(os.getenv('S2V_RESULT_CACHE_SIZE', 10000))
+result_cache_ttl = int(os.getenv('S2V_RESULT_CACHE_TTL', 3600))
+# seconds a request waits on a concurrent identical computation before computing it itself
+singleflight_timeout = float(os.getenv('S2V_SINGLEFLIGHT_TIMEOUT', 60))
+similarity_service = S2vSimilarity(
+  s2v_util,
+  s2v_key_variations,
+  s2v_key_commonizer,
+  s2v_vectors,
+  result_cache=S2vLruCache(result_cache_size, result_cache_ttl),
+  singleflight=S2vSingleflight(singleflight_timeout),
+  metrics=metrics,
+)
+synonyms_service = S2vSynonyms(
+  s2v_util,
+  s2v_key_variations,
+  s2v_key_commonizer,
+  allow_non_cached_keys=allow_non_cached_keys,
+  s2v_vector_search=s2v_vector_search,
+  s2v_neighbour_table=s2v_neighbour_table,
+  result_cache=S2vLruCache(result_cache_size, result_cache_ttl),
+  s2v_key_table=s2v_key_table,
+  singleflight=S2vSingleflight(singleflight_timeout),
+  metrics=metrics,
+)
+metrics.add_collector(cache_collector({
+  'synonyms_results': synonyms_service.result_cache,
+  'similarity_results': similarity_service.result_cache,
+  'variations': s2v_key_variations.memo_cache,
+  'phrase_vectors': s2v_vectors.phrase_cache,
+}))
+metrics.add_collector(singleflight_collector({
+  'synonyms': synonyms_service.singleflight,
+  'similarity': similarity_service.singleflight,
+}))
+# /readyz answers 503 until the synonyms of the S2V_WARMUP_KEYS most frequent keys have been
+# looked up (with the request args in the S2V_WARMUP_ARGS query string, to match the args the
+# clients send), 0 to be ready at once. the warmup runs in the background, with
+# S2V_WARMUP_BEFORE_SERVING (set by gunicorn.conf.py) it runs here before the app is served,
+# with the metrics paused so they only count what is served
+warmup = S2vWarmup(
+  s2v_key_table,
+  synonyms_service,
+  s2v_vectors,
+  top_n=int(os.getenv('S2V_WARMUP_KEYS', 1000)),
+  req_args=dict(parse_qsl(os.getenv('S2V_WARMUP_ARGS', ''))),
+)
+if os.getenv('S2V_WARMUP_BEFORE_SERVING'):
+  with metrics.paused():
+    warmup.run()
+else:
+  warmup.start()
+
+
+@app.before_request
+def start_timer():
+  g.start = perf_counter()
+
+
+@app.after_request
+def record_request(response):
+  endpoint = request.endpoint or 'unknown'
+  if 'start' in g:
+    metrics.observe('s2v_request_duration_seconds', perf_counter() - g.start, endpoint=endpoint)
+  metrics.inc('s2v_requests_total', endpoint=endpoint, status=response.status_code)
+  metrics.flush_collectors()
+  return response
+
+
+def record_items(endpoint, dedup_stats):
+  metrics.inc('s2v_request_items_total', dedup_stats['items'], endpoint=endpoint)
+  metrics.inc('s2v_request_deduplicated_items_total', dedup_stats['deduplicated'], endpoint=endpoint)
+
+
+# a trace for requests sent with ?trace=1 (or every request with S2V_VERBOSE), None otherwise
+def request_trace():
+  if trace_all_requests or request.args.get('trace'):
+    return S2vTrace()
+  return None
+
+
+# the results of a request as a json response, with ?trace=1 the response is
+# { "results": results, "trace": the request's trace } instead
+def results_response(endpoint, data, results, dedup_stats, trace):
+  if trace is not None:
+    trace = trace.to_dict()
+    if trace_all_requests:
+      print(json.dumps({ 'endpoint': endpoint, 'request_body': data, 'trace': trace }))
+    if request.args.get('trace'):
+      results = { 'results': results, 'trace': trace }
+  with metrics.stage('server', 'json_encode'):
+    response = json.dumps(results)
+  return Response(
+      status=200,
+      response=response,
+      content_type="application/json",
+      headers={ DEDUP_HEADER: str(dedup_stats['deduplicated']) },
+  )
 
 
 @app.route('/', methods=['POST', 'GET'])
 def index():
-  start = datetime.datetime.utcnow()
   data = request.data.decode('utf-8')
   if not data:
     return Response(status=500, response="no data")
 
-  if os.getenv('S2V_VERBOSE'):
-    print("request body: '%s'" % data)
   parsed = json.loads(data)
 
-  results = []
-  for item in parsed:
-    result = synonyms_service.call(item, request.args)
-    results.append(result)
-
-  fin = datetime.datetime.utcnow()
-  print(fin - start, 'req time')
-  # print('result ', result)
+  dedup_stats = {}
+  trace = request_trace()
+  with tracing(trace):
+    results = synonyms_service.call_batch(parsed, request.args, dedup_stats)
+  record_items('index', dedup_stats)
 
-  return Response(
-      status=200, response=json.dumps(results), content_type="application/json")
+  return results_response('index', data, results, dedup_stats, trace)
 
 
 @app.route('/similarity', methods=['POST', 'GET'])
 def similarity():
-  start = datetime.datetime.utcnow()
   data = request.data.decode('utf-8')
   if not data:
     print('no data in request body!')
     return Response(status=500, response="no data")
 
-  if os.getenv('S2V_VERBOSE'):
-    print("request body: '%s'" % data)
   parsed = json.loads(data)
 
-  results = []
-  for item in parsed:
-    result = similarity_service.call(item[0], item[1], request.args)
-    results.append(result)
+  dedup_stats = {}
+  trace = request_trace()
+  with tracing(trace):
+    results = similarity_service.call_batch(parsed, request.args, dedup_stats)
+  record_items('similarity', dedup_stats)
 
-  fin = datetime.datetime.utcnow()
-  print(fin - start, 'req time')
-  # print('result ', result)
+  return results_response('similarity', data, results, dedup_stats, trace)
+
+
+# liveness, answered without touching the model
+@app.route('/livez', methods=['GET'])
+def livez():
+  return Response(status=200, response="ok")
 
-  return Response(
-      status=200, response=json.dumps(results), content_type="application/json")
 
+# readiness, 200 once this process has finished its warmup and 503 until then
+@app.route('/readyz', methods=['GET'])
+def readyz():
+  status = warmup.status()
+  return Response(status=200 if status['ready'] else 503, response=json.dumps(status), content_type="application/json")
 
+
+# a full synonyms lookup, prefer /livez and /readyz for probes
 @app.route('/healthcheck', methods=['GET'])
 def healthcheck():
   parsed = json.loads("[[\"plastic|NOUN\"]]")
 
-  results = []
-  for item in parsed:
-    result = synonyms_service.call(item, request.args)
-    results.append(result)
+  results = synonyms_service.call_batch(parsed, request.args)
 
   return Response(
       status=200, response=json.dumps(results), content_type="application/json")
 
+
+# request latency per endpoint and per internal stage, request and item counts, and the cache
+# and singleflight counters in the prometheus text format
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+  return Response(status=200, response=metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 if __name__ == '__main__':
   app.run(port=port, host="0.0.0.0")